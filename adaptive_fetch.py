@@ -0,0 +1,166 @@
+import os
+import time
+import asyncio
+from urllib.parse import urlparse
+
+# --- DESCARGA ADAPTATIVA (AIMD POR HOST) ---
+# Sustituye los lotes fijos (gather de 5/10 + sleep) donde cada lote esperaba a su página
+# más lenta. Ahora hay un pool de workers sin barreras y un límite de concurrencia por host
+# que se ajusta solo (como TCP):
+# - Aumento aditivo: tras cada "ventana" (tantas páginas como el límite actual) sin errores,
+#   si el throughput no bajó, el límite sube en 1.
+# - Reducción multiplicativa: un 429/503 o timeout parte el límite a la mitad y pausa el
+#   host (Retry-After si lo hay). La página se reintenta más tarde.
+# Los límites viven por host y se comparten entre trabajos: dos mangas del mismo CDN no lo
+# castigan el doble.
+
+FETCH_START = int(os.environ.get("MANGA_CONC_START", 4))
+FETCH_MIN = int(os.environ.get("MANGA_CONC_MIN", 1))
+FETCH_MAX_PER_HOST = int(os.environ.get("MANGA_CONC_MAX_HOST", 16))
+FETCH_MAX_WORKERS = int(os.environ.get("MANGA_MAX_WORKERS", 32))
+FETCH_MAX_ATTEMPTS = 5
+
+
+class Backoff(Exception):
+    """El servidor pide frenar (429/503) o no respondió a tiempo."""
+
+    def __init__(self, reason, retry_after=None):
+        super().__init__(reason)
+        self.retry_after = retry_after
+
+
+def retry_after_of(resp):
+    try: return float(resp.headers.get('Retry-After'))
+    except (TypeError, ValueError): return None
+
+
+class AIMDLimiter:
+    def __init__(self, start=FETCH_START, min_limit=FETCH_MIN, max_limit=FETCH_MAX_PER_HOST):
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = min(max(start, self.min_limit), self.max_limit)
+        self.active = 0
+        self._cond = asyncio.Condition()
+        self._paused_until = 0.0
+        self._last_cut = 0.0
+        self._reset_window()
+        self._last_rate = 0.0
+
+    def _reset_window(self):
+        self._win_bytes = 0
+        self._win_count = 0
+        self._win_t0 = time.monotonic()
+
+    async def acquire(self):
+        async with self._cond:
+            while self.active >= self.limit:
+                await self._cond.wait()
+            self.active += 1
+        delay = self._paused_until - time.monotonic()
+        if delay > 0: await asyncio.sleep(delay)
+
+    async def release(self):
+        async with self._cond:
+            self.active -= 1
+            self._cond.notify_all()
+
+    def success(self, nbytes):
+        self._win_bytes += nbytes
+        self._win_count += 1
+        if self._win_count < self.limit: return
+        elapsed = max(time.monotonic() - self._win_t0, 1e-3)
+        rate = self._win_bytes / elapsed
+        # Subir solo si más conexiones siguen dando más (o igual) throughput
+        if rate >= self._last_rate * 0.9 and self.limit < self.max_limit:
+            self.limit += 1
+        self._last_rate = rate
+        self._reset_window()
+
+    def congestion(self, retry_after=None):
+        now = time.monotonic()
+        # Varias peticiones en vuelo fallan a la vez por la misma causa: un solo recorte por segundo
+        if now - self._last_cut > 1.0:
+            self.limit = max(self.min_limit, self.limit // 2)
+            self._last_cut = now
+            self._last_rate = 0.0
+            self._reset_window()
+        self._paused_until = max(self._paused_until, now + (retry_after if retry_after else 1.0))
+
+
+class HostLimiters:
+    def __init__(self):
+        self._hosts = {}
+
+    def get(self, url):
+        host = urlparse(url).hostname or ''
+        lim = self._hosts.get(host)
+        if lim is None:
+            lim = self._hosts[host] = AIMDLimiter()
+        return lim
+
+    def stats(self):
+        return {h: l.limit for h, l in self._hosts.items()}
+
+
+# Límites compartidos por todo el proceso
+hosts = HostLimiters()
+
+
+async def download_all(items, fetch, on_ready=None, max_workers=FETCH_MAX_WORKERS):
+    """
+    items: lista de (url, path). fetch(url, path) -> True/False, o lanza Backoff.
+    on_ready((url, path), ok): corrutina opcional llamada EN ORDEN de items a medida que el
+    prefijo se completa (para alimentar PDF/ZIP en orden sin esperar al final).
+    Retorna la lista de resultados (True/False) en orden.
+    """
+    total = len(items)
+    results = [None] * total
+    if not total: return results
+
+    queue = asyncio.Queue()
+    for i, (url, path) in enumerate(items):
+        queue.put_nowait((i, url, path, 0))
+
+    emit_lock = asyncio.Lock()
+    next_ready = 0
+
+    async def emit():
+        nonlocal next_ready
+        async with emit_lock:
+            while next_ready < total and results[next_ready] is not None:
+                if on_ready:
+                    try: await on_ready(items[next_ready], results[next_ready])
+                    except Exception as e: print(f"⚠️ [Fetch] on_ready error: {e}")
+                next_ready += 1
+
+    async def worker():
+        while True:
+            try: i, url, path, attempt = queue.get_nowait()
+            except asyncio.QueueEmpty: return
+            lim = hosts.get(url)
+            await lim.acquire()
+            try:
+                ok = await fetch(url, path)
+                if ok:
+                    try: lim.success(os.path.getsize(path))
+                    except OSError: lim.success(0)
+            except Backoff as b:
+                lim.congestion(b.retry_after)
+                if attempt + 1 < FETCH_MAX_ATTEMPTS:
+                    queue.put_nowait((i, url, path, attempt + 1))
+                    continue
+                print(f"⚠️ [Fetch] Abandonada tras {FETCH_MAX_ATTEMPTS} intentos: {url} ({b})")
+                ok = False
+            finally:
+                await lim.release()
+            results[i] = bool(ok)
+            await emit()
+
+    workers = [asyncio.create_task(worker()) for _ in range(min(total, max(1, max_workers)))]
+    try:
+        await asyncio.gather(*workers)
+    except BaseException:
+        for w in workers: w.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        raise
+    return results
@@ -0,0 +1,163 @@
+import os
+import time
+import asyncio
+from pyrogram.types import InputMediaPhoto, InputMediaDocument
+from pyrogram.errors import FloodWait
+
+# --- ENVÍO INCREMENTAL DE ÁLBUMES ---
+# El modo 'img' esperaba a que se descargaran y convirtieran TODAS las páginas y luego
+# mandaba grupos de 10 con un sleep(2) fijo entre cada uno. Aquí cada grupo completo sale
+# en cuanto sus páginas están listas (en orden), mientras las siguientes siguen bajando.
+# El ritmo lo marca un token bucket por chat en vez de sleeps fijos: ráfaga corta al inicio
+# (el usuario ve las primeras páginas en segundos) y luego el ritmo sostenido que Telegram
+# tolera. Un FloodWait vacía el bucket durante el tiempo pedido y el grupo se reintenta.
+# El bucket es compartido por todos los envíos al mismo chat (dos descargas a la vez no
+# duplican el ritmo). Los grupos que no salen tras SEND_RETRIES quedan en `failed`.
+
+ALBUM_SIZE = 10                                            # Máximo de Telegram por media group
+ALBUM_RATE = float(os.environ.get("ALBUM_RATE", 0.5))      # álbumes/seg sostenidos por chat
+ALBUM_BURST = int(os.environ.get("ALBUM_BURST", 3))        # álbumes seguidos sin esperar
+SINGLE_RATE = float(os.environ.get("SINGLE_RATE", 3))      # envíos 1 a 1 por seg
+SINGLE_BURST = int(os.environ.get("SINGLE_BURST", 5))
+SEND_RETRIES = 3
+
+
+class TokenBucket:
+    """`rate` tokens por segundo, hasta `capacity` acumulados. take() espera si no hay."""
+
+    def __init__(self, rate, capacity):
+        self.rate = max(rate, 1e-3)
+        self.capacity = max(1, capacity)
+        self._tokens = float(self.capacity)
+        self._stamp = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._stamp) * self.rate)
+        self._stamp = now
+
+    async def take(self, cost=1):
+        async with self._lock:
+            while True:
+                self._refill()
+                if self._tokens >= cost:
+                    self._tokens -= cost
+                    return
+                await asyncio.sleep((cost - self._tokens) / self.rate)
+
+    def penalize(self, seconds):
+        """FloodWait: sin tokens hasta dentro de `seconds` (el refill arranca después)."""
+        self._tokens = 0.0
+        self._stamp = max(self._stamp, time.monotonic() + seconds)
+
+
+_buckets = {}   # {(chat_id, group_mode): TokenBucket}
+
+
+def bucket_for(chat_id, group_mode=True):
+    """Token bucket del chat (uno para álbumes y otro para envíos 1 a 1)."""
+    key = (chat_id, bool(group_mode))
+    bucket = _buckets.get(key)
+    if bucket is None:
+        if group_mode: bucket = TokenBucket(ALBUM_RATE, ALBUM_BURST)
+        else: bucket = TokenBucket(SINGLE_RATE, SINGLE_BURST)
+        _buckets[key] = bucket
+    return bucket
+
+
+def _file_id_of(msg):
+    if not msg: return None
+    if msg.photo: return msg.photo.file_id
+    if msg.document: return msg.document.file_id
+    return None
+
+
+class AlbumSender:
+    """
+    Recibe páginas en orden con feed() y las envía en grupos de 10 (o 1 a 1) en segundo plano.
+    prepare(lista_rutas) es una corrutina opcional que se aplica a cada grupo antes de
+    enviarlo (p.ej. convertir WebP -> JPG) y retorna las rutas finales.
+    También acepta file_ids (reenvío desde cache).
+
+        s = AlbumSender(client, chat_id).start()
+        await s.feed(page) ...
+        ids = await s.finish()   # file_ids enviados, en orden
+        s.failed                 # páginas que no se pudieron enviar (0 si todo salió)
+    """
+
+    def __init__(self, client, chat_id, doc_mode=False, group_mode=True, prepare=None, max_pending=3):
+        self.client = client
+        self.chat_id = chat_id
+        self.doc_mode = doc_mode
+        self.group_mode = group_mode
+        self.prepare = prepare
+        self.group_size = ALBUM_SIZE if group_mode else 1
+        self.bucket = bucket_for(chat_id, group_mode)
+        self.file_ids = []
+        self.sent = 0
+        self.failed = 0
+        self._pending = []
+        self._queue = asyncio.Queue(max_pending)
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._consume())
+        return self
+
+    async def feed(self, item):
+        if self._task.done():
+            await self._task  # Propaga el error del consumidor
+        self._pending.append(item)
+        if len(self._pending) >= self.group_size:
+            group, self._pending = self._pending, []
+            await self._queue.put(group)
+
+    async def _consume(self):
+        while True:
+            group = await self._queue.get()
+            if group is None: return
+            if self.prepare:
+                try: group = await self.prepare(group)
+                except Exception as e: print(f"⚠️ [Album] Error preparando grupo: {e}")
+            if group: await self._send(group)
+
+    async def _send(self, group):
+        for attempt in range(SEND_RETRIES):
+            await self.bucket.take()
+            try:
+                if self.group_mode:
+                    media = [InputMediaDocument(f) if self.doc_mode else InputMediaPhoto(f) for f in group]
+                    msgs = await self.client.send_media_group(self.chat_id, media) or []
+                elif self.doc_mode:
+                    msgs = [await self.client.send_document(self.chat_id, group[0])]
+                else:
+                    msgs = [await self.client.send_photo(self.chat_id, group[0])]
+                for m in msgs:
+                    fid = _file_id_of(m)
+                    if fid: self.file_ids.append(fid)
+                self.sent += len(group)
+                return
+            except FloodWait as e:
+                print(f"⏳ [Album] FloodWait {e.value}s")
+                self.bucket.penalize(e.value + 1)
+            except Exception as e:
+                print(f"⚠️ [Album] Error enviando grupo: {e}")
+                break
+        # Reintentos agotados: el grupo no salió, el llamador decide qué hacer
+        print(f"❌ [Album] Grupo de {len(group)} sin enviar")
+        self.failed += len(group)
+
+    async def finish(self):
+        if self._pending:
+            group, self._pending = self._pending, []
+            await self._queue.put(group)
+        await self._queue.put(None)
+        await self._task
+        return self.file_ids
+
+    async def abort(self):
+        if self._task and not self._task.done():
+            self._task.cancel()
+            try: await self._task
+            except BaseException: pass
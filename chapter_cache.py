@@ -0,0 +1,131 @@
+import os
+import time
+import json
+import sqlite3
+import threading
+from collections import OrderedDict
+from config import DATA_DIR
+
+# --- CACHE DE CAPÍTULOS (manga_id -> lista de capítulos parseada) ---
+# get_manga_chapters hacía un runQuery completo en cada llamada (incluso solo para validar
+# el conteo de un álbum cacheado). Ahora:
+# - Memoria (LRU de CHAPTER_CACHE_MEM mangas) + SQLite en disco (sobrevive reinicios).
+# - Dentro de CHAPTER_CACHE_TTL se usa sin preguntar a Firestore.
+# - Pasado el TTL se revalida con una query que solo trae nombres + updateTime (firma =
+#   número de capítulos + updateTime más reciente). Si no cambió, se reutiliza lo guardado.
+# - Al navegar el catálogo se precargan en lote (una query IN) los mangas cercanos.
+
+CHAPTER_CACHE_DB = os.path.join(DATA_DIR, "chapter_cache.db")
+CHAPTER_CACHE_TTL = int(os.environ.get("CHAPTER_CACHE_TTL", 900))
+CHAPTER_CACHE_MEM = int(os.environ.get("CHAPTER_CACHE_MEM", 200))
+CHAPTER_PREFETCH = int(os.environ.get("CHAPTER_PREFETCH", 5))   # mangas vecinos precargados al navegar el catálogo
+
+
+class ChapterCache:
+    def __init__(self, path=CHAPTER_CACHE_DB, ttl=CHAPTER_CACHE_TTL, mem_entries=CHAPTER_CACHE_MEM):
+        self.path = path
+        self.ttl = ttl
+        self.mem_entries = mem_entries
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        self._mem = OrderedDict()   # {manga_id: (fetched, sig, chapters)}
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _db(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS chapters ("
+                " manga_id TEXT PRIMARY KEY, fetched REAL NOT NULL, sig TEXT NOT NULL, data TEXT NOT NULL)"
+            )
+        return self._conn
+
+    def _remember(self, manga_id, entry):
+        self._mem[manga_id] = entry
+        self._mem.move_to_end(manga_id)
+        while len(self._mem) > self.mem_entries:
+            self._mem.popitem(last=False)
+
+    def entry(self, manga_id):
+        """(fetched, sig, chapters) guardado (vigente o no), o None."""
+        manga_id = str(manga_id)
+        entry = self._mem.get(manga_id)
+        if entry:
+            self._mem.move_to_end(manga_id)
+            return entry
+        with self._lock:
+            try:
+                row = self._db().execute(
+                    "SELECT fetched, sig, data FROM chapters WHERE manga_id=?", (manga_id,)
+                ).fetchone()
+            except sqlite3.Error as e:
+                print(f"⚠️ [ChapterCache] Error leyendo: {e}")
+                row = None
+        if not row: return None
+        try: entry = (row[0], row[1], json.loads(row[2]))
+        except ValueError: return None
+        self._remember(manga_id, entry)
+        return entry
+
+    def is_fresh(self, manga_id):
+        entry = self.entry(manga_id)
+        return bool(entry) and time.time() - entry[0] < self.ttl
+
+    def fresh(self, manga_id):
+        """Capítulos dentro del TTL, o None (sin contar misses: el llamador decide)."""
+        if not self.is_fresh(manga_id): return None
+        self.hits += 1
+        return self.entry(manga_id)[2]
+
+    def put(self, manga_id, chapters, sig):
+        manga_id = str(manga_id)
+        entry = (time.time(), sig, chapters)
+        self._remember(manga_id, entry)
+        with self._lock:
+            try:
+                self._db().execute(
+                    "INSERT OR REPLACE INTO chapters (manga_id, fetched, sig, data) VALUES (?,?,?,?)",
+                    (manga_id, entry[0], sig, json.dumps(chapters, ensure_ascii=False))
+                )
+            except sqlite3.Error as e:
+                print(f"⚠️ [ChapterCache] Error guardando: {e}")
+
+    def touch(self, manga_id):
+        """La firma no cambió: renovar el TTL sin reescribir los datos."""
+        manga_id = str(manga_id)
+        entry = self.entry(manga_id)
+        if not entry: return
+        self.revalidated += 1
+        now = time.time()
+        self._remember(manga_id, (now, entry[1], entry[2]))
+        with self._lock:
+            try: self._db().execute("UPDATE chapters SET fetched=? WHERE manga_id=?", (now, manga_id))
+            except sqlite3.Error: pass
+
+    def invalidate(self, manga_id):
+        manga_id = str(manga_id)
+        self._mem.pop(manga_id, None)
+        with self._lock:
+            try: self._db().execute("DELETE FROM chapters WHERE manga_id=?", (manga_id,))
+            except sqlite3.Error: pass
+
+    def stats(self):
+        return {
+            'memory': len(self._mem),
+            'hits': self.hits,
+            'revalidated': self.revalidated,
+            'misses': self.misses,
+        }
+
+
+def chapters_signature(docs):
+    """Firma de un conjunto de documentos runQuery: cuántos son + updateTime más reciente."""
+    times = [d.get('updateTime', '') for d in docs]
+    return f"{len(times)}:{max(times) if times else ''}"
+
+
+# Instancia única del proceso
+chapter_cache = ChapterCache()
@@ -0,0 +1,105 @@
+import time
+import asyncio
+
+# --- DESCARGAS COMPARTIDAS (SINGLE-FLIGHT) ---
+# Si varios usuarios piden el mismo vid_id + calidad a la vez, solo el primero (líder)
+# descarga y sube. Los demás (seguidores) ven el progreso del líder en su propio mensaje
+# y, cuando hay file_id de Telegram, lo reenvían al instante.
+# Si el líder falla o no obtiene file_id (p.ej. video cortado en partes), cada seguidor
+# descarga por su cuenta.
+
+MIRROR_EVERY = 5  # segundos mínimos entre ediciones del mensaje de un seguidor
+
+
+class Flight:
+    def __init__(self, key):
+        self.key = key
+        self.future = asyncio.get_running_loop().create_future()
+        self.text = None
+        self.followers = 0
+        self._changed = asyncio.Event()
+
+    def publish(self, text):
+        self.text = text
+        self._changed.set()
+
+    def resolve(self, file_id):
+        if not self.future.done():
+            self.future.set_result(file_id)
+        self._changed.set()
+
+    async def changed(self, timeout):
+        try: await asyncio.wait_for(self._changed.wait(), timeout)
+        except asyncio.TimeoutError: pass
+        self._changed.clear()
+
+
+class Coalescer:
+    def __init__(self):
+        self._flights = {}
+
+    def get(self, key):
+        return self._flights.get(key)
+
+    def lead(self, key):
+        """Registra al llamador como líder de `key`. Retorna el Flight (o None si ya hay líder)."""
+        if key in self._flights: return None
+        flight = Flight(key)
+        self._flights[key] = flight
+        return flight
+
+    def resolve(self, key, file_id):
+        flight = self._flights.get(key)
+        if flight: flight.resolve(file_id)
+
+    def finish(self, key):
+        """Fin del líder (bien o mal): los seguidores sin file_id reciben None."""
+        flight = self._flights.pop(key, None)
+        if flight: flight.resolve(None)
+
+    def stats(self):
+        return {'flights': len(self._flights), 'followers': sum(f.followers for f in self._flights.values())}
+
+    async def follow(self, client, chat_id, flight, label=""):
+        """Espera al líder reflejando su progreso. Retorna el file_id o None."""
+        flight.followers += 1
+        head = f"🔗 **Descarga compartida**{f' ({label})' if label else ''}\n"
+        msg = await client.send_message(chat_id, head + (flight.text or "⏳ Otro usuario ya está descargando este archivo..."))
+        shown = flight.text
+        last = time.time()
+        try:
+            while not flight.future.done():
+                await flight.changed(MIRROR_EVERY)
+                if flight.future.done(): break
+                if flight.text and flight.text != shown and time.time() - last >= MIRROR_EVERY:
+                    shown, last = flight.text, time.time()
+                    try: await msg.edit(head + shown)
+                    except Exception: pass
+            return flight.future.result()
+        finally:
+            flight.followers -= 1
+            try: await msg.delete()
+            except Exception: pass
+
+
+class MirroredStatus:
+    """Proxy del mensaje de estado del líder: cada edición se publica también a los seguidores."""
+
+    def __init__(self, msg, flight):
+        self._msg = msg
+        self._flight = flight
+
+    async def edit(self, text, *args, **kwargs):
+        self._flight.publish(text)
+        return await self._msg.edit(text, *args, **kwargs)
+
+    async def edit_text(self, text, *args, **kwargs):
+        self._flight.publish(text)
+        return await self._msg.edit_text(text, *args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._msg, name)
+
+
+# Instancia única del proceso
+coalescer = Coalescer()
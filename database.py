@@ -1,51 +1,319 @@
 import json
 import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from collections.abc import MutableMapping
 from config import DB_FILE, DATA_DIR
 
 DB_CACHE = os.path.join(DATA_DIR, "manga_cache.json")
 DB_TAGS = os.path.join(DATA_DIR, "hashtags.json")
+DB_USER_SNAPSHOT = os.path.join(DATA_DIR, "user_configs_snapshot.json")
+DB_SQLITE = os.path.join(DATA_DIR, "bot_data.db")
+STORE_CACHE_MAX = int(os.environ.get("STORE_CACHE_MAX", 2000))   # entradas guardadas que se quedan en memoria
+
+# --- ALMACENAMIENTO SQLITE (WAL) ---
+# downloads_db y hashtag_db se guardaban reescribiendo el JSON entero (indent=4) en cada
+# guardar_db/save_tags: O(tamaño total) por guardado y un corte a mitad de escritura dejaba el
+# archivo corrupto. Ahora viven en SQLite en modo WAL con la misma API de dict:
+# - Lo leído/asignado queda en un LRU acotado; guardar_db/save_tags solo escriben las claves
+#   marcadas como pendientes (asignadas o avisadas con mark_dirty tras mutarlas en sitio).
+# - Hashtags normalizados (tag, chat, mensaje) con índices por tag y por chat.
+# - Al primer arranque se importan los JSON existentes y se renombran a *.migrated.
+
+
+class SqliteStore:
+    def __init__(self, path=DB_SQLITE):
+        self.path = path
+        self.lock = threading.Lock()
+        self._conn = None
+
+    def db(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")  # WAL: seguro ante cortes del proceso
+        return self._conn
+
+    def write(self, statements):
+        """Ejecuta [(sql, filas)] en UNA transacción (todo o nada)."""
+        with self.lock:
+            db = self.db()
+            db.execute("BEGIN")
+            try:
+                for sql, rows in statements:
+                    if rows: db.executemany(sql, rows)
+                db.execute("COMMIT")
+            except Exception:
+                db.execute("ROLLBACK")
+                raise
+
+    def query(self, sql, args=()):
+        with self.lock:
+            return self.db().execute(sql, args).fetchall()
+
+
+def _migrate_json(table, json_path):
+    """Importa el JSON antiguo si la tabla está vacía (una sola vez)."""
+    if not os.path.exists(json_path) or len(table): return
+    try:
+        with open(json_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        table.update(data)
+        table.save()
+        os.replace(json_path, json_path + ".migrated")
+        print(f"📦 Migrado a SQLite: {os.path.basename(json_path)} ({len(data)} entradas)")
+    except Exception as e:
+        print(f"⚠️ Error migrando {os.path.basename(json_path)}: {e}")
+
+
+def _evict_clean(cache, dirty, limit, *extra):
+    """Saca del LRU las entradas más antiguas ya guardadas hasta quedar en `limit`."""
+    if len(cache) <= limit: return
+    for key in list(cache):
+        if len(cache) <= limit: break
+        if key in dirty: continue
+        del cache[key]
+        for d in extra: d.pop(key, None)
+
+
+class JsonTable(MutableMapping):
+    """
+    Tabla clave -> valor JSON con API de dict (claves como texto, igual que en el JSON).
+    Asignar marca la clave como pendiente; si se muta en sitio un valor leído, llamar
+    a mark_dirty(clave) para que el próximo save() lo escriba.
+    """
+
+    def __init__(self, store, name, max_cached=STORE_CACHE_MAX):
+        self.store = store
+        self.name = name
+        self.max_cached = max_cached
+        self._cache = OrderedDict()   # LRU {clave: objeto} leído o asignado
+        self._dirty = set()           # claves pendientes de guardar
+        with store.lock:
+            db = store.db()
+            db.execute(f"CREATE TABLE IF NOT EXISTS {name} (key TEXT PRIMARY KEY, value TEXT NOT NULL, chat_id INTEGER)")
+            db.execute(f"CREATE INDEX IF NOT EXISTS {name}_chat ON {name}(chat_id)")
+
+    def __getitem__(self, key):
+        key = str(key)
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+        rows = self.store.query(f"SELECT value FROM {self.name} WHERE key=?", (key,))
+        if not rows: raise KeyError(key)
+        self._cache[key] = json.loads(rows[0][0])
+        _evict_clean(self._cache, self._dirty, self.max_cached)
+        return self._cache[key]
+
+    def __setitem__(self, key, value):
+        key = str(key)
+        self._cache[key] = value
+        self._cache.move_to_end(key)
+        self._dirty.add(key)
+
+    def mark_dirty(self, key):
+        """El valor de `key` se modificó en sitio: guardarlo en el próximo save()."""
+        key = str(key)
+        if key in self._cache: self._dirty.add(key)
+
+    def __delitem__(self, key):
+        key = str(key)
+        if key not in self: raise KeyError(key)
+        self._cache.pop(key, None)
+        self._dirty.discard(key)
+        self.store.write([(f"DELETE FROM {self.name} WHERE key=?", [(key,)])])
+
+    def __contains__(self, key):
+        key = str(key)
+        return key in self._cache or bool(self.store.query(f"SELECT 1 FROM {self.name} WHERE key=?", (key,)))
+
+    def __iter__(self):
+        keys = [r[0] for r in self.store.query(f"SELECT key FROM {self.name}")]
+        seen = set(keys)
+        return iter(keys + [k for k in self._cache if k not in seen])
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def save(self):
+        """Upsert solo de las claves pendientes (O(filas cambiadas), no O(cache))."""
+        rows = []
+        for key in self._dirty:
+            if key not in self._cache: continue
+            value = self._cache[key]
+            try: raw = json.dumps(value, ensure_ascii=False)
+            except (TypeError, ValueError) as e:
+                print(f"⚠️ [{self.name}] Valor no serializable en {key}: {e}")
+                continue
+            chat = value.get('chat_id', value.get('chat')) if isinstance(value, dict) else None
+            rows.append((key, raw, chat if isinstance(chat, int) else None))
+        if rows:
+            self.store.write([(
+                f"INSERT INTO {self.name} (key, value, chat_id) VALUES (?,?,?)"
+                " ON CONFLICT(key) DO UPDATE SET value=excluded.value, chat_id=excluded.chat_id", rows
+            )])
+        self._dirty.clear()
+        _evict_clean(self._cache, self._dirty, self.max_cached)
+        return len(rows)
+
+
+def _tag_row(tag, item):
+    """(chat, mensaje) de una entrada de hashtag, o None si está mal formada."""
+    try: return int(item['chat']), int(item['id'])
+    except (KeyError, TypeError, ValueError):
+        print(f"⚠️ Hashtag #{tag}: entrada inválida ignorada: {item!r}")
+        return None
+
+
+class HashtagStore(MutableMapping):
+    """
+    tag -> lista de {'id': msg_id, 'chat': chat_id} (en orden de alta), como el antiguo hashtags.json.
+    Si se muta en sitio la lista de un tag, llamar a mark_dirty(tag) antes de save().
+    """
+
+    def __init__(self, store, max_cached=STORE_CACHE_MAX):
+        self.store = store
+        self.max_cached = max_cached
+        self._cache = OrderedDict()   # LRU {tag: lista}
+        self._saved = {}              # {tag: set((chat, id))} ya en la base (tags en cache)
+        self._dirty = set()           # tags pendientes de guardar
+        with store.lock:
+            db = store.db()
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS hashtags ("
+                " tag TEXT NOT NULL, chat_id INTEGER NOT NULL, msg_id INTEGER NOT NULL,"
+                " UNIQUE (tag, chat_id, msg_id))"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS hashtags_chat ON hashtags(chat_id)")
+
+    def _rows(self, tag):
+        return self.store.query("SELECT chat_id, msg_id FROM hashtags WHERE tag=? ORDER BY rowid", (tag,))
+
+    def __getitem__(self, tag):
+        if tag in self._cache:
+            self._cache.move_to_end(tag)
+            return self._cache[tag]
+        rows = self._rows(tag)
+        if not rows: raise KeyError(tag)
+        self._saved[tag] = set(rows)
+        self._cache[tag] = [{'id': m, 'chat': c} for c, m in rows]
+        _evict_clean(self._cache, self._dirty, self.max_cached, self._saved)
+        return self._cache[tag]
+
+    def __setitem__(self, tag, msgs):
+        self._cache[tag] = msgs
+        self._cache.move_to_end(tag)
+        self._dirty.add(tag)
+
+    def mark_dirty(self, tag):
+        """La lista de `tag` se modificó en sitio: guardarla en el próximo save()."""
+        if tag in self._cache: self._dirty.add(tag)
+
+    def __delitem__(self, tag):
+        if tag not in self: raise KeyError(tag)
+        self._cache.pop(tag, None)
+        self._saved.pop(tag, None)
+        self._dirty.discard(tag)
+        self.store.write([("DELETE FROM hashtags WHERE tag=?", [(tag,)])])
+
+    def __contains__(self, tag):
+        return tag in self._cache or bool(self.store.query("SELECT 1 FROM hashtags WHERE tag=? LIMIT 1", (tag,)))
+
+    def __iter__(self):
+        tags = [r[0] for r in self.store.query("SELECT DISTINCT tag FROM hashtags")]
+        seen = set(tags)
+        return iter(tags + [t for t in self._cache if t not in seen])
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def tags_for_chat(self, chat_id):
+        return [r[0] for r in self.store.query("SELECT DISTINCT tag FROM hashtags WHERE chat_id=?", (chat_id,))]
+
+    def save(self):
+        """Inserta/borra solo las filas (tag, chat, mensaje) de los tags pendientes."""
+        added, removed, current = [], [], {}
+        for tag in self._dirty:
+            if tag not in self._cache: continue
+            cur = [r for r in (_tag_row(tag, it) for it in self._cache[tag]) if r]
+            old = self._saved.get(tag)
+            if old is None: old = set(self._rows(tag))  # Asignado sin leer: comparar con la base
+            added.extend((tag, c, m) for c, m in cur if (c, m) not in old)
+            removed.extend((tag, c, m) for c, m in old - set(cur))
+            current[tag] = set(cur)
+        if added or removed:
+            self.store.write([
+                ("INSERT OR IGNORE INTO hashtags (tag, chat_id, msg_id) VALUES (?,?,?)", added),
+                ("DELETE FROM hashtags WHERE tag=? AND chat_id=? AND msg_id=?", removed),
+            ])
+        self._saved.update(current)
+        self._dirty.clear()
+        _evict_clean(self._cache, self._dirty, self.max_cached, self._saved)
+        return len(added) + len(removed)
+
+
+# --- CONFIG DE USUARIOS BAJO DEMANDA ---
+# Antes boot_services traía TODA la colección user_configs a RAM (tiempo de arranque y
+# memoria crecían con cada usuario). Ahora:
+# - ensure_config(chat_id) la carga de Firestore la primera vez que el chat habla.
+# - user_config es un LRU de USER_CONFIG_MAX chats (lo expulsado ya está en Firestore).
+# - Al apagar se guarda una foto de los USER_SNAPSHOT_MAX chats más recientes; al arrancar
+#   se lee esa foto (tamaño fijo) y se refresca en segundo plano con get_all (warm_user_configs).
+USER_CONFIG_MAX = int(os.environ.get("USER_CONFIG_MAX", 5000))
+USER_SNAPSHOT_MAX = int(os.environ.get("USER_SNAPSHOT_MAX", 500))
+USER_DOC_FIELDS = ('first_name', 'username', 'joined_at', 'user_id')  # Datos de registro, no de config
 
 # --- VARIABLES GLOBALES (NO BORRAR) ---
 url_storage = {}    # <-- Esta es la variable que te faltaba
-user_config = {}    
-downloads_db = {}   
-hashtag_db = {}     # <-- Base de datos de hashtags
+user_config = OrderedDict()   # LRU {chat_id: config}
+config_loaded = set()          # chats ya sincronizados con Firestore
+store = SqliteStore()
+downloads_db = JsonTable(store, "downloads")
+hashtag_db = HashtagStore(store)     # <-- Base de datos de hashtags
 active_downloads = {} # {chat_id: {msg_id: future/task}}
 user_cooldowns = {}   # {chat_id: timestamp}
 
 # --- FUNCIONES ---
 
 def cargar_db():
-    global downloads_db
-    if os.path.exists(DB_FILE):
-        try:
-            with open(DB_FILE, 'r') as f:
-                downloads_db.update(json.load(f))
-        except:
-            downloads_db = {}
+    # Los datos se leen de SQLite bajo demanda; solo queda importar el JSON antiguo
+    _migrate_json(downloads_db, DB_FILE)
 
 def guardar_db():
     try:
-        with open(DB_FILE, 'w') as f:
-            json.dump(downloads_db, f, indent=4)
-    except:
-        pass
+        downloads_db.save()
+    except Exception as e:
+        print(f"⚠️ Error guardando DB: {e}")
 
 def load_tags():
-    global hashtag_db
-    if os.path.exists(DB_TAGS):
-        try:
-            with open(DB_TAGS, 'r', encoding='utf-8') as f:
-                hashtag_db.update(json.load(f))
-        except:
-            hashtag_db = {}
+    _migrate_json(hashtag_db, DB_TAGS)
 
 def save_tags():
     try:
-        with open(DB_TAGS, 'w', encoding='utf-8') as f:
-            json.dump(hashtag_db, f, indent=4, ensure_ascii=False)
-    except:
-        pass
+        hashtag_db.save()
+    except Exception as e:
+        print(f"⚠️ Error guardando hashtags: {e}")
+
+def merge_tags(tags):
+    """Une hashtags traídos de Firestore a los locales (solo añade lo que falte). Retorna cuántos añadió."""
+    added = 0
+    for tag, items in (tags or {}).items():
+        if not isinstance(items, list): continue
+        items = [it for it in items if isinstance(it, dict)]
+        try: cur = hashtag_db[tag]
+        except KeyError:
+            hashtag_db[tag] = items
+            added += len(items)
+            continue
+        seen = {(str(it.get('chat')), str(it.get('id'))) for it in cur}
+        new = [it for it in items if (str(it.get('chat')), str(it.get('id'))) not in seen]
+        if new:
+            cur.extend(new)
+            hashtag_db.mark_dirty(tag)
+            added += len(new)
+    if added: save_tags()
+    return added
 
 def get_config(chat_id):
     if chat_id not in user_config:
@@ -62,17 +330,83 @@ def get_config(chat_id):
             'party_mode': False,
             'ai_mode': False, # Modo Party
         }
+        while len(user_config) > USER_CONFIG_MAX:
+            old_id, _ = user_config.popitem(last=False)
+            config_loaded.discard(old_id)
+    user_config.move_to_end(chat_id)
     return user_config[chat_id]
 
+def merge_config(chat_id, data):
+    """Aplica la config guardada (Firestore o foto local) sobre la de memoria."""
+    conf = get_config(chat_id)
+    conf.update({k: v for k, v in (data or {}).items() if k not in USER_DOC_FIELDS})
+    return conf
+
+async def ensure_config(chat_id):
+    """get_config, cargando antes la config guardada en Firestore si este chat aún no se sincronizó."""
+    if chat_id in config_loaded: return get_config(chat_id)
+    from firebase_service import load_user_configs
+    found = await load_user_configs([chat_id])
+    if chat_id in found:  # Si la lectura falló se reintenta en el próximo mensaje
+        merge_config(chat_id, found[chat_id])
+        config_loaded.add(chat_id)
+    return get_config(chat_id)
+
+async def warm_user_configs(chat_ids):
+    """Refresca desde Firestore (en lote) los chats de la foto local."""
+    from firebase_service import load_user_configs
+    pending = [c for c in chat_ids if c not in config_loaded]
+    if not pending: return 0
+    found = await load_user_configs(pending)
+    for chat_id, data in found.items():
+        if chat_id in config_loaded: continue  # Ya lo cargó ensure_config mientras tanto
+        merge_config(chat_id, data)
+        config_loaded.add(chat_id)
+    return len(found)
+
+def save_user_snapshot():
+    """Guarda los USER_SNAPSHOT_MAX chats usados más recientemente (escritura atómica)."""
+    recent = list(user_config.items())[-USER_SNAPSHOT_MAX:]
+    data = [[chat_id, conf] for chat_id, conf in recent if chat_id in config_loaded]
+    tmp = DB_USER_SNAPSHOT + ".tmp"
+    try:
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, default=str)
+        os.replace(tmp, DB_USER_SNAPSHOT)
+    except Exception as e:
+        print(f"⚠️ Error guardando foto de configs: {e}")
+
+def load_user_snapshot():
+    """Carga la foto local (sin marcar como sincronizada). Retorna los chat_ids en orden de uso."""
+    if not os.path.exists(DB_USER_SNAPSHOT): return []
+    try:
+        with open(DB_USER_SNAPSHOT, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except Exception:
+        return []
+    ids = []
+    for chat_id, conf in data:
+        merge_config(chat_id, conf)
+        ids.append(chat_id)
+    return ids
+
 def can_download(chat_id, max_concurrent=3, cooldown_sec=2):
-    # Restricciones deshabilitadas a petición del usuario (Modo Ilimitado)
+    # Sin límite de descargas simultáneas (Modo Ilimitado): el planificador las encola.
+    # Solo rechazamos si el chat ya tiene demasiados trabajos esperando turno.
+    from scheduler import scheduler, MAX_QUEUED_PER_CHAT
+    if scheduler.queued_count(chat_id) >= MAX_QUEUED_PER_CHAT:
+        return False, f"Cola llena ({MAX_QUEUED_PER_CHAT} en espera)"
     return True, None
 
-def add_active(chat_id, msg_id, task=None, pid=None):
+def add_active(chat_id, msg_id, task=None, pid=None, gid=None):
     if chat_id not in active_downloads:
         active_downloads[chat_id] = {}
-    # Guardamos diccionario con task y pid opcional
-    active_downloads[chat_id][msg_id] = {'task': task, 'pid': pid}
+    # Guardamos diccionario con task, pid y gid (Aria2 RPC) opcionales
+    prev = active_downloads[chat_id].get(msg_id)
+    if isinstance(prev, dict) and task is None:
+        # Registrar pid/gid sin perder el Task ya registrado
+        task = prev.get('task')
+    active_downloads[chat_id][msg_id] = {'task': task, 'pid': pid, 'gid': gid}
 
 def remove_active(chat_id, msg_id):
     if chat_id in active_downloads and msg_id in active_downloads[chat_id]:
@@ -86,20 +420,32 @@ async def cancel_all(chat_id):
         tasks_map = active_downloads[chat_id]
         count = len(tasks_map)
         
-        for mid, info in tasks_map.items():
+        # Copia: al cancelar, el finally de cada tarea llama a remove_active y cambia el dict mientras esperamos a Aria2
+        for mid, info in list(tasks_map.items()):
             # Soportar formato antiguo (solo task) o nuevo (dict)
             if isinstance(info, dict):
                 task = info.get('task')
                 pid = info.get('pid')
+                gid = info.get('gid')
             else:
                 task = info
                 pid = None
+                gid = None
             
             # 1. Cancelar Task de Python
             if task and not task.done():
                 task.cancel()
             
-            # 2. Matar proceso del sistema (FFmpeg / Aria2 / 7z)
+            # 2. Quitar la descarga del daemon Aria2 (RPC)
+            if gid:
+                try:
+                    from aria2_rpc import aria2
+                    await aria2.remove(gid)
+                    print(f"🔪 Aria2 GID Removed: {gid}")
+                except Exception as e:
+                    print(f"⚠️ Aria2 Remove Error {gid}: {e}")
+
+            # 3. Matar proceso del sistema (FFmpeg / Aria2 / 7z)
             if pid:
                 try:
                     import signal
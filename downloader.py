@@ -3,17 +3,26 @@ import math
 import os
 import time
 import asyncio
-import yt_dlp
 import shutil
 import subprocess
-import aiohttp
 import random
 from pyrogram import enums
+from pyrogram.errors import FloodWait
 from config import LIMIT_2GB, HAS_FAST, DOWNLOAD_DIR, TOOLS_DIR, FAST_PATH
 from database import get_config, downloads_db, guardar_db, add_active, remove_active
-from utils import sel_cookie, traducir_texto
+from utils import sel_cookie, traducir_texto, format_bytes, SplitPipeline
 from tools_media import get_thumb, get_meta, get_audio_dur, progreso
-from firebase_service import get_cached_file, save_cached_file, get_bot_config, delete_cached_file
+from firebase_service import get_bot_config, delete_cached_file
+from media_cache import media_cache
+from coalesce import coalescer, MirroredStatus
+from scheduler import scheduler
+from ytdlp_cache import info_cache, download_with_info
+from executors import run_in
+from aria2_rpc import aria2, Aria2Error
+from http_client import cookie_session
+import segmented_dl
+from segmented_dl import SEG_CONNECTIONS
+from tg_stream import can_stream, upload_from_url, send_uploaded, ParallelUploader, UPLOAD_PARALLEL, STREAM_UPLOAD, BIG_FILE_MIN
 
 # --- HELPER: SAFE BACKUP ---
  
@@ -35,19 +44,25 @@ if not os.path.exists(RE_PATH):
 
 HAS_RE = RE_PATH is not None and os.path.exists(RE_PATH)
 
+# Motor para enlaces directos: 'auto' (Aria2 RPC > Nativo Segmentado si no hay aria2c > aria2c),
+# 'aria2' (nunca usar el nativo) o 'native' (siempre el segmentado de Python)
+DIRECT_ENGINE = os.environ.get("DIRECT_ENGINE", "auto").lower()
+
+# Videos > TG_LIMIT: partes cortadas que pueden esperar en disco a ser subidas (ffmpeg se pausa al llegar)
+SPLIT_MAX_IN_FLIGHT = int(os.environ.get("SPLIT_MAX_IN_FLIGHT", 2))
+
 async def get_mediafire_link(url):
     try:
         from utils import load_cookies_dict
         cookies = load_cookies_dict(sel_cookie(url))
-        async with aiohttp.ClientSession(cookies=cookies) as session:
-            headers = {"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"}
-            async with session.get(url, headers=headers) as resp:
-                if resp.status != 200: return None
-                text = await resp.text()
-                match = re.search(r'href="([^"]+)"\s+id="downloadButton"', text)
-                if match: return match.group(1)
-                match2 = re.search(r'href="([^"]+)"[^>]+aria-label="Download file"', text)
-                if match2: return match2.group(1)
+        headers = {"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"}
+        async with cookie_session(cookies) as session, session.get(url, headers=headers) as resp:
+            if resp.status != 200: return None
+            text = await resp.text()
+            match = re.search(r'href="([^"]+)"\s+id="downloadButton"', text)
+            if match: return match.group(1)
+            match2 = re.search(r'href="([^"]+)"[^>]+aria-label="Download file"', text)
+            if match2: return match2.group(1)
     except Exception as e: print(f"Error Mediafire: {e}")
     return None
 
@@ -56,16 +71,15 @@ async def get_yourupload_link(url):
         from utils import load_cookies_dict
         cookies = load_cookies_dict(sel_cookie(url))
         headers = {"User-Agent": "Mozilla/5.0", "Referer": url}
-        async with aiohttp.ClientSession(cookies=cookies) as session:
-            async with session.get(url, headers=headers) as resp:
-                if resp.status != 200: return None
-                text = await resp.text()
-                match_og = re.search(r'property="og:video"\s+content="([^"]+)"', text)
-                if match_og: return match_og.group(1)
-                match_jw = re.search(r"file\s*:\s*['\"]([^'\"]+)['\"]", text)
-                if match_jw:
-                    link = match_jw.group(1)
-                    return "https://www.yourupload.com" + link if link.startswith("/") else link
+        async with cookie_session(cookies) as session, session.get(url, headers=headers) as resp:
+            if resp.status != 200: return None
+            text = await resp.text()
+            match_og = re.search(r'property="og:video"\s+content="([^"]+)"', text)
+            if match_og: return match_og.group(1)
+            match_jw = re.search(r"file\s*:\s*['\"]([^'\"]+)['\"]", text)
+            if match_jw:
+                link = match_jw.group(1)
+                return "https://www.yourupload.com" + link if link.startswith("/") else link
     except Exception as e: print(f"Error YourUpload: {e}")
     return None
 
@@ -78,15 +92,92 @@ async def get_mp4upload_link(url):
         from utils import load_cookies_dict
         cookies = load_cookies_dict(sel_cookie(url))
         headers = {"User-Agent": "Mozilla/5.0", "Referer": url}
-        async with aiohttp.ClientSession(cookies=cookies) as session:
-            async with session.get(url, headers=headers) as resp:
-                if resp.status != 200: return None
-                text = await resp.text()
-                match = re.search(r'src:\s*"([^"]+\.mp4)"', text)
-                if match: return match.group(1)
+        async with cookie_session(cookies) as session, session.get(url, headers=headers) as resp:
+            if resp.status != 200: return None
+            text = await resp.text()
+            match = re.search(r'src:\s*"([^"]+\.mp4)"', text)
+            if match: return match.group(1)
     except Exception as e: print(f"Error MP4Upload: {e}")
     return None
 
+async def sondear_streaming(url_descarga, calidad, headers=None, cookies=None):
+    """
+    Decide si un enlace directo va por streaming. Retorna (probed, motivo):
+    probed = (tamaño, acepta_rangos) si hubo sondeo (el motor segmentado lo reutiliza) y
+    motivo = None si se puede hacer streaming, o por qué se omite.
+    """
+    if calidad == "mp3": return None, "MP3 (requiere conversión)"
+    if not STREAM_UPLOAD: return None, "STREAM_UPLOAD desactivado"
+    try:
+        probed = await segmented_dl.probe(url_descarga, headers, cookies)
+    except Exception as e:
+        return None, f"sondeo falló ({e})"
+    size = probed[0]
+    if not size: return probed, "tamaño desconocido"
+    if size <= BIG_FILE_MIN: return probed, f"archivo pequeño ({format_bytes(size)})"
+    if not can_stream(size, TG_LIMIT): return probed, f"hay que cortarlo ({format_bytes(size)})"
+    return probed, None
+
+async def enviar_streaming(client, chat_id, conf, datos, url_descarga, calidad, ckey, status, msg_orig, size, headers=None, cookies=None, force_doc=False):
+    """
+    Modo streaming para enlaces directos: HTTP -> Telegram sin pasar por disco.
+    `size` viene de sondear_streaming (ya validado con can_stream).
+    Retorna True si el archivo se envió; False si falló (el llamador descarga a disco).
+    """
+
+    clean_name = url_descarga.split('?')[0].rstrip('/').split('/')[-1]
+    file_name = clean_name if '.' in clean_name and len(os.path.splitext(clean_name)[1]) < 7 else f"video_{int(time.time())}.mp4"
+    ext = os.path.splitext(file_name)[1].lower()
+    as_video = ext in ['.mp4', '.mkv', '.mov', '.webm', '.m4v'] and not force_doc and not conf.get('doc_mode')
+
+    # Metadatos y miniatura directamente desde la URL (ffprobe/ffmpeg leen HTTP) en paralelo a la subida
+    ts = f"{int(time.time() * 1000)}_s"
+    meta_task = asyncio.create_task(get_meta(url_descarga)) if as_video else None
+    thumb_task = asyncio.create_task(get_thumb(url_descarga, chat_id, ts)) if as_video else None
+    thumb = None
+
+    try:
+        await status.edit(f"📡 **Streaming directo...**\n📥 {format_bytes(size)}\n🚀 Descarga y subida simultáneas")
+        act = "📡 Descargando y Subiendo"
+        input_file = await upload_from_url(
+            client, url_descarga, size, file_name, headers=headers, cookies=cookies,
+            progress=progreso, progress_args=(status, [time.time(), 0], act)
+        )
+
+        w, h, dur = await meta_task if meta_task else (0, 0, 0)
+        thumb = await thumb_task if thumb_task else None
+
+        cap = ""
+        if conf.get('meta'):
+            res_str = f"{w}x{h}" if w else "Archivo"
+            cap = f"🎬 **{file_name}**\n⚙️ {res_str}"
+            if dur: cap += f" | ⏱ {time.strftime('%H:%M:%S', time.gmtime(dur))}"
+            cap = cap[:1024]
+
+        res = await send_uploaded(
+            client, chat_id, input_file, file_name, caption=cap, as_video=as_video,
+            width=w, height=h, duration=dur, thumb=thumb, reply_to_message_id=msg_orig.id
+        )
+        if res and datos.get('id'):
+            fid = res.video.file_id if res.video else (res.document.file_id if res.document else None)
+            if fid:
+                media_cache.put(datos['id'], ckey, fid, meta=datos)
+                coalescer.resolve((str(datos['id']), ckey), fid)
+        return res is not None
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        print(f"⚠️ Streaming falló ({e}). Fallback a descarga en disco.")
+        try: await status.edit("⚠️ **Streaming falló.**\n🔄 Descargando a disco...")
+        except: pass
+        return False
+    finally:
+        for t in (meta_task, thumb_task):
+            if t and not t.done(): t.cancel()
+        if thumb and os.path.exists(thumb):
+            try: os.remove(thumb)
+            except: pass
+
 async def procesar_descarga(client, chat_id, url, calidad, datos, msg_orig):
     conf = get_config(chat_id)
     vid_id = datos.get('id')
@@ -119,22 +210,10 @@ async def procesar_descarga(client, chat_id, url, calidad, datos, msg_orig):
     if conf.get('doc_mode') and calidad != "mp3":
         ckey += "_doc"
 
-    # --- ZONA DE CACHE (FIREBASE) ---
-    # --- ZONA DE CACHE (FIREBASE) ---
-    cached_fid = None
-    if vid_id:
-        # print(f"🔎 DEBUG: Checking cache for {vid_id} [{ckey}]...")
-        # cached_fid = await get_cached_file(vid_id, ckey)
-        print(f"🔎 DEBUG: Skipping cache for {vid_id} (FORCE DISABLE)")
-        cached_fid = None
-    else:
-        print("⚠️ DEBUG: vid_id is None! Skipping cache check.")
-
-    if cached_fid:
+    # --- ZONA DE CACHE (LOCAL -> FIREBASE) ---
+    async def enviar_cacheado(file_id):
+        """Reenvía un file_id ya subido. False si Telegram lo rechaza (cache inválido)."""
         try:
-            print(f"✨ Firebase Cache Hit: {vid_id} [{ckey}]")
-            file_id = cached_fid
-            
             res_str = f"{calidad}p" if calidad.isdigit() else calidad.upper()
             cap_cache = f"🎬 **{datos.get('titulo','Video')}**\n⚙️ {res_str} | ✨ (Reenviado al instante)"
             
@@ -148,10 +227,39 @@ async def procesar_descarga(client, chat_id, url, calidad, datos, msg_orig):
                     await client.send_video(chat_id, file_id, caption=cap_cache)
                 except:
                     await client.send_document(chat_id, file_id, caption=cap_cache)
-            return
+            return True
         except Exception as e:
             print(f"⚠️ Cache inválido o borrado: {e}")
-            if vid_id: await delete_cached_file(vid_id)
+            await media_cache.delete(vid_id, ckey)
+            await delete_cached_file(vid_id)
+            return False
+
+    cached_fid = None
+    if vid_id:
+        # Índice local primero; Firebase solo si FIREBASE_CACHE_READ=1 (lento/inestable)
+        cached_fid = await media_cache.lookup(vid_id, ckey)
+    else:
+        print("⚠️ DEBUG: vid_id is None! Skipping cache check.")
+
+    if cached_fid:
+        print(f"✨ Cache Hit: {vid_id} [{ckey}]")
+        if await enviar_cacheado(cached_fid): return
+
+    # --- DESCARGA COMPARTIDA (SINGLE-FLIGHT) ---
+    # Mismo vid_id + calidad ya en curso: seguir al líder y reenviar su file_id.
+    # Mientras solo espera, el seguidor devuelve su turno del planificador a otras descargas.
+    flight_key = (str(vid_id), ckey) if vid_id else None
+    flight = None
+    if flight_key:
+        leader = coalescer.get(flight_key)
+        if leader:
+            print(f"🔗 Coalesce: {vid_id} [{ckey}] ya en curso, esperando al líder...")
+            scheduler.pause_turn()
+            shared_fid = await coalescer.follow(client, chat_id, leader, calidad)
+            if shared_fid and await enviar_cacheado(shared_fid): return
+            print(f"🔗 Coalesce: líder sin file_id para {vid_id} [{ckey}], descargando por cuenta propia")
+            await scheduler.resume_turn()
+        flight = coalescer.lead(flight_key)
 
     # Register Task for Anti-Spam / Cancellation
     curr_task = asyncio.current_task()
@@ -206,6 +314,7 @@ async def procesar_descarga(client, chat_id, url, calidad, datos, msg_orig):
                 except: pass
 
         status = await client.send_message(chat_id, f"⏳ **Descargando...**\n📥 {calidad}")
+        if flight: status = MirroredStatus(status, flight)
         
         # --- LOGICA DE SELECCIÓN DE MOTOR ---
         engine_name = "Nativo (Estándar)"
@@ -343,48 +452,105 @@ async def procesar_descarga(client, chat_id, url, calidad, datos, msg_orig):
              
              temp_out = f"dl_{chat_id}_{ts}_temp"
              final_temp = os.path.join(DOWNLOAD_DIR, temp_out)
+
+             # STREAMING: tamaño conocido y sin corte -> de la fuente a Telegram sin pasar por disco
+             from utils import load_cookies_dict
+             st_headers = {"Referer": url} if yourupload_link else None
+             probed, sin_stream = await sondear_streaming(
+                 url_descarga, calidad, headers=st_headers, cookies=load_cookies_dict(sel_cookie(url))
+             )
+             if sin_stream:
+                 print(f"📡 Streaming omitido: {sin_stream}")
+             elif await enviar_streaming(
+                 client, chat_id, conf, datos, url_descarga, calidad, ckey, status, msg_orig, probed[0],
+                 headers=st_headers, cookies=load_cookies_dict(sel_cookie(url)),
+                 force_doc=bool(mediafire_link or mp4_link)
+             ):
+                 return
              
-             # FALLBACK: Si no hay aria2c, usar aiohttp (Python nativo)
-             if not HAS_FAST and not shutil.which("aria2c"):
-                 await status.edit(f"⏳ **Descargando (Nativo)...**\n🚀 **Motor:** Python (aiohttp)")
+             # MOTOR NATIVO SEGMENTADO: si se fuerza por config o si no hay aria2c en el sistema
+             if DIRECT_ENGINE == "native" or (DIRECT_ENGINE == "auto" and not HAS_FAST and not shutil.which("aria2c")):
+                 engine_name = f"Nativo Segmentado (x{SEG_CONNECTIONS})"
+                 await status.edit(f"⏳ **Descargando...**\n📥 {calidad}\n🚀 **Motor:** {engine_name}")
+
+                 from utils import load_cookies_dict, render_bar, format_bytes
+                 seg_headers = {"Referer": url} if yourupload_link else {}
+
+                 async def seg_progress(done, total, speed):
+                     nonlocal last_edit
+                     now_t = time.time()
+                     if (now_t - last_edit) < 4: return
+                     last_edit = now_t
+                     pct = f"{done * 100 / total:.1f}%" if total else "..."
+                     bar = render_bar(done, total) if total else "░" * 10
+                     await status.edit(
+                         f"⏳ **Descargando...**\n"
+                         f"📥 {calidad}\n"
+                         f"🚀 **Motor:** {engine_name}\n\n"
+                         f"{bar} **{pct}**\n"
+                         f"📦 {format_bytes(done)} / {format_bytes(total)}\n"
+                         f"⚡ **{format_bytes(speed)}/s**"
+                     )
+
+                 # Nombre estable por (chat, url): si el mismo enlace se reintenta, reanuda desde el sidecar
+                 import hashlib
+                 url_hash = hashlib.md5(url_descarga.encode()).hexdigest()[:12]
+                 seg_path = os.path.join(DOWNLOAD_DIR, f"dl_{chat_id}_seg_{url_hash}")
+
                  try:
-                     async with aiohttp.ClientSession() as session:
-                         async with session.get(url_descarga) as resp:
-                             if resp.status == 200:
-                                 total_size = int(resp.headers.get('Content-Length', 0))
-                                 downloaded = 0
-                                 start_t = time.time()
-                                 last_edit_t = 0
-                                 
-                                 with open(final_temp, 'wb') as f:
-                                     while True:
-                                         chunk = await resp.content.read(1024*1024) # 1MB chunks
-                                         if not chunk: break
-                                         f.write(chunk)
-                                         downloaded += len(chunk)
-                                         
-                                         # Status update
-                                         now_t = time.time()
-                                         if now_t - last_edit_t > 4:
-                                             last_edit_t = now_t
-                                             from utils import render_bar
-                                             pct = f"{int(downloaded/total_size*100)}%" if total_size else "..."
-                                             bar = render_bar(downloaded, total_size) if total_size else "░░░░░░░░░░"
-                                             mb = downloaded / (1024*1024)
-                                             speed = mb / (now_t - start_t) if (now_t - start_t) > 0 else 0
-                                             await status.edit(f"⏳ **Descargando...**\n**{pct}**\n⚡ {speed:.2f} MB/s")
-                                             
-                                 final = final_temp
-                             else:
-                                 await status.edit(f"❌ Error descarga: {resp.status}")
-                                 return
+                     final = await segmented_dl.download(
+                         url_descarga, seg_path,
+                         headers=seg_headers,
+                         cookies=load_cookies_dict(sel_cookie(url)),
+                         on_progress=seg_progress,
+                         probed=probed
+                     )
                  except Exception as e:
-                      print(f"Native DL Error: {e}")
-                      await status.edit(f"❌ Error interno: {e}")
-                      return
+                     print(f"Native DL Error: {e}")
+                     await status.edit(f"❌ Error descarga: {e}")
+                     return
+
+             elif await aria2.available():
+                 # ARIA2 RPC: el daemon residente hace la descarga (sin proceso por trabajo)
+                 rpc_headers = {}
+                 if yourupload_link:
+                     rpc_headers["Referer"] = url
+
+                 from utils import load_cookies_dict, render_bar, format_bytes
+                 cookies = load_cookies_dict(sel_cookie(url))
+                 if cookies:
+                     rpc_headers["Cookie"] = "; ".join(f"{k}={v}" for k, v in cookies.items())
+
+                 async def rpc_progress(done, total, speed):
+                     nonlocal last_edit
+                     now_t = time.time()
+                     if (now_t - last_edit) < 4: return
+                     last_edit = now_t
+                     pct = f"{done * 100 / total:.1f}%" if total else "..."
+                     bar = render_bar(done, total) if total else "░" * 10
+                     await status.edit(
+                         f"⏳ **Descargando...**\n"
+                         f"📥 {calidad}\n"
+                         f"🚀 **Motor:** Aria2 (RPC)\n\n"
+                         f"{bar} **{pct}**\n"
+                         f"📦 {format_bytes(done)} / {format_bytes(total)}\n"
+                         f"⚡ **{format_bytes(speed)}/s**"
+                     )
+
+                 try:
+                     final = await aria2.download(
+                         url_descarga, DOWNLOAD_DIR, temp_out,
+                         headers=rpc_headers,
+                         on_start=lambda gid: add_active(chat_id, msg_orig.id, None, gid=gid),
+                         on_progress=rpc_progress
+                     )
+                 except Aria2Error as e:
+                     print(f"Aria2 RPC Error: {e}")
+                     await status.edit(f"❌ Error descarga (Aria2): {e}")
+                     return
 
              else:
-                 # ARIA2 BLOCK (Solo si existe)
+                 # ARIA2 BLOCK (Solo si existe y el daemon RPC no responde)
                  cmd = [
                      FAST_PATH if os.path.exists(FAST_PATH) else "aria"+"2c", 
                      url_descarga,
@@ -405,6 +571,7 @@ async def procesar_descarga(client, chat_id, url, calidad, datos, msg_orig):
                      cmd.extend(["--load-cookies", cookie_file])
 
                  process = await asyncio.create_subprocess_exec(*cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+                 add_active(chat_id, msg_orig.id, None, process.pid)
                  
                  # Loop simple de progreso (Aria2)
                  start_t = time.time()
@@ -424,20 +591,6 @@ async def procesar_descarga(client, chat_id, url, calidad, datos, msg_orig):
                      except: pass
                  
                  final = final_temp
-             
-             # Loop simple de progreso
-             start_t = time.time()
-             while process.returncode is None:
-                 try:
-                     await asyncio.sleep(3)
-                     elapsed = int(time.time() - start_t)
-                     await status.edit(f"⏳ **Descargando...**\n🚀 **Motor:** {engine_name}\n⏱ Tiempo: {elapsed}s")
-                 except: pass
-                 
-                 if process.returncode is not None: break
-                 try: 
-                    await asyncio.wait_for(process.wait(), timeout=0.1)
-                 except: pass
 
              final_temp = os.path.join(DOWNLOAD_DIR, temp_out)
              if os.path.exists(final_temp):
@@ -492,9 +645,10 @@ async def procesar_descarga(client, chat_id, url, calidad, datos, msg_orig):
                     use_fast = True
             
             # Helper para ejecutar descarga
+            # Reutiliza el info-dict del análisis (si sigue vigente) en vez de re-extraer
             async def run_ytdlp(options):
-                with yt_dlp.YoutubeDL(options) as ydl:
-                    await loop.run_in_executor(None, lambda: ydl.download([url_descarga]))
+                info = info_cache.get(url_descarga)
+                await run_in('io', lambda: download_with_info(options, url_descarga, info))
 
             # Intento 1: FAST (si aplica)
             if use_fast:
@@ -702,78 +856,50 @@ async def procesar_descarga(client, chat_id, url, calidad, datos, msg_orig):
             # No sacamos thumb ni meta de video
             pass
         
-        files_to_send = [final]
-        is_split = False
-            
-        # --- LÓGICA DE CORTE (SPLIT) - SOLO SI ES VIDEO ---
-        # Si es un ZIP de 3GB, Telegram permite hasta 2GB (4GB con Premium, bot tiene 2GB limit por API a veces)
-        # Si es Documento > 2GB, fallará. Split de ZIPs es complejo.
-        # Por ahora solo cortamos VIDEO.
-        
-        print(f"ℹ️ DEBUG: Checking Split logic. Size {file_size} > {TG_LIMIT} ? {file_size > TG_LIMIT}")
-        
-        if is_video and file_size > TG_LIMIT and calidad != "mp3":
-            from utils import split_video_generic, format_bytes
-            
-            sz_fmt = format_bytes(file_size)
-            num_parts = int(-(-file_size // TG_LIMIT)) 
-            est_part_size = format_bytes(file_size / num_parts)
+        # SAFEGUARD: Validar Thumb (Existencia y Tamaño)
+        thumb_ok = thumb
+        if thumb and (not os.path.exists(thumb) or os.path.getsize(thumb) == 0):
+            print(f"⚠️ Invalid Thumb (Missing/Empty): {thumb}")
+            thumb_ok = None
 
-            print(f"✂️ DEBUG: SPLIT TRIGGERED. Parts: {num_parts}")
-            await status.edit(
-                f"✂️ **Video Grande Detectado ({sz_fmt})**\n"
-                f"🔪 Cortando en **{num_parts} partes** de ~**{est_part_size}**\n"
-                "⏳ Por favor espera..."
-            )
+        async def armar_caption(i, f_path, total_parts, cur_dur):
+            # Caption solo si conf tiene meta activado
+            if not conf.get('meta'): return ""
+            t = datos.get('titulo','Archivo')
+            # Si es mediafire y tenemos filename en path, usarlo
+            if is_direct_download: t = os.path.basename(f_path)
             
-            loop = asyncio.get_running_loop()
-            new_files = await loop.run_in_executor(None, lambda: split_video_generic(final, 'parts', num_parts))
+            if total_parts > 1: t += f" [Parte {i+1}/{total_parts}]"
             
-            print(f"✂️ DEBUG: Split result: {len(new_files)} files.")
-            if new_files:
-                files_to_send = new_files
-                is_split = True
-                try: os.remove(final) 
-                except: pass
+            if conf.get('lang') == 'es' and not is_direct_download: t = await traducir_texto(t) # Traducir solo si no es filename literal
+            
+            tags = [f"#{x.replace(' ','_')}" for x in (datos.get('tags') or [])[:10]]
+            res_str = f"{w}x{h}" if w else ("Audio" if calidad=="mp3" else "Archivo")
+            cap = f"🎬 **{t}**\n⚙️ {res_str}"
+            if cur_dur: cap += f" | ⏱ {time.strftime('%H:%M:%S', time.gmtime(cur_dur))}"
+            if tags: cap += f"\n{' '.join(tags)}"
+            return cap[:1024]
+
+        # --- SUBIDA DE UNA PARTE ---
+        # total_parts > 1 = video cortado (caption con [Parte i/N], sin guardar en caché)
+        async def subir_parte(i, f_path, total_parts):
+            is_split = total_parts > 1
 
-        # --- BUCLE DE SUBIDA ---
-        for i, f_path in enumerate(files_to_send):
             # SAFEGUARD: Verificar existencia real y tamaño > 0
             if not os.path.exists(f_path) or os.path.getsize(f_path) == 0:
                 print(f"❌ Skipping 0-byte/missing file: {f_path}")
-                continue
+                return None
 
-            # SAFEGUARD: Validar Thumb (Existencia y Tamaño)
-            current_thumb = thumb
-            if current_thumb:
-                if not os.path.exists(current_thumb) or os.path.getsize(current_thumb) == 0:
-                    print(f"⚠️ Invalid Thumb (Missing/Empty): {current_thumb}")
-                    current_thumb = None
+            current_thumb = thumb_ok
 
-            msg_label = f"📤 **Subiendo Parte {i+1}/{len(files_to_send)}...**" if is_split else "📤 **Subiendo...**"
+            msg_label = f"📤 **Subiendo Parte {i+1}/{total_parts}...**" if is_split else "📤 **Subiendo...**"
             await status.edit(msg_label)
             
             cur_dur = dur
             if is_split:
                  _, _, cur_dur = await get_meta(f_path)
             
-            cap = ""
-            # Caption solo si conf tiene meta activado
-            if conf.get('meta'):
-                t = datos.get('titulo','Archivo')
-                # Si es mediafire y tenemos filename en path, usarlo
-                if is_direct_download: t = os.path.basename(f_path)
-                
-                if is_split: t += f" [Parte {i+1}/{len(files_to_send)}]"
-                
-                if conf.get('lang') == 'es' and not is_direct_download: t = await traducir_texto(t) # Traducir solo si no es filename literal
-                
-                tags = [f"#{x.replace(' ','_')}" for x in (datos.get('tags') or [])[:10]]
-                res_str = f"{w}x{h}" if w else ("Audio" if calidad=="mp3" else "Archivo")
-                cap = f"🎬 **{t}**\n⚙️ {res_str}"
-                if cur_dur: cap += f" | ⏱ {time.strftime('%H:%M:%S', time.gmtime(cur_dur))}"
-                if tags: cap += f"\n{' '.join(tags)}"
-                cap = cap[:1024]
+            cap = await armar_caption(i, f_path, total_parts, cur_dur)
 
             act = enums.ChatAction.UPLOAD_AUDIO if calidad == "mp3" else (enums.ChatAction.UPLOAD_VIDEO if is_video else enums.ChatAction.UPLOAD_DOCUMENT)
             
@@ -844,9 +970,6 @@ async def procesar_descarga(client, chat_id, url, calidad, datos, msg_orig):
             # User requested to remove this feature.
             # We now rely solely on the File ID from the user chat.
 
-
-
-
             # Guardar en Firebase (y DB local si se quiere, por ahora solo Firebase)
             # FIX: Quitamos restricción de html_ para que guarde JAVs también.
             if res and vid_id and not is_split:
@@ -857,11 +980,81 @@ async def procesar_descarga(client, chat_id, url, calidad, datos, msg_orig):
                 
                 if fid:
                     print(f"💾 DEBUG: Saving cache for {vid_id} | FID: {fid}[:10]...")
-                    await save_cached_file(vid_id, ckey, fid, meta=datos)
+                    media_cache.put(vid_id, ckey, fid, meta=datos)
+                    coalescer.resolve(flight_key, fid)
+            return res
             
-            if is_split:
-                try: os.remove(f_path)
-                except: pass
+        # --- LÓGICA DE CORTE (SPLIT) - SOLO SI ES VIDEO ---
+        # Si es un ZIP de 3GB, Telegram permite hasta 2GB (4GB con Premium, bot tiene 2GB limit por API a veces)
+        # Si es Documento > 2GB, fallará. Split de ZIPs es complejo.
+        # Por ahora solo cortamos VIDEO.
+        
+        print(f"ℹ️ DEBUG: Checking Split logic. Size {file_size} > {TG_LIMIT} ? {file_size > TG_LIMIT}")
+        
+        if is_video and file_size > TG_LIMIT and calidad != "mp3":
+            sz_fmt = format_bytes(file_size)
+            num_parts = int(-(-file_size // TG_LIMIT)) 
+            est_part_size = format_bytes(file_size / num_parts)
+
+            print(f"✂️ DEBUG: SPLIT TRIGGERED. Parts: {num_parts}")
+            await status.edit(
+                f"✂️ **Video Grande Detectado ({sz_fmt})**\n"
+                f"🔪 Cortando en **{num_parts} partes** de ~**{est_part_size}**\n"
+                "⏳ La subida empieza con la primera parte..."
+            )
+            
+            async def enviar_parte(input_file, f_path, cap, cur_dur):
+                name = os.path.basename(f_path)
+                as_video = not conf.get('doc_mode')
+                try:
+                    return await send_uploaded(
+                        client, chat_id, input_file, name, cap, as_video=as_video,
+                        width=w, height=h, duration=cur_dur, thumb=thumb_ok, reply_to_message_id=msg_orig.id
+                    )
+                except FloodWait:
+                    raise
+                except Exception as e:
+                    if not as_video: raise
+                    # Mismo archivo ya subido, solo cambia el tipo de mensaje
+                    print(f"⚠️ Falló envío de parte como video ({e}), reintentando como documento")
+                    return await send_uploaded(client, chat_id, input_file, name, cap, reply_to_message_id=msg_orig.id)
+
+            # Tubería + subida paralela: ffmpeg corta la parte N+1 mientras varias partes suben a la vez.
+            # Cada parte se borra (y ffmpeg se reanuda) en cuanto su mensaje sale.
+            uploader = ParallelUploader(
+                client, total=file_size, progress=progreso,
+                progress_args=(status, [time.time(),0], enums.ChatAction.UPLOAD_VIDEO)
+            )
+            pipe = SplitPipeline(final, 'parts', num_parts, max_in_flight=max(SPLIT_MAX_IN_FLIGHT, UPLOAD_PARALLEL))
+            sent_parts = 0
+            try:
+                async for f_path in pipe:
+                    if sent_parts == 0 and pipe.pid:
+                        add_active(chat_id, msg_orig.id, pid=pipe.pid)
+                    total_parts = max(num_parts, sent_parts + 1)
+                    _, _, cur_dur = await get_meta(f_path)
+                    cap = await armar_caption(sent_parts, f_path, total_parts, cur_dur)
+                    uploader.submit(
+                        f_path,
+                        lambda inp, p=f_path, c=cap, d=cur_dur: enviar_parte(inp, p, c, d),
+                        on_done=pipe.release
+                    )
+                    sent_parts += 1
+                results = await uploader.wait()
+            finally:
+                await uploader.close()
+                await pipe.close()
+
+            for i, r in enumerate(results):
+                if isinstance(r, Exception):
+                    await client.send_message(chat_id, f"❌ Error crítico subiendo parte {i+1}: {r}")
+
+            print(f"✂️ DEBUG: Split result: {sent_parts} parts sent.")
+            if sent_parts == 0:
+                # ffmpeg no produjo partes: intentar con el archivo completo
+                await subir_parte(0, final, 1)
+        else:
+            await subir_parte(0, final, 1)
 
     except Exception as e:
         import traceback
@@ -869,6 +1062,7 @@ async def procesar_descarga(client, chat_id, url, calidad, datos, msg_orig):
         print(f"Excepción: {e}")
         if status: await status.edit(f"❌ Error: {e}")
     finally:
+        if flight: coalescer.finish(flight_key)
         remove_active(chat_id, msg_orig.id) # Cleanup Anti-Spam
         # Cleanup específico de la sesión actual
         for f in [final, thumb, f"dl_{chat_id}_{ts}.jpg"]:
@@ -0,0 +1,149 @@
+import os
+import sys
+import time
+import asyncio
+import importlib
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+# --- POOLS DE HILOS CON NOMBRE ---
+# Antes todo iba a run_in_executor(None, ...): una descarga larga de yt-dlp ocupaba el mismo
+# pool que una lectura de Firestore de 5s. Cada tipo de trabajo tiene ahora su pool con su
+# tamaño, y cada pool mide la cola (trabajos esperando hilo) y el tiempo de espera.
+#   io        -> descargas yt-dlp, galerías, traducción (red, larga duración)
+#   cpu       -> ffmpeg/ffprobe (split, cortes), descompresión de ZIPs
+#   firestore -> llamadas bloqueantes del SDK de Firebase (cortas, interactivas)
+#   extract   -> análisis yt-dlp (extract_info)
+# Además hay un pool de PROCESOS para trabajo CPU puro en Python (conversión de imágenes con
+# PIL), que con hilos quedaría serializado por el GIL.
+
+POOL_SIZES = {
+    'io': int(os.environ.get("EXEC_IO_WORKERS", 16)),
+    'cpu': int(os.environ.get("EXEC_CPU_WORKERS", os.cpu_count() or 2)),
+    'firestore': int(os.environ.get("EXEC_FIRESTORE_WORKERS", 8)),
+    'extract': int(os.environ.get("EXEC_EXTRACT_WORKERS", 4)),
+}
+EXEC_PROC_WORKERS = int(os.environ.get("EXEC_PROC_WORKERS", os.cpu_count() or 2))
+EXEC_WARN_WAIT = float(os.environ.get("EXEC_WARN_WAIT", 2.0))  # segundos en cola antes de avisar
+
+
+class NamedPool:
+    def __init__(self, name, workers):
+        self.name = name
+        self.workers = max(1, workers)
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=f"pool-{name}")
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    async def run(self, fn, *args):
+        """Ejecuta fn(*args) en este pool y espera el resultado."""
+        t_submit = time.monotonic()
+        state = {'started': False, 'dropped': False}
+
+        def job():
+            waited = time.monotonic() - t_submit
+            with self._lock:
+                state['started'] = True
+                if not state['dropped']: self.queued -= 1
+                self.running += 1
+                self.wait_total += waited
+                self.wait_max = max(self.wait_max, waited)
+            if waited > EXEC_WARN_WAIT:
+                print(f"⚠️ [Pool {self.name}] Trabajo esperó {waited:.1f}s por un hilo ({self.workers} hilos)")
+            try:
+                return fn(*args)
+            finally:
+                with self._lock:
+                    self.running -= 1
+                    self.completed += 1
+
+        with self._lock:
+            self.queued += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, job)
+        except asyncio.CancelledError:
+            # Cancelado antes de conseguir hilo: ya no cuenta como encolado
+            with self._lock:
+                if not state['started']:
+                    self.queued -= 1
+                    state['dropped'] = True
+            raise
+
+    def stats(self):
+        with self._lock:
+            done = self.completed + self.running
+            return {
+                'workers': self.workers,
+                'queued': self.queued,
+                'running': self.running,
+                'completed': self.completed,
+                'wait_avg': (self.wait_total / done) if done else 0.0,
+                'wait_max': self.wait_max,
+            }
+
+
+_pools = {name: NamedPool(name, size) for name, size in POOL_SIZES.items()}
+
+
+def get_pool(name):
+    return _pools[name]
+
+
+async def run_in(name, fn, *args):
+    """Atajo: await run_in('firestore', doc_ref.get)."""
+    return await _pools[name].run(fn, *args)
+
+
+def stats():
+    return {name: p.stats() for name, p in _pools.items()}
+
+
+_process_pool = None
+
+
+class _LightSpawnProcess(multiprocessing.context.SpawnProcess):
+    """Proceso 'spawn' que arranca con proc_entry como __main__ en vez de main.py."""
+
+    def start(self):
+        real_main = sys.modules['__main__']
+        sys.modules['__main__'] = importlib.import_module('proc_entry')
+        try:
+            super().start()
+        finally:
+            sys.modules['__main__'] = real_main
+
+
+class _LightSpawnContext(multiprocessing.context.SpawnContext):
+    Process = _LightSpawnProcess
+
+
+def get_process_pool():
+    """
+    Pool de procesos (creado al primer uso). 'spawn': no heredar hilos ni sockets del bot.
+    Cada worker se lanza con proc_entry como __main__, así no re-ejecuta main.py (Firebase,
+    SQLite, Client de Pyrogram) al arrancar.
+    """
+    global _process_pool
+    if _process_pool is None:
+        _process_pool = ProcessPoolExecutor(max_workers=max(1, EXEC_PROC_WORKERS), mp_context=_LightSpawnContext())
+    return _process_pool
+
+
+def reset_process_pool():
+    """Descarta un pool roto (BrokenProcessPool: un worker murió) para que el próximo uso cree otro."""
+    global _process_pool
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=False, cancel_futures=True)
+        _process_pool = None
+
+
+def shutdown():
+    """Libera los hilos y procesos al apagar (no espera trabajos en curso)."""
+    for p in _pools.values():
+        p.executor.shutdown(wait=False, cancel_futures=True)
+    reset_process_pool()
@@ -2,7 +2,11 @@ import firebase_admin
 from firebase_admin import credentials, firestore
 import os
 import json
+import copy
+import time
+import random
 import asyncio
+from executors import run_in
 
 # Variable global para el cliente de Firestore
 db = None
@@ -54,48 +58,257 @@ from config import BOT_TOKEN
 BOT_ID = BOT_TOKEN.split(":")[0] if ":" in BOT_TOKEN else "global"
 CACHE_COLLECTION = f"media_cache_{BOT_ID}"
 
+# --- COLA DE ESCRITURAS (WRITE-BEHIND) ---
+# Cada save_* hacía su propio doc_ref.set() (un round trip por llamada; un usuario tocando
+# ajustes disparaba uno por toque). Ahora las escrituras se encolan por documento:
+# - Varias escrituras al mismo documento se fusionan en una (como set(merge=True) sucesivos).
+# - Se envían en WriteBatch de hasta 500 cada FIRESTORE_FLUSH_SECS o al llegar a FIRESTORE_FLUSH_SIZE.
+# - Si el commit falla se reintenta con backoff; lo que no entra vuelve a la cola.
+# - Las lecturas de este módulo ven lo pendiente (read-your-writes) y boot_services vacía la cola al apagar.
+
+FIRESTORE_FLUSH_SECS = float(os.environ.get("FIRESTORE_FLUSH_SECS", 2))
+FIRESTORE_FLUSH_SIZE = int(os.environ.get("FIRESTORE_FLUSH_SIZE", 200))
+FIRESTORE_BATCH_MAX = 500   # Límite de Firestore por WriteBatch
+FIRESTORE_WRITE_RETRIES = 5
+
+
+def _deep_merge(base, extra):
+    """Fusión como set(merge=True): los dicts anidados se combinan, el resto se reemplaza."""
+    out = dict(base)
+    for k, v in extra.items():
+        if isinstance(v, dict) and isinstance(out.get(k), dict):
+            out[k] = _deep_merge(out[k], v)
+        else:
+            out[k] = v
+    return out
+
+
+class WriteQueue:
+    def __init__(self):
+        # {(colección, doc_id): (data o None si es borrado, merge)}
+        self._pending = {}
+        self._task = None
+        self._wake = None
+        self._flush_lock = None
+        self.committed = 0
+        self.batches = 0
+        self.failed = 0
+
+    def _start(self):
+        if self._task is None or self._task.done():
+            self._wake = asyncio.Event()
+            self._flush_lock = asyncio.Lock()
+            self._task = asyncio.create_task(self._run())
+
+    def _put(self, key, data, merge):
+        old = self._pending.get(key)
+        if old is not None and merge:
+            old_data, old_merge = old
+            # Borrado + set(merge) equivale a un set completo
+            data, merge = _deep_merge(old_data or {}, data), old_merge
+        self._pending.pop(key, None)
+        self._pending[key] = (data, merge)
+
+    def set(self, collection, doc_id, data, merge=True):
+        self._put((collection, str(doc_id)), data, merge)
+        doc_cache.invalidate(collection, doc_id)
+        self._start()
+        if len(self._pending) >= FIRESTORE_FLUSH_SIZE: self._wake.set()
+
+    def delete(self, collection, doc_id):
+        self._put((collection, str(doc_id)), None, False)
+        doc_cache.invalidate(collection, doc_id)
+        self._start()
+
+    def pending(self, collection, doc_id):
+        """(data, merge) aún no enviado para el documento, o None."""
+        return self._pending.get((collection, str(doc_id)))
+
+    def overlay(self, collection, doc_id, data):
+        """
+        Aplica lo pendiente sobre un documento leído (dict o None si no existe).
+        Retorna el dict resultante o None si el documento está (o quedará) borrado.
+        """
+        item = self.pending(collection, doc_id)
+        if item is None: return data
+        p_data, merge = item
+        if p_data is None: return None
+        return _deep_merge(data or {}, p_data) if merge else dict(p_data)
+
+    async def _run(self):
+        while True:
+            try: await asyncio.wait_for(self._wake.wait(), timeout=FIRESTORE_FLUSH_SECS)
+            except asyncio.TimeoutError: pass
+            self._wake.clear()
+            if self._pending: await self.flush()
+
+    def _commit(self, items):
+        batch = db.batch()
+        for (collection, doc_id), (data, merge) in items:
+            ref = db.collection(collection).document(doc_id)
+            if data is None: batch.delete(ref)
+            else: batch.set(ref, data, merge=merge)
+        batch.commit()
+
+    async def flush(self):
+        """Envía todo lo pendiente (en lotes de FIRESTORE_BATCH_MAX)."""
+        if not db or not self._pending: return
+        async with self._flush_lock:
+            items = list(self._pending.items())
+            self._pending = {}
+            for i in range(0, len(items), FIRESTORE_BATCH_MAX):
+                chunk = items[i:i + FIRESTORE_BATCH_MAX]
+                for attempt in range(FIRESTORE_WRITE_RETRIES):
+                    try:
+                        await run_in('firestore', self._commit, chunk)
+                        self.committed += len(chunk)
+                        self.batches += 1
+                        break
+                    except Exception as e:
+                        if attempt == FIRESTORE_WRITE_RETRIES - 1:
+                            print(f"❌ [Firebase] Lote de {len(chunk)} escrituras falló: {e}. Se reintentará.")
+                            self.failed += 1
+                            self._requeue(items[i:])
+                            return
+                        await asyncio.sleep(min(30, 2 ** attempt) + random.random())
+
+    def _requeue(self, items):
+        # Lo escrito después del fallo es más nuevo: va encima de lo que no se pudo enviar
+        newer = self._pending
+        self._pending = {}
+        for key, (data, merge) in items:
+            self._pending[key] = (data, merge)
+        for key, (data, merge) in newer.items():
+            self._put(key, data, merge)
+
+    def stats(self):
+        return {
+            'pending': len(self._pending),
+            'committed': self.committed,
+            'batches': self.batches,
+            'failed': self.failed,
+        }
+
+    async def close(self):
+        """Vacía la cola (llamado al apagar)."""
+        if self._task:
+            # Con el lock tomado el flusher no tiene un lote a medias: se puede cancelar sin perder nada
+            async with self._flush_lock:
+                self._task.cancel()
+            try: await self._task
+            except BaseException: pass
+        await self.flush()
+
+
+# Instancia única del proceso
+write_queue = WriteQueue()
+
+# --- LECTURAS EN LOTE + CACHE DE LECTURA ---
+# get_cached_file hacía un doc_ref.get() por llamada (el warmer de portadas, uno por manga).
+# get_docs resuelve muchos documentos con un solo get_all (hasta FIRESTORE_GETALL_MAX por RPC)
+# y guarda el resultado FIRESTORE_READ_TTL segundos; los documentos inexistentes también se
+# recuerdan (FIRESTORE_NEG_TTL) para no preguntar de nuevo en cada chequeo. Escribir un
+# documento (write_queue) lo invalida.
+
+FIRESTORE_READ_TTL = float(os.environ.get("FIRESTORE_READ_TTL", 60))
+FIRESTORE_NEG_TTL = float(os.environ.get("FIRESTORE_NEG_TTL", 30))
+FIRESTORE_GETALL_MAX = 100
+FIRESTORE_READ_TIMEOUT = 5.0
+
+
+class DocCache:
+    def __init__(self, ttl=FIRESTORE_READ_TTL, neg_ttl=FIRESTORE_NEG_TTL, max_entries=5000):
+        self.ttl = ttl
+        self.neg_ttl = neg_ttl
+        self.max_entries = max_entries
+        self._data = {}   # {(colección, doc_id): (timestamp, dict o None)}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, collection, doc_id):
+        """(True, dict o None) si hay entrada vigente, (False, None) si hay que leer."""
+        key = (collection, str(doc_id))
+        item = self._data.get(key)
+        if item:
+            ts, data = item
+            if time.time() - ts < (self.ttl if data is not None else self.neg_ttl):
+                self.hits += 1
+                return True, data
+            self._data.pop(key, None)
+        self.misses += 1
+        return False, None
+
+    def put(self, collection, doc_id, data):
+        if len(self._data) >= self.max_entries:
+            # Descartar el más antiguo (dict mantiene orden de inserción)
+            self._data.pop(next(iter(self._data)), None)
+        key = (collection, str(doc_id))
+        self._data.pop(key, None)
+        self._data[key] = (time.time(), data)
+
+    def invalidate(self, collection, doc_id):
+        self._data.pop((collection, str(doc_id)), None)
+
+
+doc_cache = DocCache()
+
+
+def _get_all(collection, doc_ids):
+    refs = [db.collection(collection).document(d) for d in doc_ids]
+    return {snap.id: (snap.to_dict() if snap.exists else None) for snap in db.get_all(refs)}
+
+async def get_docs(collection, doc_ids, timeout=FIRESTORE_READ_TIMEOUT):
+    """
+    Lee varios documentos: cache primero, el resto con get_all en lotes.
+    Retorna {doc_id: dict o None} (None = no existe). Los que fallen por error/timeout no aparecen.
+    """
+    result, missing = {}, []
+    for doc_id in dict.fromkeys(str(d) for d in doc_ids):
+        hit, data = doc_cache.get(collection, doc_id)
+        if hit: result[doc_id] = data
+        else: missing.append(doc_id)
+
+    if db:
+        for i in range(0, len(missing), FIRESTORE_GETALL_MAX):
+            chunk = missing[i:i + FIRESTORE_GETALL_MAX]
+            try:
+                fetched = await asyncio.wait_for(run_in('firestore', _get_all, collection, chunk), timeout=timeout)
+            except asyncio.TimeoutError:
+                print(f"⚠️ [Firebase] Lectura en lote Timeout ({len(chunk)} docs) - Saltando cache.")
+                continue
+            except Exception as e:
+                print(f"⚠️ [Firebase] Error en lectura en lote: {e}")
+                continue
+            for doc_id in chunk:
+                data = fetched.get(doc_id)
+                doc_cache.put(collection, doc_id, data)
+                result[doc_id] = data
+
+    # Lo pendiente en la cola de escrituras manda sobre lo leído
+    return {d: copy.deepcopy(write_queue.overlay(collection, d, data)) for d, data in result.items()}
+
+async def get_cached_files(lookups):
+    """
+    lookups: lista de (video_id, quality). Un solo get_all para todo.
+    Retorna {(video_id, quality): file_id o None}; las que no se pudieron leer no aparecen.
+    """
+    docs = await get_docs(CACHE_COLLECTION, [v for v, _ in lookups])
+    return {(v, q): (docs[str(v)] or {}).get(q) for v, q in lookups if str(v) in docs}
+
 async def get_cached_file(video_id, quality):
     """
     Busca en la colección del bot actual si existe el file_id.
     Retorna el file_id o None.
     """
-    if not db: return None
-
-    try:
-        # Usamos el video_id como ID del documento para búsqueda rápida O(1)
-        doc_ref = db.collection(CACHE_COLLECTION).document(str(video_id))
-        
-        loop = asyncio.get_running_loop()
-        # FIX: Añadir timeout de 5s para evitar hanging si Firebase falla
-        try:
-            doc = await asyncio.wait_for(loop.run_in_executor(None, doc_ref.get), timeout=5.0)
-        except asyncio.TimeoutError:
-            print(f"⚠️ [Firebase] Cache Read Timeout ({video_id}) - Saltando cache.")
-            return None
-        
-        if doc.exists:
-            data = doc.to_dict()
-            # data estructura: {'mp3': 'file_id_1', '720': 'file_id_2', ...}
-            return data.get(quality)
-        return None
-    except Exception as e:
-        print(f"⚠️ [Firebase] Error leyendo cache: {e}")
-        return None
+    # Usamos el video_id como ID del documento para búsqueda rápida O(1)
+    # data estructura: {'mp3': 'file_id_1', '720': 'file_id_2', ...}
+    return (await get_cached_files([(video_id, quality)])).get((video_id, quality))
 
 async def get_cached_data(video_id):
     """
     Retorna el documento completo del cache (incluyendo meta y todos los formatos).
     """
-    if not db: return None
-    try:
-        doc_ref = db.collection(CACHE_COLLECTION).document(str(video_id))
-        loop = asyncio.get_running_loop()
-        doc = await loop.run_in_executor(None, doc_ref.get)
-        
-        if doc.exists: return doc.to_dict()
-    except Exception as e:
-        print(f"⚠️ [Firebase] Error leyendo data cache: {e}")
-    return None
+    return (await get_docs(CACHE_COLLECTION, [video_id])).get(str(video_id))
 
 async def save_cached_file(video_id, quality, file_id, meta=None):
     """
@@ -104,8 +317,6 @@ async def save_cached_file(video_id, quality, file_id, meta=None):
     if not db: return
     
     try:
-        doc_ref = db.collection(CACHE_COLLECTION).document(str(video_id))
-        
         # Usamos set con merge=True para no borrar otras calidades
         update_data = {
             quality: file_id,
@@ -115,8 +326,7 @@ async def save_cached_file(video_id, quality, file_id, meta=None):
         if meta:
             update_data['meta'] = meta # Título, duración, etc si queremos guardar info extra
             
-        loop = asyncio.get_running_loop()
-        await loop.run_in_executor(None, lambda: doc_ref.set(update_data, merge=True))
+        write_queue.set(CACHE_COLLECTION, video_id, update_data)
         
         print(f"🔥 [Firebase] Cache guardado: {video_id} [{quality}]")
     except Exception as e:
@@ -128,9 +338,7 @@ async def delete_cached_file(video_id):
     """
     if not db: return
     try:
-        doc_ref = db.collection(CACHE_COLLECTION).document(str(video_id))
-        loop = asyncio.get_running_loop()
-        await loop.run_in_executor(None, doc_ref.delete)
+        write_queue.delete(CACHE_COLLECTION, video_id)
         print(f"🗑 [Firebase] Cache eliminado: {video_id}")
     except Exception as e:
         print(f"⚠️ [Firebase] Error eliminando cache: {e}")
@@ -143,12 +351,9 @@ async def get_bot_config():
     if not db: return {}
     try:
         doc_ref = db.collection('bot_settings').document('global_config')
-        loop = asyncio.get_running_loop()
-        doc = await loop.run_in_executor(None, doc_ref.get)
+        doc = await run_in('firestore', doc_ref.get)
         
-        if doc.exists:
-            return doc.to_dict()
-        return {}
+        return write_queue.overlay('bot_settings', 'global_config', doc.to_dict() if doc.exists else None) or {}
     except Exception as e:
         print(f"⚠️ [Firebase] Error leyendo config global: {e}")
         return {}
@@ -159,10 +364,7 @@ async def save_bot_config(key, value):
     """
     if not db: return False
     try:
-        doc_ref = db.collection('bot_settings').document('global_config')
-        
-        loop = asyncio.get_running_loop()
-        await loop.run_in_executor(None, lambda: doc_ref.set({key: value}, merge=True))
+        write_queue.set('bot_settings', 'global_config', {key: value})
         
         print(f"🔥 [Firebase] Config guardada: {key} = {value}")
         return True
@@ -175,8 +377,7 @@ async def load_all_user_configs():
     if not db: return {}
     try:
         # Ejecutar en thread pool para no bloquear
-        loop = asyncio.get_running_loop()
-        docs = await loop.run_in_executor(None, lambda: db.collection('user_configs').stream())
+        docs = await run_in('firestore', lambda: db.collection('user_configs').stream())
         
         # Stream devuelve un generador, iterarlo puede bloquear si son muchos,
         # pero es necesario para poblar la RAM inicial.
@@ -191,13 +392,21 @@ async def load_all_user_configs():
         print(f"⚠️ [Firebase] Config Load Error: {e}")
         return {}
 
+async def load_user_configs(chat_ids):
+    """
+    Config guardada de uno o varios chats (get_all en lote + cache de lectura).
+    Retorna {chat_id: dict o None si no tiene}; los que no se pudieron leer no aparecen.
+    """
+    if not db: return {c: None for c in chat_ids}
+    docs = await get_docs('user_configs', chat_ids)
+    return {c: docs[str(c)] for c in chat_ids if str(c) in docs}
+
 async def save_user_config_fb(chat_id, config_data):
     """Guarda/Actualiza la config de un usuario."""
     if not db: return
     try:
-        # Fire-and-forget sync wrapper
-        loop = asyncio.get_running_loop()
-        await loop.run_in_executor(None, lambda: db.collection('user_configs').document(str(chat_id)).set(config_data, merge=True))
+        # Se fusiona con otros cambios del mismo usuario y sale en el próximo lote
+        write_queue.set('user_configs', chat_id, dict(config_data))
     except Exception as e:
          print(f"❌ [Firebase] Save Config Error: {e}")
 
@@ -205,8 +414,7 @@ async def load_all_hashtags():
     """Carga todos los hashtags."""
     if not db: return {}
     try:
-        loop = asyncio.get_running_loop()
-        docs = await loop.run_in_executor(None, lambda: db.collection('hashtags').stream())
+        docs = await run_in('firestore', lambda: db.collection('hashtags').stream())
         
         data = {}
         for doc in docs:
@@ -220,61 +428,88 @@ async def load_all_hashtags():
 async def save_hashtag_fb(tag, msgs_list):
     if not db: return
     try:
-        loop = asyncio.get_running_loop()
-        await loop.run_in_executor(None, lambda: db.collection('hashtags').document(tag).set({'msgs': msgs_list}, merge=True))
+        write_queue.set('hashtags', tag, {'msgs': list(msgs_list)})
     except Exception as e:
         print(f"❌ [Firebase] Save Tag Error: {e}")
 
+# --- CONTADOR DE USUARIOS (SHARDED) ---
+# El contador era leer stats.user_count + escribir +1 (dos RPC, y dos /start simultáneos
+# perdían cuentas). Ahora cada alta suma Increment(1) en uno de USER_COUNTER_SHARDS documentos
+# al azar (bot_settings/stats/user_count_shards/N), en el MISMO WriteBatch que crea al usuario.
+# El total = stats.user_count (valor histórico previo a los shards) + suma de shards, leído
+# con un solo get_all.
+
+USER_COUNTER_SHARDS = int(os.environ.get("USER_COUNTER_SHARDS", 10))
+_registering = set()   # user_ids con alta en curso (dos /start seguidos no cuentan doble)
+_user_count = [0]      # Último total conocido
+
+
+def _stats_ref():
+    return db.collection('bot_settings').document('stats')
+
+def _shard_ref(i):
+    return _stats_ref().collection('user_count_shards').document(str(i))
+
+def _commit_new_user(user_id, user_data):
+    batch = db.batch()
+    batch.set(db.collection('user_configs').document(str(user_id)), user_data, merge=True)
+    batch.set(_shard_ref(random.randrange(USER_COUNTER_SHARDS)), {'count': firestore.Increment(1)}, merge=True)
+    batch.commit()
+
+def _read_user_count():
+    refs = [_stats_ref()] + [_shard_ref(i) for i in range(USER_COUNTER_SHARDS)]
+    total = 0
+    for snap in db.get_all(refs):
+        if not snap.exists: continue
+        data = snap.to_dict()
+        total += data.get('count', 0) if snap.reference.parent.id == 'user_count_shards' else data.get('user_count', 0)
+    return total
+
+async def get_user_count():
+    """Total de usuarios registrados (histórico + shards)."""
+    if not db: return 0
+    try:
+        _user_count[0] = await run_in('firestore', _read_user_count)
+    except Exception as e:
+        print(f"⚠️ [Firebase] Error leyendo contador: {e}")
+    return _user_count[0]
+
 async def register_user(user_id, first_name, username):
     """
     Registra al usuario, cuenta el total y detecta cambio de nombre.
-    Retorna: (is_new, count, name_changed)
+    Retorna: (is_new, count, name_changed). count es el último total conocido (aproximado).
     """
     if not db: return (False, 0, False) # Fallback
+    if user_id in _registering: return (False, 0, False)
 
+    _registering.add(user_id)
     try:
-        # Referencias
-        user_ref = db.collection('user_configs').document(str(user_id))
-        stats_ref = db.collection('bot_settings').document('stats')
-        
-        # Ejecutar transacción (pseudo-transacción para simplificar en async wrapper)
-        # Nota: Firestore async de python no soporta transactions con await facil dentro de lambda
-        # Haremos una logica optimista/separada por simplicidad y velocidad
-        
-        # 1. Obtener User
-        loop = asyncio.get_running_loop()
-        doc = await loop.run_in_executor(None, user_ref.get)
+        # 1. Obtener User (cache de lectura + lo que aún esté en la cola de escrituras)
+        docs = await get_docs('user_configs', [user_id])
+        if str(user_id) not in docs: return (False, 0, False)  # Lectura falló: no arriesgar doble alta
+        data = docs[str(user_id)]
         
-        if not doc.exists:
+        if data is None:
             # --- NUEVO USUARIO ---
-            # 1. Incrementar contador global
-            try:
-                # Lectura + Escritura (Riesgo bajo de colision en low traffic)
-                st_doc = await loop.run_in_executor(None, stats_ref.get)
-                current_count = st_doc.to_dict().get('user_count', 0) if st_doc.exists else 0
-                new_count = current_count + 1
-                await loop.run_in_executor(None, lambda: stats_ref.set({'user_count': new_count}, merge=True))
-            except:
-                new_count = 1 # Fallback
-            
-            # 2. Guardar Usuario
+            # Usuario + contador en un solo commit atómico
             user_data = {
                 'first_name': first_name,
                 'username': username,
                 'joined_at': firestore.SERVER_TIMESTAMP,
                 'user_id': user_id
             }
-            await loop.run_in_executor(None, lambda: user_ref.set(user_data, merge=True))
-            return (True, new_count, False)
+            await run_in('firestore', _commit_new_user, user_id, user_data)
+            doc_cache.invalidate('user_configs', user_id)
+            _user_count[0] += 1
+            return (True, _user_count[0], False)
             
         else:
             # --- USUARIO EXISTENTE ---
-            data = doc.to_dict()
             old_name = data.get('first_name', '')
             
             # Detectar cambio de nombre
             if old_name != first_name:
-                await loop.run_in_executor(None, lambda: user_ref.set({'first_name': first_name, 'username': username}, merge=True))
+                write_queue.set('user_configs', user_id, {'first_name': first_name, 'username': username})
                 return (False, 0, True)
             
             return (False, 0, False)
@@ -282,15 +517,15 @@ async def register_user(user_id, first_name, username):
     except Exception as e:
         print(f"⚠️ [Firebase] Register Error: {e}")
         return (False, 0, False)
+    finally:
+        _registering.discard(user_id)
 
 async def get_global_stats():
-    """Retorna el diccionario de stats (ej: user_count)."""
+    """Retorna el diccionario de stats (ej: user_count, ya sumando los shards)."""
     if not db: return {}
     try:
-        doc_ref = db.collection('bot_settings').document('stats')
-        loop = asyncio.get_running_loop()
-        doc = await loop.run_in_executor(None, doc_ref.get)
-        
-        if doc.exists: return doc.to_dict()
-        return {}
+        doc = await run_in('firestore', _stats_ref().get)
+        stats = doc.to_dict() if doc.exists else {}
+        stats['user_count'] = await get_user_count()
+        return stats
     except: return {}
@@ -0,0 +1,84 @@
+import os
+import aiohttp
+
+# --- CLIENTE HTTP COMPARTIDO ---
+# Una sesión aiohttp por proceso (y por perfil) en lugar de abrir ClientSession en cada
+# llamada: el pool mantiene conexiones keep-alive por host y cachea DNS, así que las
+# llamadas repetidas a Firestore, CDNs de manga o hosts directos se ahorran DNS+TCP+TLS.
+# Nota: aiohttp solo habla HTTP/1.1; el ahorro viene de reutilizar conexiones.
+
+HTTP_POOL_LIMIT = int(os.environ.get("HTTP_POOL_LIMIT", 100))
+HTTP_POOL_PER_HOST = int(os.environ.get("HTTP_POOL_PER_HOST", 16))
+HTTP_DNS_TTL = int(os.environ.get("HTTP_DNS_TTL", 300))
+HTTP_KEEPALIVE = float(os.environ.get("HTTP_KEEPALIVE", 60))
+HTTP_TIMEOUT = float(os.environ.get("HTTP_TIMEOUT", 60))
+
+DEFAULT_UA = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
+
+# Perfiles de pool: cada uno tiene su propio conector y límites
+PROFILES = {
+    'default': {'limit': HTTP_POOL_LIMIT, 'per_host': HTTP_POOL_PER_HOST, 'timeout': HTTP_TIMEOUT},
+    # Daemon aria2 local: pocas conexiones, respuestas rápidas
+    'aria2': {'limit': 8, 'per_host': 8, 'timeout': 10},
+}
+
+_sessions = {}
+
+
+def get_session(profile='default'):
+    """
+    Devuelve la sesión compartida del perfil (creándola al primer uso).
+    NO usar como `async with`: la sesión vive hasta shutdown().
+    El jar es nulo para que no se mezclen cookies entre usuarios ni hosts: solo para
+    APIs sin cookies (Firestore, aria2, CDNs de manga). Descargas con cookies: cookie_session().
+    """
+    s = _sessions.get(profile)
+    if s is None or s.closed:
+        cfg = PROFILES.get(profile, PROFILES['default'])
+        connector = aiohttp.TCPConnector(
+            limit=cfg['limit'],
+            limit_per_host=cfg['per_host'],
+            ttl_dns_cache=HTTP_DNS_TTL,
+            use_dns_cache=True,
+            keepalive_timeout=HTTP_KEEPALIVE,
+        )
+        s = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=cfg['timeout']),
+            cookie_jar=aiohttp.DummyCookieJar(),
+            headers={"User-Agent": DEFAULT_UA},
+        )
+        _sessions[profile] = s
+    return s
+
+
+def cookie_session(cookies=None, profile='default'):
+    """
+    Sesión de una descarga con su propio CookieJar sobre el conector compartido del perfil.
+    Conserva las cookies que ponen las redirecciones (Mediafire, CDNs con token) sin
+    mezclarlas con otras descargas. Usar con `async with`: cerrarla no cierra el pool.
+    """
+    base = get_session(profile)
+    return aiohttp.ClientSession(
+        connector=base.connector,
+        connector_owner=False,
+        timeout=base.timeout,
+        headers=base.headers,
+        cookies=cookies,
+        cookie_jar=aiohttp.CookieJar(unsafe=True),
+    )
+
+
+async def startup():
+    """Precalienta el pool por defecto (llamado desde boot_services)."""
+    get_session()
+    print(f"🌐 [HTTP] Pool listo (limit={HTTP_POOL_LIMIT}, por host={HTTP_POOL_PER_HOST}, DNS TTL={HTTP_DNS_TTL}s)")
+
+
+async def shutdown():
+    """Cierra todas las sesiones compartidas (llamado al apagar el bot)."""
+    for name, s in list(_sessions.items()):
+        if not s.closed:
+            try: await s.close()
+            except Exception as e: print(f"⚠️ [HTTP] Error cerrando pool {name}: {e}")
+    _sessions.clear()
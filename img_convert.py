@@ -0,0 +1,68 @@
+import os
+import asyncio
+from concurrent.futures.process import BrokenProcessPool
+from PIL import Image
+
+# --- CONVERSIÓN DE IMÁGENES EN PARALELO (PROCESOS) ---
+# Decodificar/recodificar WebP->JPG/PNG es CPU puro: en el hilo del loop congelaba el bot
+# entero y en hilos quedaría serializado por el GIL. Aquí cada página va a un proceso del
+# pool de executors (un núcleo por worker). Los workers arrancan con proc_entry como
+# __main__ (ver executors.get_process_pool) y solo cargan este módulo, que solo importa PIL.
+
+
+def convert_one(src, dst, quality=95):
+    """Convierte src -> dst (RGB). Borra src si la extensión cambia. Retorna (ok, dst o error)."""
+    try:
+        with Image.open(src) as im:
+            im.convert('RGB').save(dst, quality=quality)
+        if os.path.normcase(src) != os.path.normcase(dst):
+            os.remove(src)
+        return True, dst
+    except Exception as e:
+        return False, f"{os.path.basename(src)}: {e}"
+
+
+async def convert_many(jobs, on_progress=None, quality=95):
+    """
+    jobs: lista de (src, dst). Convierte en paralelo y retorna los resultados EN ORDEN.
+    on_progress(done, total): corrutina opcional llamada al completar cada imagen.
+    Si el pool de procesos no está disponible, cae al pool de hilos 'cpu'.
+    """
+    from executors import get_process_pool, reset_process_pool, run_in
+    if not jobs: return []
+
+    loop = asyncio.get_running_loop()
+    try:
+        pool = get_process_pool()
+        futs = [loop.run_in_executor(pool, convert_one, src, dst, quality) for src, dst in jobs]
+    except (BrokenProcessPool, OSError, RuntimeError) as e:
+        print(f"⚠️ [ImgConvert] Pool de procesos no disponible ({e}), usando hilos")
+        futs = [asyncio.ensure_future(run_in('cpu', convert_one, src, dst, quality)) for src, dst in jobs]
+
+    total = len(futs)
+    try:
+        done = 0
+        for fut in asyncio.as_completed(futs):
+            try: await fut
+            except Exception: pass
+            done += 1
+            if on_progress:
+                try: await on_progress(done, total)
+                except Exception: pass
+    except asyncio.CancelledError:
+        for f in futs: f.cancel()
+        raise
+
+    results = []
+    broken = False
+    for (src, dst), fut in zip(jobs, futs):
+        try:
+            results.append(fut.result())
+        except BrokenProcessPool:
+            broken = True
+            # Un worker murió: convertir esta imagen en el proceso actual
+            results.append(await run_in('cpu', convert_one, src, dst, quality))
+        except Exception as e:
+            results.append((False, f"{os.path.basename(src)}: {e}"))
+    if broken: reset_process_pool()
+    return results
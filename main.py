@@ -1,7 +1,6 @@
 import asyncio
 import os
 import sys
-import yt_dlp
 import time
 import re
 import shutil
@@ -36,15 +35,22 @@ def run_health_check():
 
 # --- IMPORTACIONES DEL PROYECTO ---
 from config import API_ID, API_HASH, BOT_TOKEN, DATA_DIR, COOKIE_MAP, DATABASE_CHANNEL, BASE_DIR, OWNER_ID
-from database import get_config, url_storage, hashtag_db, can_download, cancel_all, add_active, remove_active
+import database
+from database import get_config, ensure_config, url_storage, hashtag_db, can_download, cancel_all, add_active, remove_active
 from utils import format_bytes, limpiar_url, sel_cookie, resolver_url_facebook, descargar_galeria, scan_channel_history
 from jav_extractor import extraer_jav_directo
 from downloader import procesar_descarga
+from scheduler import scheduler, PRIORITY_HIGH, PRIORITY_NORMAL
+from media_cache import media_cache
+from ytdlp_cache import info_cache
+import executors
+from executors import run_in
 from manga_service import (
-    get_all_mangas_paginated, get_manga_metadata, 
+    get_all_mangas_paginated, get_manga_metadata, get_catalog_entry,
     process_manga_download, get_or_cache_cover,
-    get_manga_chapters
+    get_manga_chapters, prefetch_chapters
 )
+from chapter_cache import CHAPTER_PREFETCH
 from firebase_service import save_bot_config, get_cached_file, save_cached_file, get_cached_data, register_user
 
 logging.basicConfig(level=logging.INFO)
@@ -76,6 +82,7 @@ BOT_USERNAME = None
 async def run_party_logic(client, chat_id, file_path, mode, val, msg_to_edit=None):
     from utils import split_video_generic, cut_video_range
     from tools_media import get_meta, get_thumb
+    from tg_stream import ParallelUploader, send_uploaded
     
     if msg_to_edit:
         await msg_to_edit.edit(f"⏳ Procesando Party ({mode}={val})...")
@@ -85,15 +92,15 @@ async def run_party_logic(client, chat_id, file_path, mode, val, msg_to_edit=Non
 
     try:
         if mode == 'parts':
-            parts = await asyncio.get_running_loop().run_in_executor(None, lambda: split_video_generic(file_path, mode, float(val)))
+            parts = await run_in('cpu', lambda: split_video_generic(file_path, mode, float(val)))
         elif mode in ['sec', 'min']:
-            parts = await asyncio.get_running_loop().run_in_executor(None, lambda: split_video_generic(file_path, mode, float(val)))
+            parts = await run_in('cpu', lambda: split_video_generic(file_path, mode, float(val)))
         elif mode == 'range':
             pts = str(val).split()
             if len(pts) != 2:
                 await msg_to_edit.edit("❌ Formato de rango inválido.")
                 return False
-            p_path = await asyncio.get_running_loop().run_in_executor(None, lambda: cut_video_range(file_path, pts[0], pts[1]))
+            p_path = await run_in('cpu', lambda: cut_video_range(file_path, pts[0], pts[1]))
             parts = [p_path] if p_path else []
         else:
             parts = []
@@ -104,25 +111,34 @@ async def run_party_logic(client, chat_id, file_path, mode, val, msg_to_edit=Non
 
         await msg_to_edit.edit(f"📤 Enviando {len(parts)} partes...")
         ts = int(time.time())
-        for i, p in enumerate(parts):
+
+        async def enviar(input_file, p, cap, w, h, dur, thumb):
             try:
+                return await send_uploaded(client, chat_id, input_file, os.path.basename(p), cap,
+                                           as_video=True, width=w, height=h, duration=dur, thumb=thumb)
+            except FloodWait:
+                raise
+            except Exception as e:
+                print(f"Error enviando parte {p}: {e}")
+                return await send_uploaded(client, chat_id, input_file, os.path.basename(p), cap)
+
+        def borrar_thumb(thumb):
+            # on_done: corre al terminar la parte por cualquier camino (envío, error, cancelación)
+            if thumb and os.path.exists(thumb): os.remove(thumb)
+
+        # Subida en paralelo, publicación en orden (Parte 1, 2, 3...)
+        uploader = ParallelUploader(client)
+        try:
+            for i, p in enumerate(parts):
                 # Extraer meta para cada parte
                 w, h, dur = await get_meta(p)
                 thumb = await get_thumb(p, chat_id, f"{ts}_{i}")
-                
-                await client.send_video(
-                    chat_id, p,
-                    width=w if w else None,
-                    height=h if h else None,
-                    duration=dur if dur else None,
-                    thumb=thumb,
-                    caption=f"🎉 Party: Parte {i+1}" if len(parts) > 1 else "🎉 Party Video"
-                )
-                if thumb and os.path.exists(thumb): os.remove(thumb)
-            except Exception as e:
-                print(f"Error enviando parte {i}: {e}")
-                try: await client.send_document(chat_id, p)
-                except: pass
+                cap = f"🎉 Party: Parte {i+1}" if len(parts) > 1 else "🎉 Party Video"
+                uploader.submit(p, lambda inp, p=p, c=cap, w=w, h=h, d=dur, t=thumb: enviar(inp, p, c, w, h, d, t),
+                                on_done=lambda _p, t=thumb: borrar_thumb(t))
+            await uploader.wait()
+        finally:
+            await uploader.close()
         
         # Cleanup
         try: 
@@ -139,6 +155,51 @@ async def run_party_logic(client, chat_id, file_path, mode, val, msg_to_edit=Non
 
 
 
+# --- HELPER: COLA DE DESCARGAS ---
+def encolar_descarga(client, chat_id, url, calidad, d_st, msg_orig, user_id=None):
+    """Entrega la descarga al planificador global y muestra la posición en cola."""
+    q_msg = None
+    shown_pos = None     # posición que muestra q_msg
+    latest_pos = None    # última posición notificada por el planificador
+    q_lock = asyncio.Lock()
+
+    async def on_position(pos):
+        nonlocal q_msg, shown_pos, latest_pos
+        latest_pos = pos
+        # Las notificaciones llegan como tareas sueltas: una a la vez, saltando las que
+        # ya quedaron viejas o repiten la posición mostrada (evita avisos duplicados)
+        async with q_lock:
+            if pos != latest_pos or pos == shown_pos: return
+            shown_pos = pos
+            await mostrar_posicion(pos)
+
+    async def mostrar_posicion(pos):
+        nonlocal q_msg
+        if pos == 0:
+            if q_msg:
+                try: await q_msg.delete()
+                except: pass
+                q_msg = None
+            return
+        txt = f"🕒 **En cola...**\n📥 {calidad}\n#️⃣ Posición: **{pos}**"
+        if q_msg: await q_msg.edit(txt)
+        else: q_msg = await client.send_message(chat_id, txt)
+
+    def on_done(_):
+        # Si se canceló estando en cola, borrar el aviso de posición
+        if q_msg: asyncio.create_task(q_msg.delete())
+
+    prio = PRIORITY_HIGH if user_id == OWNER_ID else PRIORITY_NORMAL
+    task = scheduler.submit(
+        chat_id, msg_orig.id,
+        lambda: procesar_descarga(client, chat_id, url, calidad, d_st, msg_orig),
+        priority=prio, on_position=on_position
+    )
+    task.add_done_callback(on_done)
+    return task
+
+
+
 # --- 3. DISEÑO DE MENÚ (DISEÑO REFINADO) ---
 def gen_kb(conf, user_id=None):
     c_on, c_off = "🟢", "🔴"
@@ -209,8 +270,19 @@ async def log_message(c, m):
         text = m.text if m.text else "[Media/Emoji]"
         print(f"📩 [MSG] From: {uid} | Text: {text[:50]}")
     except: pass
+    # Config del chat bajo demanda (antes se cargaba toda la colección al arrancar)
+    try:
+        if m.chat: await ensure_config(m.chat.id)
+    except: pass
     m.continue_propagation()
 
+@app.on_callback_query(group=-1)
+async def load_callback_config(c, q):
+    try:
+        if q.message: await ensure_config(q.message.chat.id)
+    except: pass
+    q.continue_propagation()
+
 @app.on_message(filters.command("ping"))
 async def ping_cmd(c, m):
     import socket
@@ -393,7 +465,7 @@ async def cb(c, q):
             await msg.delete()
             url_storage.pop(cid, None)
             d_st['fast_enabled'] = conf.get('fast_enabled', True)
-            asyncio.create_task(procesar_descarga(c, cid, d_st['url'], data.split("|")[1], d_st, msg))
+            encolar_descarga(c, cid, d_st['url'], data.split("|")[1], d_st, msg, uid)
             return
 
         # --- SECCION: CONFIGURACION ---
@@ -443,12 +515,17 @@ async def cb(c, q):
         if data == "menu|admin":
             if uid != OWNER_ID: return await q.answer("🔒", show_alert=True)
             active_c = len(url_storage)
-            from firebase_service import db
-            st_doc = db.collection('bot_settings').document('stats').get()
-            u_count = st_doc.to_dict().get('user_count', 0) if st_doc.exists else 0
+            sch = scheduler.stats()
+            mc = await media_cache.stats()
+            pools = " | ".join(f"{n} {p['running']}/{p['workers']}+{p['queued']}" for n, p in executors.stats().items())
+            from firebase_service import get_user_count
+            u_count = await get_user_count()
             txt = (f"👮‍♂️ **Panel de Control**\n\n"
                    f"👥 **Usuarios Totales:** `{u_count}`\n"
-                   f"⬇️ **Descargas Activas:** `{active_c}`\n\n"
+                   f"⬇️ **Descargas Activas:** `{active_c}`\n"
+                   f"🚦 **Cola Global:** `{sch['running']}` corriendo | `{sch['queued']}` en espera\n"
+                   f"💾 **Cache Local:** `{mc['entries']}` archivos | `{mc['hits']}` aciertos / `{mc['misses']}` fallos ({mc['hit_rate']:.0%})\n"
+                   f"🧵 **Pools:** `{pools}`\n\n"
                    f"🆔 **Tu ID:** `{uid}`")
             await msg.edit(text=txt, reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Volver", callback_data="menu|main")]]))
             return
@@ -460,6 +537,8 @@ async def cb(c, q):
             if not mgs: return await q.answer("⚠️ Catálogo vacío.", show_alert=True)
             url_storage[cid] = {'catalog_list': mgs}
             curr = mgs[0]
+            # Precarga en lote de los primeros capítulos (un solo runQuery, en segundo plano)
+            asyncio.create_task(prefetch_chapters([m['id'] for m in mgs[:CHAPTER_PREFETCH]]))
             kb = InlineKeyboardMarkup([
                 [InlineKeyboardButton("⬅️", callback_data=f"catalog|nav|{len(mgs)-1}"), InlineKeyboardButton(f"1/{len(mgs)}", callback_data="ignore"), InlineKeyboardButton("➡️", callback_data=f"catalog|nav|1")],
                 [InlineKeyboardButton("📥 VER MANGA", callback_data=f"catalog|sel|{curr['id']}")],
@@ -477,17 +556,21 @@ async def cb(c, q):
             m_m = data.split("|")[1]
             if m_m == "nav":
                 px = int(data.split("|")[2])
-                lst = url_storage.get(cid, {}).get('catalog_list', [])
+                # Sin lista propia (p.ej. tras reinicio) se navega el catálogo global
+                lst = url_storage.get(cid, {}).get('catalog_list') or await get_all_mangas_paginated()
                 if not lst: return
                 if px < 0: px = len(lst)-1
                 if px >= len(lst): px = 0
                 cur = lst[px]
+                asyncio.create_task(prefetch_chapters([m['id'] for m in lst[px:px+CHAPTER_PREFETCH]]))
                 kb_n = InlineKeyboardMarkup([[InlineKeyboardButton("⬅️", callback_data=f"catalog|nav|{px-1}"), InlineKeyboardButton(f"{px+1}/{len(lst)}", callback_data="ignore"), InlineKeyboardButton("➡️", callback_data=f"catalog|nav|{px+1}")], [InlineKeyboardButton("📥 VER", callback_data=f"catalog|sel|{cur['id']}")], [InlineKeyboardButton("🔙 Salir", callback_data="menu|main")]])
                 await msg.edit_media(InputMediaPhoto(cur['cover'], caption=f"📚 **Manga Flow**\n📌 **{cur['title']}**"), reply_markup=kb_n)
             elif m_m == "sel":
                 mi = data.split("|")[2]
-                t = next((m for m in url_storage[cid]['catalog_list'] if m['id'] == mi), None)
-                url_storage[cid]['manga_data'] = t
+                t = get_catalog_entry(mi)
+                if not t: t = next((m for m in url_storage.get(cid, {}).get('catalog_list', []) if m['id'] == mi), None)
+                if not t: return await q.answer("⚠️ Manga no encontrado, abre el catálogo de nuevo.", show_alert=True)
+                url_storage.setdefault(cid, {})['manga_data'] = t
                 # AÑADIDO BOTÓN IMAGENES
                 kb_d = InlineKeyboardMarkup([
                     [InlineKeyboardButton("📦 ZIP", callback_data="manga_sel|zip"), InlineKeyboardButton("📄 PDF", callback_data="manga_sel|pdf")],
@@ -590,7 +673,8 @@ async def input_handler(c, m):
 @app.on_message(filters.text & (filters.regex("http") | filters.regex("www") | filters.regex("twisted-brody-manga-flow")))
 async def analyze(c, m):
     cid = m.chat.id
-    if not can_download(cid)[0]: return await m.reply("⚠️ Espera a que terminen tus descargas.")
+    ok_dl, reason = can_download(cid)
+    if not ok_dl: return await m.reply(f"⚠️ Espera a que terminen tus descargas.\n{reason}")
     url_storage.pop(cid, None)
     match = re.search(r"(https?://\S+)", m.text)
     if not match: return
@@ -605,7 +689,7 @@ async def analyze(c, m):
         url_storage[cid] = {'url': l_u, 'titulo': "Audio Auto-MP3", 'fast_enabled': conf.get('fast_enabled', True)}
         
         # Lanzamos descarga directa como MP3
-        asyncio.create_task(procesar_descarga(c, cid, l_u, "mp3", url_storage[cid], m))
+        encolar_descarga(c, cid, l_u, "mp3", url_storage[cid], m, m.from_user.id if m.from_user else None)
         await wm.delete()
         return
 
@@ -645,7 +729,7 @@ async def analyze(c, m):
         try:
             # Usar cookie si existe
             c_file = sel_cookie(l_u)
-            paths, tmp = await asyncio.get_running_loop().run_in_executor(None, lambda: descargar_galeria(l_u, c_file))
+            paths, tmp = await run_in('io', lambda: descargar_galeria(l_u, c_file))
             
             if paths:
                 # Solo AHORA avisamos, cuando YA tenemos las imagenes listas
@@ -749,7 +833,7 @@ async def analyze(c, m):
         y_i = None
         try:
             # Attempt 1: With Cookies (if available)
-            y_i = await asyncio.get_running_loop().run_in_executor(None, lambda: yt_dlp.YoutubeDL(y_o).extract_info(l_u, download=False))
+            y_i = await info_cache.extract(l_u, y_o)
         except Exception as e_analysis:
             print(f"⚠️ Analysis Attempt 1 Failed: {e_analysis}")
             # Attempt 2: Without Cookies (often fixes HTTPSConnection/403 on Servers)
@@ -757,7 +841,7 @@ async def analyze(c, m):
                 print("🔄 Retrying analysis WITHOUT cookies...")
                 del y_o['cookiefile']
                 try:
-                    y_i = await asyncio.get_running_loop().run_in_executor(None, lambda: yt_dlp.YoutubeDL(y_o).extract_info(l_u, download=False))
+                    y_i = await info_cache.extract(l_u, y_o)
                 except Exception as e_analysis_2:
                     raise e_analysis_2 # Raise the second error if both fail
             else:
@@ -832,7 +916,7 @@ async def analyze(c, m):
                 d_st['fast_enabled'] = conf.get('fast_enabled', True)
                 
                 # Lanzar download
-                asyncio.create_task(procesar_descarga(c, cid, d_st['url'], target_q, d_st, m))
+                encolar_descarga(c, cid, d_st['url'], target_q, d_st, m, m.from_user.id if m.from_user else None)
                 await wm.delete()
                 return
 
@@ -901,7 +985,7 @@ async def id_command(c, m):
 
 @app.on_message(filters.command("cancel"))
 async def cancel_cmd(c, m):
-    n = cancel_all(m.chat.id)
+    n = await cancel_all(m.chat.id)
     url_storage.pop(m.chat.id, None)
     await m.reply(f"🛑 **Se cancelaron {n} descargas activas.**")
 
@@ -928,6 +1012,22 @@ async def setsudo_cmd(c, m):
 
 # --- ARRANQUE ---
 
+async def warm_startup(recent_chats):
+    """Refresca la config de los chats recientes (get_all) y une los hashtags de Firestore a la copia local."""
+    try:
+        n = await database.warm_user_configs(recent_chats)
+        if n: print(f"🔥 [Firebase] Configs precargadas: {n} chats recientes.")
+        # Siempre en segundo plano: la copia local responde ya y aquí se completa con lo que falte
+        from firebase_service import load_all_hashtags
+        added = database.merge_tags(await load_all_hashtags())
+        if added: print(f"🔥 [Firebase] Hashtags: {added} mensajes nuevos respecto a la copia local.")
+    except Exception as e:
+        print(f"⚠️ Warm-up Firebase: {e}")
+    # Foto periódica por si el proceso muere sin pasar por el apagado ordenado
+    while True:
+        await asyncio.sleep(600)
+        database.save_user_snapshot()
+
 async def boot_services():
     print("🚀 Bot Iniciando (Versión Final)...")
     
@@ -992,19 +1092,24 @@ async def boot_services():
         BotCommand("cancel", "🛑 Cancelar")
     ])
     
-    # Firebase sync
-    try:
-        from firebase_service import load_all_user_configs, load_all_hashtags
-        import database
-        cfs = await load_all_user_configs()
-        if cfs: database.user_config.update(cfs)
-        tgs = await load_all_hashtags()
-        if tgs: database.hashtag_db.update(tgs)
-    except: pass
+    # Pool HTTP compartido (manga, enlaces directos, Aria2 RPC)
+    import http_client
+    await http_client.startup()
+
+    # Firebase sync: foto local de los chats recientes ya; Firestore en segundo plano
+    recent_chats = database.load_user_snapshot()
+    asyncio.create_task(warm_startup(recent_chats))
     
     print("✅ Bot Conectado y Listo.")
     await idle()
     await app.stop()
+    database.save_user_snapshot()
+    await media_cache.flush()
+    # Escrituras a Firestore aún en cola (configs, cache, hashtags...)
+    from firebase_service import write_queue
+    await write_queue.close()
+    await http_client.shutdown()
+    executors.shutdown()
 
 if __name__ == "__main__":
     try:
@@ -1,16 +1,23 @@
 import aiohttp
 import asyncio
 import os
+import random
 import shutil
 import json
 import zipfile
-import img2pdf
-from PIL import Image
 from io import BytesIO
 from config import DATA_DIR
 from pyrogram.types import InputMediaPhoto, InputMediaDocument
 from tools_media import progreso
-from firebase_service import get_cached_file, save_cached_file, get_cached_data
+from firebase_service import get_cached_file, save_cached_file, get_cached_data, get_cached_files
+from http_client import get_session
+from executors import run_in
+from img_convert import convert_many
+from pdf_stream import PdfBuilder
+from zip_stream import ZipBuilder, encode_index, decode_index, iter_zip_pages
+from adaptive_fetch import download_all, Backoff, retry_after_of
+from album_stream import AlbumSender
+from chapter_cache import chapter_cache, chapters_signature
 
 import time
 
@@ -19,45 +26,37 @@ FIREBASE_BASE_URL = "https://firestore.googleapis.com/v1/projects/twistedbrody-9
 # --- GLOBAL CACHE ---
 MANGA_CACHE = {
     'data': [],
+    'by_id': {},        # {manga_id: posición en 'data'} (índice para catalog|nav / catalog|sel)
     'last_updated': 0,
-    'ttl': 300  # 5 minutos
+    'ttl': 300,  # 5 minutos; pasado el TTL se sirve lo guardado y se refresca en segundo plano
+    'refresh': None     # Task de refresco en curso (uno solo a la vez)
 }
-
-async def download_image(session, url, path):
-    try:
-        async with session.get(url) as resp:
-            if resp.status == 200:
-                with open(path, 'wb') as f:
-                    f.write(await resp.read())
-                return True
-    except Exception as e:
-        print(f"Error downloading {url}: {e}")
-    return False
+CATALOG_PAGE_SIZE = 300  # Documentos por página del runQuery (cursor por __name__)
+CATALOG_FIELDS = ("title", "author", "cover", "image")
 
 
 async def get_manga_metadata(manga_id):
     """Obtiene título, autor y portada del manga desde Firebase."""
     url = f"{FIREBASE_BASE_URL}/mangas/{manga_id}"
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as resp:
-                if resp.status != 200:
-                    print(f"❌ Error Metadata ({resp.status}): {await resp.text()}")
-                    return None
-                data = await resp.json()
-                
-                fields = data.get('fields', {})
-                title = fields.get('title', {}).get('stringValue', 'Desconocido')
-                author = fields.get('author', {}).get('stringValue', 'Desconocido')
-                # La portada suele estar en 'cover' o 'image'
-                cover = fields.get('cover', {}).get('stringValue') or fields.get('image', {}).get('stringValue')
-                
-                return {
-                    'id': manga_id,
-                    'title': title,
-                    'author': author,
-                    'cover': cover
-                }
+        async with get_session().get(url) as resp:
+            if resp.status != 200:
+                print(f"❌ Error Metadata ({resp.status}): {await resp.text()}")
+                return None
+            data = await resp.json()
+            
+            fields = data.get('fields', {})
+            title = fields.get('title', {}).get('stringValue', 'Desconocido')
+            author = fields.get('author', {}).get('stringValue', 'Desconocido')
+            # La portada suele estar en 'cover' o 'image'
+            cover = fields.get('cover', {}).get('stringValue') or fields.get('image', {}).get('stringValue')
+            
+            return {
+                'id': manga_id,
+                'title': title,
+                'author': author,
+                'cover': cover
+            }
     except Exception as e:
         print(f"❌ Excepción Metadata: {e}")
         return None
@@ -81,23 +80,22 @@ async def get_or_cache_cover(client, chat_id, manga_id, cover_url):
         ts = int(time.time())
         tmp_path = os.path.join(DATA_DIR, f"cover_{manga_id}_{ts}.jpg")
         
-        async with aiohttp.ClientSession() as session:
-            if await download_image(session, cover_url, tmp_path):
-                # Enviar mensaje temporal para sacar ID
-                # Usamos send_photo con file=tmp_path
-                msg = await client.send_photo(chat_id, tmp_path)
-                if msg and msg.photo:
-                    fid = msg.photo.file_id
-                    await save_cached_file(f"manga_{manga_id}", "cover_id", fid)
-                    await msg.delete()
-                    try: os.remove(tmp_path)
-                    except: pass
-                    return fid
-                
-                # Si falla obtener ID, pero descargó, devolvemos PATH
-                # No borramos tmp_path aqui, dejamos que main.py lo use
+        if await download_image(get_session(), cover_url, tmp_path):
+            # Enviar mensaje temporal para sacar ID
+            # Usamos send_photo con file=tmp_path
+            msg = await client.send_photo(chat_id, tmp_path)
+            if msg and msg.photo:
+                fid = msg.photo.file_id
+                await save_cached_file(f"manga_{manga_id}", "cover_id", fid)
                 await msg.delete()
-                return tmp_path
+                try: os.remove(tmp_path)
+                except: pass
+                return fid
+            
+            # Si falla obtener ID, pero descargó, devolvemos PATH
+            # No borramos tmp_path aqui, dejamos que main.py lo use
+            await msg.delete()
+            return tmp_path
 
     except Exception as e:
         print(f"❌ Error Cache Cover: {e}")
@@ -105,163 +103,318 @@ async def get_or_cache_cover(client, chat_id, manga_id, cover_url):
     return cover_url # Fallback a URL original (baja probabilidad de éxito si es img protegida)
 
 
-async def get_manga_chapters(manga_id):
-    """Obtiene los capítulos (imágenes) usando una Query a Firebase."""
-    url = f"{FIREBASE_BASE_URL}:runQuery"
+def parse_chapter_doc(doc):
+    """Documento runQuery de 'chapters' -> dict de capítulo."""
+    fields = doc.get('fields', {})
     
-    # Query Body exacto proporcionado por el usuario
-    payload = {
-        "structuredQuery": {
-            "from": [{ "collectionId": "chapters" }],
-            "where": {
-                "fieldFilter": {
-                    "field": { "fieldPath": "manga_id" },
-                    "op": "EQUAL",
-                    "value": { "stringValue": manga_id }
-                }
-            }
-        }
-    }
+    # Extraer páginas originales
+    orig_pages = []
+    vals = fields.get('original_pages', {}).get('arrayValue', {}).get('values', [])
+    for v in vals:
+        if 'stringValue' in v: orig_pages.append(v['stringValue'])
+        
+    # Extraer páginas webp
+    webp_pages = []
+    vals = fields.get('pages', {}).get('arrayValue', {}).get('values', [])
+    for v in vals:
+        if 'stringValue' in v: webp_pages.append(v['stringValue'])
+        
+    ch_num = fields.get('number', {}).get('integerValue', '0')
+    ch_title = fields.get('title', {}).get('stringValue', f"Capítulo {ch_num}")
     
+    return {
+        'title': ch_title,
+        'number': int(ch_num),
+        'original': orig_pages,
+        'webp': webp_pages
+    }
+
+async def query_chapter_docs(manga_ids, names_only=False):
+    """
+    runQuery de 'chapters' para uno o varios mangas (IN, máx. 30 por query).
+    names_only: máscara vacía -> solo nombre + updateTime (para revalidar barato).
+    Retorna {manga_id: [documentos]} o None si la query falla.
+    """
+    url = f"{FIREBASE_BASE_URL}:runQuery"
+    if len(manga_ids) == 1:
+        op, value = "EQUAL", {"stringValue": manga_ids[0]}
+    else:
+        op, value = "IN", {"arrayValue": {"values": [{"stringValue": m} for m in manga_ids]}}
+    query = {
+        "from": [{ "collectionId": "chapters" }],
+        "where": {"fieldFilter": {"field": {"fieldPath": "manga_id"}, "op": op, "value": value}}
+    }
+    if names_only:
+        query["select"] = {"fields": [{"fieldPath": "__name__"}]}
+    elif len(manga_ids) > 1:
+        # Hace falta manga_id para repartir los documentos entre mangas
+        query["select"] = {"fields": [{"fieldPath": f} for f in ("manga_id", "original_pages", "pages", "number", "title")]}
+
+    async with get_session().post(url, json={"structuredQuery": query}) as resp:
+        if resp.status != 200:
+            print(f"❌ Error Chapters ({resp.status}): {await resp.text()}")
+            return None
+        data = await resp.json()
+
+    grouped = {m: [] for m in manga_ids}
+    for item in data:
+        doc = item.get('document', {})
+        if not doc: continue
+        if len(manga_ids) == 1:
+            grouped[manga_ids[0]].append(doc)
+        else:
+            mid = doc.get('fields', {}).get('manga_id', {}).get('stringValue')
+            if mid in grouped: grouped[mid].append(doc)
+    return grouped
+
+def store_chapters(manga_id, docs):
+    chapters = [parse_chapter_doc(d) for d in docs]
+    # Ordenar por número
+    chapters.sort(key=lambda x: x['number'])
+    chapter_cache.put(manga_id, chapters, chapters_signature(docs))
+    return chapters
+
+async def get_manga_chapters(manga_id):
+    """Obtiene los capítulos (imágenes): cache local, revalidación por updateTime o Query a Firebase."""
+    chapters = chapter_cache.fresh(manga_id)
+    if chapters is not None: return chapters
+
+    stale = chapter_cache.entry(manga_id)
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, json=payload) as resp:
-                if resp.status != 200:
-                    print(f"❌ Error Chapters ({resp.status}): {await resp.text()}")
-                    return []
-                
-                data = await resp.json()
-                # data es una lista de documentos wrapper
-                
-                chapters = []
-                for item in data:
-                    doc = item.get('document', {})
-                    if not doc: continue
-                    
-                    fields = doc.get('fields', {})
-                    
-                    # Extraer páginas originales
-                    orig_pages = []
-                    vals = fields.get('original_pages', {}).get('arrayValue', {}).get('values', [])
-                    for v in vals:
-                        if 'stringValue' in v: orig_pages.append(v['stringValue'])
-                        
-                    # Extraer páginas webp
-                    webp_pages = []
-                    vals = fields.get('pages', {}).get('arrayValue', {}).get('values', [])
-                    for v in vals:
-                        if 'stringValue' in v: webp_pages.append(v['stringValue'])
-                        
-                    ch_num = fields.get('number', {}).get('integerValue', '0')
-                    ch_title = fields.get('title', {}).get('stringValue', f"Capítulo {ch_num}")
-                    
-                    chapters.append({
-                        'title': ch_title,
-                        'number': int(ch_num),
-                        'original': orig_pages,
-                        'webp': webp_pages
-                    })
-                
-                # Ordenar por número
-                chapters.sort(key=lambda x: x['number'])
-                return chapters
-                
+        if stale:
+            # Revalidar: solo nombres + updateTime (respuesta mínima)
+            found = await query_chapter_docs([manga_id], names_only=True)
+            if found is not None and chapters_signature(found[manga_id]) == stale[1]:
+                chapter_cache.touch(manga_id)
+                return stale[2]
+
+        chapter_cache.misses += 1
+        found = await query_chapter_docs([manga_id])
+        if found is None: return stale[2] if stale else []
+        return store_chapters(manga_id, found[manga_id])
+            
     except Exception as e:
         print(f"❌ Excepción Chapters: {e}")
-        return []
-
-    except: pass
-    return None
+        # Firestore caído: mejor lo último conocido que nada
+        return stale[2] if stale else []
+
+async def prefetch_chapters(manga_ids):
+    """Carga en lote (IN de 30) los capítulos de los mangas que no estén vigentes en cache."""
+    pending = [str(m) for m in dict.fromkeys(manga_ids) if m and not chapter_cache.is_fresh(m)]
+    for i in range(0, len(pending), 30):
+        batch = pending[i:i+30]
+        try:
+            found = await query_chapter_docs(batch)
+        except Exception as e:
+            print(f"⚠️ Prefetch Chapters: {e}")
+            return
+        if found is None: return
+        for mid, docs in found.items():
+            store_chapters(mid, docs)
 
-async def get_all_mangas_paginated():
-    """Obtiene una lista ligera de TODOS los mangas (Title, ID, Cover) para el catálogo."""
+def parse_catalog_doc(doc):
+    # ID está en name: .../documents/mangas/ID
+    mid = doc.get('name', '').split('/')[-1]
     
-    # 1. Global Cache Check
-    now = time.time()
-    if MANGA_CACHE['data'] and (now - MANGA_CACHE['last_updated'] < MANGA_CACHE['ttl']):
-        return MANGA_CACHE['data']
+    fields = doc.get('fields', {})
+    title = fields.get('title', {}).get('stringValue', 'Sin Título')
+    author = fields.get('author', {}).get('stringValue', 'Desconocido')
+    cover = fields.get('cover', {}).get('stringValue') or fields.get('image', {}).get('stringValue')
+    
+    # Sin portada: el warmer la busca en el capítulo 1 (warm_covers_background)
+    if not cover:
+        print(f"⚠️ Manga sin portada: {title} ({mid})")
+
+    return {
+        'id': mid,
+        'title': title,
+        'author': author,
+        'cover': cover
+    }
 
+async def fetch_catalog():
+    """
+    Trae TODO el catálogo por páginas de CATALOG_PAGE_SIZE con cursor (orderBy __name__ + startAt),
+    pidiendo solo los campos que usa el catálogo. Retorna la lista ordenada por título o None si falla.
+    """
     url = f"{FIREBASE_BASE_URL}:runQuery"
-    # Query para traer solo campos necesarios y ordenar (simulado)
-    # Firebase REST es limitado, traemos todo y filtramos en RAM (Para ~50 mangas está bien)
-    payload = {
-        "structuredQuery": {
+    mangas = []
+    cursor = None
+    while True:
+        query = {
             "from": [{ "collectionId": "mangas" }],
-            "limit": 100 # Safety limit
+            "select": {"fields": [{"fieldPath": f} for f in CATALOG_FIELDS]},
+            "orderBy": [{"field": {"fieldPath": "__name__"}, "direction": "ASCENDING"}],
+            "limit": CATALOG_PAGE_SIZE
         }
-    }
-    
+        if cursor:
+            # before=False: la página empieza DESPUÉS del último documento visto
+            query["startAt"] = {"values": [{"referenceValue": cursor}], "before": False}
+
+        async with get_session().post(url, json={"structuredQuery": query}) as resp:
+            if resp.status != 200:
+                print(f"❌ Error Catálogo ({resp.status}): {await resp.text()}")
+                return None
+            data = await resp.json()
+
+        docs = [item['document'] for item in data if item.get('document')]
+        mangas.extend(parse_catalog_doc(d) for d in docs)
+        if len(docs) < CATALOG_PAGE_SIZE: break
+        cursor = docs[-1]['name']
+
+    # Ordenar alfabéticamente
+    mangas.sort(key=lambda x: x['title'])
+    return mangas
+
+async def refresh_catalog():
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, json=payload) as resp:
-                if resp.status != 200: return []
-                data = await resp.json()
-                
-                mangas = []
-                for item in data:
-                    doc = item.get('document', {})
-                    if not doc: continue
-                    
-                    # ID está en name: .../documents/mangas/ID
-                    full_name = doc.get('name', '')
-                    mid = full_name.split('/')[-1]
-                    
-                    fields = doc.get('fields', {})
-                    title = fields.get('title', {}).get('stringValue', 'Sin Título')
-                    author = fields.get('author', {}).get('stringValue', 'Desconocido')
-                    cover = fields.get('cover', {}).get('stringValue') or fields.get('image', {}).get('stringValue')
-                    
-                    # FALLBACK: Si no hay 'cover' ni 'image' en metadata general, buscar en el capitulo 1 (si existiese en la DB plana)
-                    # Pero get_all_mangas solo mira la coleccion "mangas", no "chapters".
-                    # Intentamos buscar clean_url o similar
-                    if not cover:
-                         # Intento desesperado: buscar cualquier campo que parezca url
-                         for k, v in fields.items():
-                             val = v.get('stringValue', '')
-                             if 'http' in val and ('jpg' in val or 'png' in val or 'webp' in val):
-                                 cover = val
-                                 break
-
-                    if not cover:
-                        print(f"⚠️ Manga sin portada: {title} ({mid})")
-
-                    mangas.append({
-                        'id': mid,
-                        'title': title, # Strip para limpieza
-                        'author': author,
-                        'cover': cover
-                    })
-                
-                # Ordenar alfabéticamente
-                mangas.sort(key=lambda x: x['title'])
-                
-                # Update Cache
-                MANGA_CACHE['data'] = mangas
-                MANGA_CACHE['last_updated'] = time.time()
-                
-                return mangas
+        mangas = await fetch_catalog()
     except Exception as e:
         print(f"Error Manga Pagination: {e}")
-        return []
+        return MANGA_CACHE['data']
+    if mangas is None: return MANGA_CACHE['data']
 
+    # Update Cache
+    MANGA_CACHE['data'] = mangas
+    MANGA_CACHE['by_id'] = {m['id']: i for i, m in enumerate(mangas)}
+    MANGA_CACHE['last_updated'] = time.time()
+    return mangas
+
+async def get_all_mangas_paginated():
+    """Lista ligera de TODOS los mangas (Title, ID, Author, Cover) para el catálogo."""
+    refresh = MANGA_CACHE['refresh']
+    if not refresh or refresh.done():
+        if MANGA_CACHE['data'] and time.time() - MANGA_CACHE['last_updated'] < MANGA_CACHE['ttl']:
+            return MANGA_CACHE['data']
+        refresh = MANGA_CACHE['refresh'] = asyncio.create_task(refresh_catalog())
+
+    # Stale-while-revalidate: con datos previos no se espera al refresco
+    if MANGA_CACHE['data']: return MANGA_CACHE['data']
+    return await asyncio.shield(refresh)
+
+def get_catalog_entry(manga_id=None, pos=None):
+    """Manga del catálogo cacheado por ID o por posición (sin recorrer la lista)."""
+    data = MANGA_CACHE['data']
+    if manga_id is not None: pos = MANGA_CACHE['by_id'].get(manga_id)
+    if pos is None or not data: return None
+    return data[pos % len(data)]
+
+
+# --- DESCARGA DE PÁGINAS ---
+IMG_CHUNK = 256 * 1024      # Lecturas/escrituras grandes: menos syscalls que trozos de 1 KB
+IMG_MIN_BYTES = 256         # Menos que esto no es una página (HTML de error, placeholder...)
+TG_STREAM_CHUNK = 1024 * 1024  # stream_media entrega trozos de 1 MB (offset en trozos)
+IMG_MAGIC = (b'\xff\xd8\xff', b'\x89PNG\r\n\x1a\n', b'GIF87a', b'GIF89a', b'BM')
+
+
+class PageError(Exception):
+    pass
+
+
+def looks_like_image(head):
+    """Sniff por firma: JPEG, PNG, GIF, BMP, WebP (RIFF....WEBP) o AVIF/HEIC (ftyp)."""
+    if head.startswith(IMG_MAGIC): return True
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP': return True
+    if head[4:8] == b'ftyp': return True
+    return False
 
-from pyrogram.types import InputMediaPhoto, InputMediaDocument
-from pyrogram.errors import FloodWait
 
 async def download_image(session, url, file_path, retries=3):
-    """Descarga e una imagen Directamente al Disco (Streaming) para ahorrar RAM."""
-    for i in range(retries):
+    """
+    Descarga una imagen directamente al disco (streaming) para ahorrar RAM.
+    - Escribe a <ruta>.part y renombra al final: nunca queda una página a medias con el nombre final.
+      El disco se toca en el pool 'io' (bloques de IMG_CHUNK), no en el loop.
+    - Valida Content-Length, Content-Type y la firma del archivo; si algo falla, reintenta
+      con backoff exponencial + jitter en vez de meter una página rota en el PDF/ZIP.
+    - 429/503/timeout lanzan Backoff para que download_all frene el host y reintente después.
+    """
+    tmp_path = file_path + ".part"
+    timeout = aiohttp.ClientTimeout(total=60, sock_connect=10, sock_read=20)
+    last_err = None
+    for attempt in range(retries):
         try:
-            async with session.get(url, timeout=20) as resp:
-                if resp.status == 200:
-                    with open(file_path, 'wb') as f:
-                        async for chunk in resp.content.iter_chunked(1024):
-                            f.write(chunk)
-                    return True
+            async with session.get(url, timeout=timeout) as resp:
+                if resp.status in (429, 503):
+                    raise Backoff(f"HTTP {resp.status}", retry_after_of(resp))
+                if resp.status in (403, 404, 410):
+                    print(f"⚠️ Página no disponible (HTTP {resp.status}): {url}")
+                    return False
+                if resp.status != 200:
+                    raise PageError(f"HTTP {resp.status}")
+
+                ctype = resp.headers.get('Content-Type', '').split(';')[0].strip().lower()
+                if ctype and not ctype.startswith('image/') and ctype not in ('application/octet-stream', 'binary/octet-stream'):
+                    raise PageError(f"Content-Type {ctype}")
+
+                # Con Content-Encoding, Content-Length es el tamaño comprimido: no se puede comparar
+                expected = None if resp.headers.get('Content-Encoding') else resp.content_length
+                size = 0
+                head = b''
+                buf = bytearray()
+                f = await run_in('io', open, tmp_path, 'wb')
+                try:
+                    async for chunk in resp.content.iter_chunked(IMG_CHUNK):
+                        if len(head) < 16: head += chunk[:16 - len(head)]
+                        buf += chunk
+                        size += len(chunk)
+                        if len(buf) >= IMG_CHUNK:
+                            data, buf = buf, bytearray()
+                            await run_in('io', f.write, data)
+                    if buf: await run_in('io', f.write, buf)
+                finally:
+                    await run_in('io', f.close)
+
+            if expected is not None and size != expected:
+                raise PageError(f"Incompleta ({size}/{expected} bytes)")
+            if size < IMG_MIN_BYTES or not looks_like_image(head):
+                raise PageError(f"No es una imagen válida ({size} bytes)")
+
+            await run_in('io', os.replace, tmp_path, file_path)
+            return True
+        except Backoff:
+            _discard(tmp_path)
+            raise
+        except asyncio.TimeoutError:
+            _discard(tmp_path)
+            raise Backoff("timeout")
+        except asyncio.CancelledError:
+            _discard(tmp_path)
+            raise
         except Exception as e:
-            await asyncio.sleep(1)
+            _discard(tmp_path)
+            last_err = e
+            if attempt < retries - 1:
+                await asyncio.sleep(min(8.0, 0.5 * 2 ** attempt) + random.uniform(0, 0.5))
+    print(f"⚠️ Página descartada tras {retries} intentos ({last_err}): {url}")
     return False
 
+
+def _discard(path):
+    try: os.remove(path)
+    except OSError: pass
+
+def pdf_output_path(title, quality):
+    # Sanitize Title for Filename (Windows)
+    safe_title = "".join([c for c in title if c.isalnum() or c in " -_().[]"])
+    return os.path.join(DATA_DIR, f"{safe_title} [{quality.upper()}].pdf")
+
+def zip_output_path(title, quality):
+    safe_title = "".join([c for c in title if c.isalnum() or c in " -_().[]"])
+    return os.path.join(DATA_DIR, f"{safe_title} [{quality.upper()}].zip")
+
+def convert_target(cur_ext, container, quality, doc_mode):
+    """Extensión a la que hay que convertir una página, o None si se envía/empaqueta tal cual."""
+    # A. PDF Mode: sin conversión, PdfStreamWriter acepta WebP directamente.
+    if container == 'pdf':
+        return None
+    # B. Img Mode (Photo): Convert WebP -> JPG (Telegram compatibility)
+    if container == 'img' and not doc_mode:
+        return ".jpg" if cur_ext == '.webp' else None
+    # C. Explicit Format Request (PNG/JPG) vs Original
+    if quality in ['png', 'jpg'] and cur_ext != f".{quality}":
+        return f".{quality}"
+    return None
+
 async def process_manga_download(client, chat_id, manga_data, container, quality, status_msg, doc_mode=False, group_mode=True):
     """
     Descarga, procesa y envía el manga.
@@ -279,6 +432,9 @@ async def process_manga_download(client, chat_id, manga_data, container, quality
     timestamp = int(time.time())
     base_tmp = os.path.join(DATA_DIR, f"manga_{manga_id}_{timestamp}")
     os.makedirs(base_tmp, exist_ok=True)
+    pdf_builder = None
+    zip_builder = None
+    album_sender = None
     
     try:
         # 0. KEY GENERATION & CACHE CHECK
@@ -325,34 +481,16 @@ async def process_manga_download(client, chat_id, manga_data, container, quality
             await status_msg.edit(f"✨ **{title}**\n⚡ Enviando desde memoria (instantáneo)...")
             try:
                 if isinstance(cached_data_to_use, list):
-                    # ALBUM CACHE (Images)
-                    if group_mode:
-                        for i in range(0, len(cached_data_to_use), 10):
-                            chunk = cached_data_to_use[i:i+10]
-                            media = []
-                            for fid in chunk:
-                                if not fid: continue # Skip invalid IDs
-                                if doc_mode: media.append(InputMediaDocument(fid))
-                                else: media.append(InputMediaPhoto(fid))
-                            
-                            if not media: continue
-                            
-                            try:
-                                await client.send_media_group(chat_id, media)
-                                await asyncio.sleep(1)
-                            except FloodWait as fw: await asyncio.sleep(fw.value + 1)
-                            except Exception as e: 
-                                print(f"⚠️ Error SendGroup Cache: {e}")
-                    else:
+                    # ALBUM CACHE (Images): mismo ritmo (token bucket) que el envío normal
+                    cache_sender = AlbumSender(client, chat_id, doc_mode, group_mode).start()
+                    try:
                         for fid in cached_data_to_use:
-                            if not fid: continue
-                            try:
-                                if doc_mode: await client.send_document(chat_id, fid)
-                                else: await client.send_photo(chat_id, fid)
-                                await asyncio.sleep(0.3)
-                            except FloodWait as fw: await asyncio.sleep(fw.value + 1)
-                            except Exception as e:
-                                print(f"⚠️ Error SendItem Cache: {e}")
+                            if fid: await cache_sender.feed(fid) # Skip invalid IDs
+                        await cache_sender.finish()
+                    finally:
+                        await cache_sender.abort()
+                    if cache_sender.failed:
+                        return await status_msg.edit(f"⚠️ **{title}**\n{cache_sender.failed} páginas no se pudieron enviar (Telegram rechazó el envío).")
                 else:
                     # SINGLE FILE CACHE (ZIP/PDF)
                     cap = f"🎬 **{title}**\n👤 {manga_data.get('author','?')}\n✨ (Desde Memoria)"
@@ -369,13 +507,77 @@ async def process_manga_download(client, chat_id, manga_data, container, quality
         if not valid_cache: # Solo editar si no acabamos de fallar cache silenciosamente
              await status_msg.edit(f"⏳ **{title}**\n🔍 Obteniendo lista de capítulos...")
         
+        async def prepare_pages(paths):
+            # Conversión del grupo justo antes de enviarlo (si falla, va el original)
+            jobs, out = [], []
+            for p in paths:
+                fname, cur_ext = os.path.splitext(p)
+                target_ext = convert_target(cur_ext.lower(), container, quality, doc_mode)
+                if target_ext: jobs.append((p, fname + target_ext))
+            results = dict(zip([src for src, _ in jobs], await convert_many(jobs)))
+            for p in paths:
+                ok, info = results.get(p, (True, p))
+                if not ok: print(f"⚠️ Error converting {info}")
+                out.append(info if ok else p)
+            return out
+
+        def open_sinks():
+            # PDF: las páginas se escriben al PDF mientras llegan las siguientes
+            if container == 'pdf':
+                return PdfBuilder(pdf_output_path(title, quality)).start(), None, None
+            # ZIP: igual, salvo que haya que convertir formato después (PNG/JPG explícito)
+            if container == 'zip' and quality not in ['png', 'jpg']:
+                return None, ZipBuilder(zip_output_path(title, quality), base_tmp).start(), None
+            # IMG: cada grupo de 10 se convierte y se envía mientras llegan las siguientes páginas
+            if container == 'img':
+                return None, None, AlbumSender(client, chat_id, doc_mode, group_mode, prepare=prepare_pages).start()
+            return None, None, None
+
+        done_count = [0, time.time()]
+
+        async def on_page(item, ok):
+            # Llamado en orden: el PDF/ZIP/álbum recibe las páginas según se completa el prefijo
+            page_sink = pdf_builder or zip_builder or album_sender
+            if ok and page_sink: await page_sink.feed(item[1])
+            done_count[0] += 1
+            if time.time() - done_count[1] > 4:
+                done_count[1] = time.time()
+                pct = int((done_count[0]/max(total, 1))*100)
+                try: await status_msg.edit(f"⏳ **{title}**\n⬇️ Descargando... {pct}%")
+                except: pass
+
         # --- ZIP MASTER STRATEGY ---
         # Si NO hay cache específico (ej: pdf_original), preguntamos por el ZIP Maestro.
-        zip_master_fid = await get_cached_file(f"manga_{manga_id}", "zip_master")
+        master_doc = await get_cached_data(f"manga_{manga_id}") or {}
+        zip_master_fid = master_doc.get("zip_master")
+        master_index = decode_index(master_doc.get("zip_master_index"))
         
         using_master_zip = False
         
-        if zip_master_fid:
+        if zip_master_fid and master_index:
+            # Con índice: las páginas se leen del stream de Telegram y van directo a PDF/álbum/ZIP,
+            # sin bajar el ZIP entero ni extraerlo a disco antes de empezar.
+            await status_msg.edit(f"⚡ **{title}**\n📥 Leyendo desde Respaldo (ZIP Maestro)...")
+            total = len(master_index)
+            pdf_builder, zip_builder, album_sender = open_sinks()
+            try:
+                first_chunk = min(e[1] for e in master_index) // TG_STREAM_CHUNK
+                chunks = client.stream_media(zip_master_fid, offset=first_chunk)
+                async for page_path in iter_zip_pages(chunks, master_index, base_tmp, first_chunk * TG_STREAM_CHUNK):
+                    await on_page((None, page_path), True)
+                using_master_zip = True
+                print(f"✅ ZIP Maestro (índice) usado para: {title}")
+            except Exception as e:
+                print(f"⚠️ Error leyendo ZIP Maestro: {e}. Fallback a descarga web.")
+                for b in (pdf_builder, zip_builder, album_sender):
+                    if b: await b.abort()
+                pdf_builder = zip_builder = album_sender = None
+                shutil.rmtree(base_tmp, ignore_errors=True)
+                os.makedirs(base_tmp, exist_ok=True)
+                done_count[0] = 0
+
+        elif zip_master_fid:
+            # Respaldo antiguo sin índice: descargar entero y extraer
             await status_msg.edit(f"⚡ **{title}**\n📥 Descargando desde Respaldo (ZIP Maestro)...")
             try:
                 # Descargar ZIP Maestro
@@ -386,11 +588,10 @@ async def process_manga_download(client, chat_id, manga_data, container, quality
                     await status_msg.edit(f"⚡ **{title}**\n📦 Extrayendo Respaldo...")
                     
                     # Extraer
-                    loop = asyncio.get_running_loop()
                     def unzip_master():
                         with zipfile.ZipFile(zip_path, 'r') as zip_ref:
                             zip_ref.extractall(base_tmp)
-                    await loop.run_in_executor(None, unzip_master)
+                    await run_in('cpu', unzip_master)
                     
                     # Cleanup zip
                     try: os.remove(zip_path)
@@ -434,25 +635,11 @@ async def process_manga_download(client, chat_id, manga_data, container, quality
              total = len(img_queue)
              await status_msg.edit(f"⏳ **{title}**\n⬇️ Descargando {total} imágenes ({quality.upper()})...")
 
-             # 2. Descarga Concurrente (OPTIMIZADO: 5 hilos)
-             # Reducido de 40 a 5 para evitar saltar límites de RAM/CPU y 'saldo'
-             batch_size = 5
-             
-             async with aiohttp.ClientSession() as session:
-                 for i in range(0, total, batch_size):
-                     batch = img_queue[i:i+batch_size]
-                     tasks = []
-                     for url, path in batch:
-                         # Pasamos 'path' directo a download_image
-                         tasks.append(download_image(session, url, path))
-                         
-                     # Gather devuelve lista de True/False
-                     results = await asyncio.gather(*tasks)
-                 
-                     if i % 10 == 0:
-                         pct = int((i/total)*100)
-                         try: await status_msg.edit(f"⏳ **{title}**\n⬇️ Descargando... {pct}%")
-                         except: pass
+             # 2. Descarga Concurrente (AIMD por host, sin lotes: ver adaptive_fetch)
+             pdf_builder, zip_builder, album_sender = open_sinks()
+             session = get_session()
+
+             await download_all(img_queue, lambda url, path: download_image(session, url, path), on_page)
         
         # 3. Conversión de Formato (si aplica)
         # Fix: img2pdf no soporta WebP. Telegram send_photo no soporta WebP con Alpha (a veces).
@@ -461,122 +648,61 @@ async def process_manga_download(client, chat_id, manga_data, container, quality
         # Fix: img2pdf no soporta WebP. Telegram send_photo no soporta WebP con Alpha.
         
         # Logic Revamp: Only convert if strictly necessary to preserve quality.
-        convert_count = 0
+        # Primero se reúnen los trabajos; la conversión corre en paralelo en el pool de procesos.
+        convert_jobs = []
         
-        for root, _, files in os.walk(base_tmp):
+        # IMG con envío incremental: cada grupo ya se convirtió al enviarse
+        for root, _, files in ([] if album_sender else os.walk(base_tmp)):
             for file in files:
                 safe_path = os.path.join(root, file)
                 fname, cur_ext = os.path.splitext(file)
-                cur_ext = cur_ext.lower()
-                
-                start_convert = False
-                target_ext = ".jpg"
-
-                # A. PDF Mode: Convert WebP -> JPG (img2pdf limitation). Keep PNG/JPG as is.
-                if container == 'pdf':
-                    if cur_ext == '.webp':
-                        start_convert = True
-                        target_ext = ".jpg"
-                
-                # B. Img Mode (Photo): Convert WebP -> JPG (Telegram compatibility)
-                elif container == 'img' and not doc_mode:
-                    if cur_ext == '.webp': # or quality == 'webp' implicit
-                         start_convert = True
-                         target_ext = ".jpg"
-                
-                # C. Explicit Format Request (PNG/JPG) vs Original
-                elif quality in ['png', 'jpg']:
-                    if cur_ext != f".{quality}":
-                        start_convert = True
-                        target_ext = f".{quality}"
-
-                if start_convert:
-                    if convert_count == 0:
-                        await status_msg.edit(f"⏳ **{title}**\n⚙️ Procesando imágenes para compatibilidad...")
-                    
-                    convert_count += 1
-                    try:
-                        with Image.open(safe_path) as im:
-                            rgb_im = im.convert('RGB')
-                            new_path = os.path.join(root, fname + target_ext)
-                            rgb_im.save(new_path, quality=95)
-                        
-                        # Remove original if different extension
-                        if cur_ext != target_ext:
-                            os.remove(safe_path)
-                    except Exception as e:
-                        print(f"⚠️ Error converting {file}: {e}")
-                        
-                        if new_path != safe_path: os.remove(safe_path)
-                    except Exception as e:
-                        print(f"Error converting {file}: {e}")
+                target_ext = convert_target(cur_ext.lower(), container, quality, doc_mode)
+                if target_ext:
+                    convert_jobs.append((safe_path, os.path.join(root, fname + target_ext)))
+
+        if convert_jobs:
+            await status_msg.edit(f"⏳ **{title}**\n⚙️ Procesando imágenes para compatibilidad...")
+            last_edit = [0]
+
+            async def conv_progress(done, n):
+                if time.time() - last_edit[0] < 4 and done < n: return
+                last_edit[0] = time.time()
+                try: await status_msg.edit(f"⏳ **{title}**\n⚙️ Convirtiendo imágenes... {done}/{n}")
+                except: pass
+
+            for ok, info in await convert_many(convert_jobs, conv_progress):
+                if not ok: print(f"⚠️ Error converting {info}")
 
         # 4. Empaquetado o Envío
         
         if container == 'img':
-            await status_msg.edit(f"📤 **{title}**\nEnviando {total} imágenes...")
-            
-            # Recolectar todos los archivos finales ordenados
-            all_files = []
-            for ch in chapters:
-                ch_safe = "".join([c for c in ch['title'] if c.isalnum() or c in " -_"]).strip()
-                ch_dir = os.path.join(base_tmp, ch_safe)
-                if not os.path.exists(ch_dir): continue
-                imgs = sorted(os.listdir(ch_dir))
-                for im in imgs:
-                    all_files.append(os.path.join(ch_dir, im))
-
-            if not all_files:
-                return await status_msg.edit("❌ Error: No se descargaron imágenes.")
-            
-            # --- ENVIAR AL USUARIO Y CAPTURAR FILE IDs ---
-            sent_file_ids = []
-            
-            if group_mode:
-                # Album Fotos/Docs
-                for i in range(0, len(all_files), 10):
-                    chunk = all_files[i:i+10]
-                    media = []
-                    for f in chunk:
-                        if doc_mode: media.append(InputMediaDocument(f))
-                        else: media.append(InputMediaPhoto(f))
-                    
-                    try:
-                        # Capturar resultado
-                        sent_msgs = await client.send_media_group(chat_id, media)
-                        if sent_msgs:
-                            for m in sent_msgs:
-                                if m.photo: sent_file_ids.append(m.photo.file_id)
-                                elif m.document: sent_file_ids.append(m.document.file_id)
-                            
-                        await asyncio.sleep(2) # Increased delay to prevent flood
-                    except FloodWait as e:
-                        await asyncio.sleep(e.value + 2)
-                        # Retry once
-                        try:
-                            sent_msgs = await client.send_media_group(chat_id, media)
-                            if sent_msgs:
-                                for m in sent_msgs:
-                                    if m.photo: sent_file_ids.append(m.photo.file_id)
-                                    elif m.document: sent_file_ids.append(m.document.file_id)
-                        except: pass
-                    except Exception as e:
-                        print(f"Error sending chunk {i}: {e}")
+            if not album_sender:
+                # ZIP Maestro: las páginas ya están en disco, se envían todas ahora
+                await status_msg.edit(f"📤 **{title}**\nEnviando {total} imágenes...")
+                album_sender = AlbumSender(client, chat_id, doc_mode, group_mode).start()
+                for ch in chapters:
+                    ch_safe = "".join([c for c in ch['title'] if c.isalnum() or c in " -_"]).strip()
+                    ch_dir = os.path.join(base_tmp, ch_safe)
+                    if not os.path.exists(ch_dir): continue
+                    imgs = sorted(os.listdir(ch_dir))
+                    for im in imgs:
+                        await album_sender.feed(os.path.join(ch_dir, im))
             else:
-                # 1 a 1 Fotos/Docs
-                for f in all_files:
-                    try:
-                        m = None
-                        if doc_mode: m = await client.send_document(chat_id, f)
-                        else: m = await client.send_photo(chat_id, f)
-                        
-                        if m:
-                             if m.photo: sent_file_ids.append(m.photo.file_id)
-                             elif m.document: sent_file_ids.append(m.document.file_id)
-                             
-                        await asyncio.sleep(0.3)
-                    except FloodWait as e: await asyncio.sleep(e.value + 1)
-                    except: pass
+                try: await status_msg.edit(f"📤 **{title}**\nEnviando últimas imágenes...")
+                except: pass
+
+            # --- ENVIAR LO PENDIENTE Y CAPTURAR FILE IDs ---
+            sent_file_ids = await album_sender.finish()
+            sent_count = album_sender.sent
+            failed_count = album_sender.failed
+            album_sender = None
+
+            if not sent_count and not failed_count:
+                return await status_msg.edit("❌ Error: No se descargaron imágenes.")
+
+            if failed_count:
+                # Álbum incompleto: avisar y no cachearlo (el cache reenviaría solo una parte)
+                return await status_msg.edit(f"⚠️ **{title}**\n{failed_count} de {sent_count + failed_count} páginas no se pudieron enviar (Telegram rechazó el envío).")
 
             # SAVE TO CACHE (List of IDs)
             if sent_file_ids:
@@ -591,34 +717,28 @@ async def process_manga_download(client, chat_id, manga_data, container, quality
         final_file = None
         
         if container == 'pdf':
-            all_imgs_paths = []
-            for ch in chapters:
-                ch_safe = "".join([c for c in ch['title'] if c.isalnum() or c in " -_"]).strip()
-                ch_dir = os.path.join(base_tmp, ch_safe)
-                if not os.path.exists(ch_dir): continue
-                imgs = sorted(os.listdir(ch_dir))
-                for im in imgs:
-                    all_imgs_paths.append(os.path.join(ch_dir, im))
+            if not pdf_builder:
+                # ZIP Maestro: las páginas ya están en disco, se escriben todas ahora
+                pdf_builder = PdfBuilder(pdf_output_path(title, quality)).start()
+                for ch in chapters:
+                    ch_safe = "".join([c for c in ch['title'] if c.isalnum() or c in " -_"]).strip()
+                    ch_dir = os.path.join(base_tmp, ch_safe)
+                    if not os.path.exists(ch_dir): continue
+                    imgs = sorted(os.listdir(ch_dir))
+                    for im in imgs:
+                        await pdf_builder.feed(os.path.join(ch_dir, im))
             
-            if all_imgs_paths:
-                # Sanitize Title for Filename (Windows)
-                safe_title = "".join([c for c in title if c.isalnum() or c in " -_().[]"])
-                pdf_path = os.path.join(DATA_DIR, f"{safe_title} [{quality.upper()}].pdf")
-                with open(pdf_path, "wb") as f:
-                    f.write(img2pdf.convert(all_imgs_paths))
-                final_file = pdf_path
+            final_file = await pdf_builder.finish()
+            pdf_builder = None
                 
         else:
             # ZIP
-            safe_title = "".join([c for c in title if c.isalnum() or c in " -_().[]"])
-            zip_path = os.path.join(DATA_DIR, f"{safe_title} [{quality.upper()}].zip")
-            with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                for root, _, files in os.walk(base_tmp):
-                    for file in files:
-                        abs_path = os.path.join(root, file)
-                        arc_name = os.path.relpath(abs_path, base_tmp)
-                        zipf.write(abs_path, arc_name)
-            final_file = zip_path
+            if not zip_builder:
+                # ZIP Maestro o imágenes convertidas: empaquetar lo que hay en disco
+                zip_builder = ZipBuilder(zip_output_path(title, quality), base_tmp).start()
+                await zip_builder.feed_folder()
+            final_file = await zip_builder.finish()
+            zip_builder = None
 
         # Enviar Archivo Final
         if final_file and os.path.exists(final_file):
@@ -653,6 +773,10 @@ async def process_manga_download(client, chat_id, manga_data, container, quality
         if status_msg: await status_msg.edit(f"❌ Error Crítico: {e}")
     
     finally:
+        # PDF a medias (cancelación/error): cerrar y borrar
+        if pdf_builder: await pdf_builder.abort()
+        if zip_builder: await zip_builder.abort()
+        if album_sender: await album_sender.abort()
         # Cleanup
         if base_tmp and os.path.exists(base_tmp):
             try: shutil.rmtree(base_tmp)
@@ -681,14 +805,17 @@ async def warm_covers_background(app, dump_chat_id, single_run=False):
                 continue
             
             processed = 0
-            for m in mangas:
+            # Check cache de TODO el catálogo en lote (get_all) en vez de una lectura por manga
+            covers = await get_cached_files([(f"manga_{m['id']}", "cover_id") for m in mangas])
+            # Solo los confirmados sin portada (si la lectura falló, se revisan en la próxima ronda)
+            todo = [m for m in mangas if (f"manga_{m['id']}", "cover_id") in covers and not covers[(f"manga_{m['id']}", "cover_id")]]
+            # Los que no traen portada usan el capítulo 1: precargar sus capítulos en lote
+            await prefetch_chapters([m['id'] for m in todo if not m.get('cover') or "http" not in m['cover']])
+
+            for m in todo:
                 mid = m['id']
                 title = m['title']
                 
-                # Check cache
-                cached = await get_cached_file(f"manga_{mid}", "cover_id")
-                if cached: continue # Ya tenemos portada lista
-                
                 # Falta cachear.
                 print(f"🔥 Warmer: Procesando portada para {title}")
                 
@@ -705,22 +832,21 @@ async def warm_covers_background(app, dump_chat_id, single_run=False):
                 if cover_url and "http" in cover_url:
                     # Descargar y cachear
                     try:
-                        async with aiohttp.ClientSession() as session:
-                             async with session.get(cover_url) as resp:
-                                 if resp.status == 200:
-                                     data = await resp.read()
-                                     photo = BytesIO(data)
-                                     photo.name = "cover.jpg"
-                                     
-                                     if dump_chat_id:
-                                         # Enviar a canal dump para generar ID permanente
-                                         msg = await app.send_photo(dump_chat_id, photo, caption=f"Cover: {title}\nID: {mid}")
-                                         if msg.photo:
-                                             await save_cached_file(f"manga_{mid}", "cover_id", msg.photo.file_id)
-                                             print(f"✅ Warmer: Cacheado {title}")
-                                         processed += 1
-                                         total_processed += 1
-                                         await asyncio.sleep(5) # Delay anti-flood
+                        async with get_session().get(cover_url) as resp:
+                            if resp.status == 200:
+                                data = await resp.read()
+                                photo = BytesIO(data)
+                                photo.name = "cover.jpg"
+                                
+                                if dump_chat_id:
+                                    # Enviar a canal dump para generar ID permanente
+                                    msg = await app.send_photo(dump_chat_id, photo, caption=f"Cover: {title}\nID: {mid}")
+                                    if msg.photo:
+                                        await save_cached_file(f"manga_{mid}", "cover_id", msg.photo.file_id)
+                                        print(f"✅ Warmer: Cacheado {title}")
+                                    processed += 1
+                                    total_processed += 1
+                                    await asyncio.sleep(5) # Delay anti-flood
                     except Exception as e:
                         print(f"❌ Warmer Error {title}: {e}")
                 
@@ -745,8 +871,8 @@ async def warm_covers_background(app, dump_chat_id, single_run=False):
 # Función duplicada eliminada, usamos la de arriba.
 
 
-async def download_images_parallel(chapters, base_tmp, quality='original'):
-    """Helper interno para descargar todas las imágenes de un manga."""
+async def download_images_parallel(chapters, base_tmp, quality='original', sink=None):
+    """Helper interno para descargar todas las imágenes de un manga. sink: ZipBuilder/PdfBuilder opcional."""
     img_queue = []
     use_source = 'webp' if quality == 'webp' else 'original'
     
@@ -767,35 +893,24 @@ async def download_images_parallel(chapters, base_tmp, quality='original'):
             
     if not img_queue: return False
     
-    # Download Optimized
-    async with aiohttp.ClientSession() as session:
-        total = len(img_queue)
-        # Backup puede ser un poco más agresivo que usuario normal, pero mantenemos cautela
-        batch_size = 10 
-        
-        for i in range(0, total, batch_size):
-            batch = img_queue[i:i+batch_size]
-            tasks = []
-            for url, path in batch:
-                 # Reusamos la función optimizada
-                 tasks.append(download_image(session, url, path))
-            
-            await asyncio.gather(*tasks)
-            await asyncio.sleep(0.5) 
-            
+    # Download Optimized (AIMD por host; el límite compartido evita castigar el CDN)
+    session = get_session()
+
+    async def on_page(item, ok):
+        if ok and sink: await sink.feed(item[1])
+
+    await download_all(img_queue, lambda url, path: download_image(session, url, path), on_page)
     return True
 
 async def create_zip_from_folder(base_tmp, output_path):
-    """Crea un ZIP de la carpeta dada."""
+    """Crea un ZIP de la carpeta dada (fuera del loop; imágenes STORED)."""
+    zb = ZipBuilder(output_path, base_tmp).start()
     try:
-        with zipfile.ZipFile(output_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-            for root, _, files in os.walk(base_tmp):
-                for file in files:
-                    abs_path = os.path.join(root, file)
-                    arc_name = os.path.relpath(abs_path, base_tmp)
-                    zipf.write(abs_path, arc_name)
-        return True
-    except: return False
+        await zb.feed_folder()
+        return await zb.finish() is not None
+    except Exception:
+        await zb.abort()
+        return False
 
 async def ensure_backup_exists(client, manga_id, backup_id, status_callback=None):
     """
@@ -822,15 +937,19 @@ async def ensure_backup_exists(client, manga_id, backup_id, status_callback=None
     base_tmp = os.path.join(DATA_DIR, f"bkp_{manga_id}_{timestamp}")
     os.makedirs(base_tmp, exist_ok=True)
     
+    zip_path = os.path.join(DATA_DIR, f"MASTER_{meta['title']}.zip")
+    zb = ZipBuilder(zip_path, base_tmp).start()
     try:
-        success = await download_images_parallel(chapters, base_tmp)
+        # 2-3. Descarga + ZIP a la vez (cada lote se empaqueta mientras baja el siguiente)
+        success = await download_images_parallel(chapters, base_tmp, sink=zb)
         if not success: return None, False
         
-        if status_callback: await status_callback("📦 Comprimiendo ZIP Maestro...")
+        if status_callback: await status_callback("📦 Cerrando ZIP Maestro...")
         
-        # 3. Zip
-        zip_path = os.path.join(DATA_DIR, f"MASTER_{meta['title']}.zip")
-        if await create_zip_from_folder(base_tmp, zip_path):
+        built = await zb.finish()
+        zb_index = zb.index
+        zb = None
+        if built:
             
             if status_callback: await status_callback("📤 Subiendo a Respaldo...")
             # 4. Upload
@@ -839,7 +958,8 @@ async def ensure_backup_exists(client, manga_id, backup_id, status_callback=None
             
             fid = msg.document.file_id
             
-            # 5. Save Cache
+            # 5. Save Cache (índice primero: quien vea el file_id ya puede leer páginas sueltas)
+            await save_cached_file(f"manga_{manga_id}", "zip_master_index", encode_index(zb_index))
             await save_cached_file(f"manga_{manga_id}", "zip_master", fid, meta={'title': meta['title']})
             
             try: os.remove(zip_path)
@@ -851,6 +971,7 @@ async def ensure_backup_exists(client, manga_id, backup_id, status_callback=None
         print(f"Backup Error: {e}")
         return None, False
     finally:
+        if zb: await zb.abort()
         try: shutil.rmtree(base_tmp)
         except: pass
     
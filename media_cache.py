@@ -0,0 +1,202 @@
+import os
+import time
+import json
+import sqlite3
+import asyncio
+import threading
+from config import DATA_DIR
+from executors import run_in
+
+# --- CACHE LOCAL DE MEDIA (vid_id + ckey -> file_id) ---
+# Índice SQLite en disco consultado ANTES que Firebase: un video popular pedido por
+# muchos usuarios se reenvía al instante con su file_id de Telegram, sin re-descargar.
+# - LRU: al pasar de MEDIA_CACHE_MAX entradas o de MEDIA_CACHE_MAX_MB (file_id + meta de
+#   cada fila) se borran las menos usadas recientemente.
+# - TTL: entradas sin uso en MEDIA_CACHE_TTL_DAYS días se descartan.
+# - Write-behind: cada alta se replica a Firebase (save_cached_file) en segundo plano.
+# - SQLite se consulta en el pool 'io' de executors, nunca en el loop del bot.
+# - Solo se guarda el file_id, no el archivo terminado: con él el reenvío ya es instantáneo.
+
+MEDIA_CACHE_DB = os.path.join(DATA_DIR, "media_cache.db")
+MEDIA_CACHE_MAX = int(os.environ.get("MEDIA_CACHE_MAX", 50000))
+MEDIA_CACHE_MAX_BYTES = int(float(os.environ.get("MEDIA_CACHE_MAX_MB", 256)) * 1024 * 1024)
+MEDIA_CACHE_TTL_DAYS = float(os.environ.get("MEDIA_CACHE_TTL_DAYS", 30))
+# La lectura de Firebase estaba forzada a OFF (lenta/inestable): solo se usa si se activa
+FIREBASE_CACHE_READ = os.environ.get("FIREBASE_CACHE_READ", "0") == "1"
+
+
+class MediaCache:
+    def __init__(self, path=MEDIA_CACHE_DB, max_entries=MEDIA_CACHE_MAX, ttl_days=MEDIA_CACHE_TTL_DAYS, max_bytes=MEDIA_CACHE_MAX_BYTES):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl_days * 86400
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pending = set()  # Tasks de sincronización con Firebase
+
+    def _db(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS media ("
+                " vid_id TEXT NOT NULL, ckey TEXT NOT NULL, file_id TEXT NOT NULL,"
+                " created REAL NOT NULL, last_hit REAL NOT NULL, hits INTEGER DEFAULT 0,"
+                " synced INTEGER DEFAULT 0, meta TEXT, bytes INTEGER DEFAULT 0,"
+                " PRIMARY KEY (vid_id, ckey))"
+            )
+            cols = [r[1] for r in self._conn.execute("PRAGMA table_info(media)")]
+            if 'bytes' not in cols:  # Índice creado antes del límite por tamaño
+                self._conn.execute("ALTER TABLE media ADD COLUMN bytes INTEGER DEFAULT 0")
+                self._conn.execute("UPDATE media SET bytes = length(file_id) + ifnull(length(meta), 0)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS media_last_hit ON media(last_hit)")
+        return self._conn
+
+    # --- LECTURA ---
+
+    def _get(self, vid_id, ckey):
+        """file_id local o None. Cuenta hit/miss y refresca el LRU (bloqueante: pool 'io')."""
+        now = time.time()
+        with self._lock:
+            try:
+                db = self._db()
+                row = db.execute(
+                    "SELECT file_id, last_hit FROM media WHERE vid_id=? AND ckey=?", (str(vid_id), ckey)
+                ).fetchone()
+                if row and now - row[1] > self.ttl:
+                    db.execute("DELETE FROM media WHERE vid_id=? AND ckey=?", (str(vid_id), ckey))
+                    row = None
+                if row:
+                    db.execute(
+                        "UPDATE media SET last_hit=?, hits=hits+1 WHERE vid_id=? AND ckey=?", (now, str(vid_id), ckey)
+                    )
+            except sqlite3.Error as e:
+                print(f"⚠️ [MediaCache] Error leyendo: {e}")
+                row = None
+        if row:
+            self.hits += 1
+            return row[0]
+        self.misses += 1
+        return None
+
+    async def lookup(self, vid_id, ckey):
+        """Local primero; Firebase solo si FIREBASE_CACHE_READ (y el acierto se guarda localmente)."""
+        fid = await run_in('io', self._get, vid_id, ckey)
+        if fid or not FIREBASE_CACHE_READ: return fid
+        from firebase_service import get_cached_file
+        fid = await get_cached_file(vid_id, ckey)
+        if fid:
+            await run_in('io', self._put_local, vid_id, ckey, fid, None, True)
+        return fid
+
+    # --- ESCRITURA ---
+
+    def _put_local(self, vid_id, ckey, file_id, meta=None, synced=False):
+        now = time.time()
+        meta_json = None
+        if meta:
+            try: meta_json = json.dumps(meta, ensure_ascii=False, default=str)
+            except (TypeError, ValueError): pass
+        with self._lock:
+            try:
+                db = self._db()
+                size = len(file_id) + len(meta_json or '')
+                db.execute(
+                    "INSERT INTO media (vid_id, ckey, file_id, created, last_hit, synced, meta, bytes) VALUES (?,?,?,?,?,?,?,?)"
+                    " ON CONFLICT(vid_id, ckey) DO UPDATE SET file_id=excluded.file_id, last_hit=excluded.last_hit,"
+                    " synced=excluded.synced, meta=excluded.meta, bytes=excluded.bytes",
+                    (str(vid_id), ckey, file_id, now, now, int(synced), meta_json, size)
+                )
+                self._evict(db, now)
+            except sqlite3.Error as e:
+                print(f"⚠️ [MediaCache] Error guardando: {e}")
+
+    def _evict(self, db, now):
+        db.execute("DELETE FROM media WHERE last_hit < ?", (now - self.ttl,))
+        total = db.execute("SELECT COUNT(*) FROM media").fetchone()[0]
+        if total > self.max_entries:
+            # Quitar un 10% extra de golpe para no evaluar el LRU en cada alta
+            drop = total - self.max_entries + max(1, self.max_entries // 10)
+            db.execute(
+                "DELETE FROM media WHERE rowid IN (SELECT rowid FROM media ORDER BY last_hit ASC LIMIT ?)", (drop,)
+            )
+        used = db.execute("SELECT ifnull(sum(bytes), 0) FROM media").fetchone()[0]
+        if used > self.max_bytes:
+            # Igual por tamaño: liberar hasta quedar en el 90% del presupuesto
+            excess, drop = used - self.max_bytes * 0.9, []
+            for rowid, size in db.execute("SELECT rowid, bytes FROM media ORDER BY last_hit ASC"):
+                if excess <= 0: break
+                drop.append((rowid,))
+                excess -= size or 0
+            db.executemany("DELETE FROM media WHERE rowid=?", drop)
+
+    def put(self, vid_id, ckey, file_id, meta=None):
+        """Guarda localmente y replica a Firebase en segundo plano (write-behind)."""
+        task = asyncio.create_task(self._store(vid_id, ckey, file_id, meta))
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+
+    async def _store(self, vid_id, ckey, file_id, meta):
+        await run_in('io', self._put_local, vid_id, ckey, file_id, meta)
+        await self._sync(vid_id, ckey, file_id, meta)
+
+    def _mark_synced(self, vid_id, ckey, file_id):
+        with self._lock:
+            try:
+                self._db().execute(
+                    "UPDATE media SET synced=1 WHERE vid_id=? AND ckey=? AND file_id=?", (str(vid_id), ckey, file_id)
+                )
+            except sqlite3.Error: pass
+
+    async def _sync(self, vid_id, ckey, file_id, meta):
+        from firebase_service import save_cached_file
+        try:
+            await save_cached_file(vid_id, ckey, file_id, meta=meta)
+        except Exception as e:
+            print(f"⚠️ [MediaCache] Sync Firebase falló ({vid_id}): {e}")
+            return
+        await run_in('io', self._mark_synced, vid_id, ckey, file_id)
+
+    async def delete(self, vid_id, ckey=None):
+        await run_in('io', self._delete, vid_id, ckey)
+
+    def _delete(self, vid_id, ckey=None):
+        with self._lock:
+            try:
+                if ckey is None:
+                    self._db().execute("DELETE FROM media WHERE vid_id=?", (str(vid_id),))
+                else:
+                    self._db().execute("DELETE FROM media WHERE vid_id=? AND ckey=?", (str(vid_id), ckey))
+            except sqlite3.Error as e:
+                print(f"⚠️ [MediaCache] Error borrando: {e}")
+
+    # --- ESTADO ---
+
+    def _totals(self):
+        with self._lock:
+            try: return self._db().execute("SELECT COUNT(*), ifnull(sum(bytes), 0) FROM media").fetchone()
+            except sqlite3.Error: return 0, 0
+
+    async def stats(self):
+        total, used = await run_in('io', self._totals)
+        lookups = self.hits + self.misses
+        return {
+            'entries': total,
+            'bytes': used,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': (self.hits / lookups) if lookups else 0.0,
+            'pending_sync': len(self._pending),
+        }
+
+    async def flush(self):
+        """Espera a que terminen las réplicas pendientes (llamado al apagar)."""
+        if self._pending:
+            await asyncio.gather(*list(self._pending), return_exceptions=True)
+
+
+# Instancia única del proceso
+media_cache = MediaCache()
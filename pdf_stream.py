@@ -0,0 +1,189 @@
+import os
+import io
+import zlib
+import asyncio
+from PIL import Image
+
+# --- PDF INCREMENTAL (página a página a disco) ---
+# img2pdf.convert() arma el PDF entero como un solo bytes en RAM (y en el loop). Aquí cada
+# página se escribe al archivo en cuanto llega, así la memoria usada es la de UNA página:
+# - JPEG RGB/Gris: se copia tal cual (DCTDecode), en trozos, sin decodificar.
+# - PNG: píxeles comprimidos con Flate (sin pérdida, como img2pdf).
+# - Resto (WebP, GIF, JPEG CMYK...): se recodifica a JPEG q95 (lo que hacía la conversión previa).
+# El árbol de páginas, la tabla xref y el trailer se escriben al cerrar.
+
+COPY_CHUNK = 1024 * 1024
+DEFAULT_DPI = 96  # Igual que img2pdf cuando la imagen no trae DPI
+
+
+class PdfStreamWriter:
+    def __init__(self, path):
+        self.path = path
+        self._f = open(path, 'wb')
+        self._offsets = {}
+        self._next_id = 3       # 1 = Catalog, 2 = Pages (se escriben al final)
+        self._pages = []
+        self._f.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    @property
+    def page_count(self):
+        return len(self._pages)
+
+    def _new_id(self):
+        oid = self._next_id
+        self._next_id += 1
+        return oid
+
+    def _begin(self, oid):
+        self._offsets[oid] = self._f.tell()
+        self._f.write(f"{oid} 0 obj\n".encode())
+
+    def _object(self, oid, body):
+        self._begin(oid)
+        self._f.write(body.encode() + b"\nendobj\n")
+
+    def _stream_object(self, oid, dict_body, data=None, src_path=None, length=0):
+        self._begin(oid)
+        self._f.write(f"<< {dict_body} /Length {length} >>\nstream\n".encode())
+        if src_path:
+            with open(src_path, 'rb') as src:
+                while True:
+                    chunk = src.read(COPY_CHUNK)
+                    if not chunk: break
+                    self._f.write(chunk)
+        else:
+            self._f.write(data)
+        self._f.write(b"\nendstream\nendobj\n")
+
+    def add_page(self, img_path):
+        """Añade una página con la imagen. Bloqueante: llamar fuera del loop (pool 'cpu')."""
+        with Image.open(img_path) as im:
+            w, h = im.size
+            dpi = im.info.get('dpi') or (DEFAULT_DPI, DEFAULT_DPI)
+            try: dpi_x, dpi_y = float(dpi[0]) or DEFAULT_DPI, float(dpi[1]) or DEFAULT_DPI
+            except (TypeError, ValueError, IndexError): dpi_x = dpi_y = DEFAULT_DPI
+
+            src_path, data = None, None
+            if im.format == 'JPEG' and im.mode in ('RGB', 'L'):
+                colorspace = '/DeviceGray' if im.mode == 'L' else '/DeviceRGB'
+                filt = '/DCTDecode'
+                src_path = img_path
+                length = os.path.getsize(img_path)
+            elif im.format == 'PNG':
+                px = im if im.mode in ('RGB', 'L') else im.convert('L' if im.mode in ('1', 'LA') else 'RGB')
+                colorspace = '/DeviceGray' if px.mode == 'L' else '/DeviceRGB'
+                filt = '/FlateDecode'
+                data = zlib.compress(px.tobytes(), 6)
+                length = len(data)
+            else:
+                buf = io.BytesIO()
+                px = im.convert('L' if im.mode in ('1', 'L', 'LA') else 'RGB')
+                px.save(buf, format='JPEG', quality=95)
+                colorspace = '/DeviceGray' if px.mode == 'L' else '/DeviceRGB'
+                filt = '/DCTDecode'
+                data = buf.getvalue()
+                length = len(data)
+
+        pw, ph = w * 72.0 / dpi_x, h * 72.0 / dpi_y
+        # Punto de retorno: si la página falla a medias no debe quedar rastro en el archivo
+        mark, first_id = self._f.tell(), self._next_id
+        img_id, content_id, page_id = self._new_id(), self._new_id(), self._new_id()
+
+        try:
+            self._stream_object(
+                img_id,
+                f"/Type /XObject /Subtype /Image /Width {w} /Height {h} /ColorSpace {colorspace} "
+                f"/BitsPerComponent 8 /Filter {filt}",
+                data=data, src_path=src_path, length=length
+            )
+            content = f"q {pw:.4f} 0 0 {ph:.4f} 0 0 cm /Im0 Do Q".encode()
+            self._stream_object(content_id, "", data=content, length=len(content))
+            self._object(
+                page_id,
+                f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {pw:.4f} {ph:.4f}] "
+                f"/Resources << /XObject << /Im0 {img_id} 0 R >> >> /Contents {content_id} 0 R >>"
+            )
+        except BaseException:
+            self._f.seek(mark)
+            self._f.truncate()
+            for oid in range(first_id, self._next_id): self._offsets.pop(oid, None)
+            self._next_id = first_id
+            raise
+        self._pages.append(page_id)
+
+    def close(self):
+        """Escribe árbol de páginas, catálogo, xref y trailer. Retorna la ruta."""
+        kids = " ".join(f"{p} 0 R" for p in self._pages)
+        self._object(2, f"<< /Type /Pages /Kids [{kids}] /Count {len(self._pages)} >>")
+        self._object(1, "<< /Type /Catalog /Pages 2 0 R >>")
+
+        xref_pos = self._f.tell()
+        size = self._next_id
+        lines = [f"xref\n0 {size}\n", "0000000000 65535 f \n"]
+        for oid in range(1, size):
+            lines.append(f"{self._offsets[oid]:010d} 00000 n \n")
+        self._f.write("".join(lines).encode())
+        self._f.write(f"trailer\n<< /Size {size} /Root 1 0 R >>\nstartxref\n{xref_pos}\n%%EOF\n".encode())
+        self._f.close()
+        return self.path
+
+    def abort(self):
+        try: self._f.close()
+        except Exception: pass
+        try: os.remove(self.path)
+        except OSError: pass
+
+
+class PdfBuilder:
+    """
+    Versión async: las páginas se encolan con feed() (en orden) y un consumidor las escribe en el
+    pool 'cpu' mientras el productor sigue (p.ej. descargando el siguiente lote).
+
+        pdf = PdfBuilder(path); pdf.start()
+        await pdf.feed(page) ...
+        await pdf.finish()   # -> ruta, o None si no hubo páginas
+    """
+
+    def __init__(self, path, max_pending=20):
+        self.path = path
+        self._queue = asyncio.Queue(max_pending)
+        self._writer = None
+        self._task = None
+        self.errors = 0
+
+    def start(self):
+        self._writer = PdfStreamWriter(self.path)
+        self._task = asyncio.create_task(self._consume())
+        return self
+
+    async def feed(self, img_path):
+        if self._task.done():
+            await self._task  # Propaga el error del consumidor
+        await self._queue.put(img_path)
+
+    async def _consume(self):
+        from executors import run_in
+        while True:
+            img_path = await self._queue.get()
+            if img_path is None: return
+            try:
+                await run_in('cpu', self._writer.add_page, img_path)
+            except Exception as e:
+                self.errors += 1
+                print(f"⚠️ [PDF] Página omitida ({os.path.basename(img_path)}): {e}")
+
+    async def finish(self):
+        from executors import run_in
+        await self._queue.put(None)
+        await self._task
+        if not self._writer.page_count:
+            self._writer.abort()
+            return None
+        return await run_in('cpu', self._writer.close)
+
+    async def abort(self):
+        if self._task and not self._task.done():
+            self._task.cancel()
+            try: await self._task
+            except BaseException: pass
+        if self._writer: self._writer.abort()
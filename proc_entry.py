@@ -0,0 +1,4 @@
+# --- MÓDULO DE ARRANQUE DE LOS WORKERS DEL POOL DE PROCESOS ---
+# Con 'spawn' cada worker re-importa el módulo __main__ del padre como __mp_main__. Si fuera
+# main.py, cada worker iniciaría Firebase, abriría/migraría SQLite y crearía el Client de
+# Pyrogram. executors.get_process_pool lanza los workers con ESTE módulo (vacío) como __main__.
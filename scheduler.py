@@ -0,0 +1,211 @@
+import os
+import heapq
+import asyncio
+import itertools
+import contextvars
+from database import add_active, remove_active
+
+# --- PLANIFICADOR GLOBAL DE DESCARGAS ---
+# Cola con prioridad + límites de concurrencia (global y por chat) + reparto justo
+# (Weighted Fair Queuing) entre chats. Cada trabajo es un Task propio que espera su
+# turno, así cancel_all() lo cancela igual que a una descarga en curso.
+
+MAX_GLOBAL = int(os.environ.get("DL_MAX_GLOBAL", 4))
+MAX_PER_CHAT = int(os.environ.get("DL_MAX_PER_CHAT", 2))
+MAX_QUEUED_PER_CHAT = int(os.environ.get("DL_MAX_QUEUED_PER_CHAT", 20))
+
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+_current_job = contextvars.ContextVar('scheduler_job', default=None)   # trabajo del Task actual
+
+
+class _Job:
+    __slots__ = ('chat_id', 'msg_id', 'priority', 'vfinish', 'seq', 'waiter', 'on_position', 'last_pos', 'holding')
+
+    def __init__(self, chat_id, msg_id, priority, vfinish, seq, on_position):
+        self.chat_id = chat_id
+        self.msg_id = msg_id
+        self.priority = priority
+        self.vfinish = vfinish
+        self.seq = seq
+        self.waiter = asyncio.get_running_loop().create_future()
+        self.on_position = on_position
+        self.last_pos = None
+        self.holding = False    # tiene turno concedido (cuenta en los límites)
+
+    def key(self):
+        return (self.priority, self.vfinish, self.seq)
+
+    def __lt__(self, other):
+        return self.key() < other.key()
+
+
+class DownloadScheduler:
+    def __init__(self, max_global=MAX_GLOBAL, max_per_chat=MAX_PER_CHAT):
+        self.max_global = max(1, max_global)
+        self.max_per_chat = max(1, max_per_chat)
+        self._heap = []             # [_Job] pendientes
+        self._running = {}          # {chat_id: n}
+        self._total_running = 0
+        self._weights = {}          # {chat_id: peso} (1.0 por defecto)
+        self._last_finish = {}      # {chat_id: tiempo virtual del último trabajo}
+        self._vclock = 0.0
+        self._seq = itertools.count()
+
+    # --- API PUBLICA ---
+
+    def set_weight(self, chat_id, weight):
+        """Peso WFQ del chat: con peso 2 recibe el doble de turnos que uno con peso 1."""
+        self._weights[chat_id] = max(0.1, float(weight))
+
+    def submit(self, chat_id, msg_id, coro_factory, priority=PRIORITY_NORMAL, on_position=None):
+        """
+        Encola un trabajo y devuelve su Task.
+        coro_factory: callable sin argumentos que crea la corrutina a ejecutar.
+        on_position: corrutina opcional on_position(pos) llamada al cambiar la posición en cola
+                     (pos=0 significa que el trabajo empieza).
+        """
+        task = asyncio.create_task(self._run(chat_id, msg_id, coro_factory, priority, on_position))
+        add_active(chat_id, msg_id, task)
+        return task
+
+    def queued_count(self, chat_id=None):
+        if chat_id is None: return len(self._heap)
+        return sum(1 for j in self._heap if j.chat_id == chat_id)
+
+    def running_count(self, chat_id=None):
+        if chat_id is None: return self._total_running
+        return self._running.get(chat_id, 0)
+
+    def position(self, chat_id, msg_id):
+        """Posición 1-based en la cola global (0 si ya está corriendo o no existe)."""
+        for i, j in enumerate(sorted(self._heap), start=1):
+            if j.chat_id == chat_id and j.msg_id == msg_id:
+                return i
+        return 0
+
+    def stats(self):
+        return {'running': self._total_running, 'queued': len(self._heap), 'chats': len(self._running)}
+
+    def pause_turn(self):
+        """
+        Devuelve el turno del trabajo en curso (llamado desde su propio Task), p.ej. mientras
+        solo espera a otra descarga compartida. Si luego necesita descargar: await resume_turn().
+        """
+        job = _current_job.get()
+        if job and job.holding:
+            self._release_job(job)
+
+    async def resume_turn(self):
+        """Vuelve a pedir turno tras pause_turn(), por delante de los llegados después."""
+        job = _current_job.get()
+        if not job or job.holding: return
+        job.waiter = asyncio.get_running_loop().create_future()
+        job.last_pos = None
+        heapq.heappush(self._heap, job)
+        self._dispatch()
+        self._notify_positions()
+        try:
+            await job.waiter
+        except asyncio.CancelledError:
+            self._unqueue(job)
+            raise
+        if job.on_position:
+            try: await job.on_position(0)
+            except Exception as e: print(f"⚠️ Scheduler notify error: {e}")
+
+    # --- INTERNO ---
+
+    async def _run(self, chat_id, msg_id, coro_factory, priority, on_position):
+        job = self._enqueue(chat_id, msg_id, priority, on_position)
+        try:
+            try:
+                await job.waiter
+            except asyncio.CancelledError:
+                # Cancelado mientras esperaba: sacar de la cola o devolver el turno si ya se lo dimos
+                self._unqueue(job)
+                self._release_job(job)
+                raise
+
+            token = _current_job.set(job)
+            try:
+                if on_position:
+                    try: await on_position(0)
+                    except Exception as e: print(f"⚠️ Scheduler notify error: {e}")
+                return await coro_factory()
+            finally:
+                _current_job.reset(token)
+                self._release_job(job)
+        finally:
+            remove_active(chat_id, msg_id)
+
+    def _enqueue(self, chat_id, msg_id, priority, on_position):
+        weight = self._weights.get(chat_id, 1.0)
+        start = max(self._vclock, self._last_finish.get(chat_id, 0.0))
+        vfinish = start + 1.0 / weight
+        self._last_finish[chat_id] = vfinish
+
+        job = _Job(chat_id, msg_id, priority, vfinish, next(self._seq), on_position)
+        heapq.heappush(self._heap, job)
+        self._dispatch()
+        self._notify_positions()
+        return job
+
+    def _unqueue(self, job):
+        if job in self._heap:
+            self._heap.remove(job)
+            heapq.heapify(self._heap)
+            self._notify_positions()
+
+    def _release_job(self, job):
+        if not job.holding: return  # Sin turno (en pausa o nunca concedido)
+        job.holding = False
+        self._release(job.chat_id)
+
+    def _release(self, chat_id):
+        self._total_running -= 1
+        self._running[chat_id] -= 1
+        if self._running[chat_id] <= 0:
+            del self._running[chat_id]
+        self._dispatch()
+        self._notify_positions()
+
+    def _dispatch(self):
+        """Concede turnos mientras haya hueco global, respetando el tope por chat."""
+        while self._heap and self._total_running < self.max_global:
+            candidate = None
+            for j in sorted(self._heap):
+                if self._running.get(j.chat_id, 0) < self.max_per_chat:
+                    candidate = j
+                    break
+            if candidate is None: return
+
+            self._heap.remove(candidate)
+            heapq.heapify(self._heap)
+            self._vclock = max(self._vclock, candidate.vfinish)
+            self._total_running += 1
+            self._running[candidate.chat_id] = self._running.get(candidate.chat_id, 0) + 1
+            candidate.holding = True
+            candidate.waiter.set_result(True)
+
+        # Sin backlog: reiniciar relojes virtuales para que no crezcan sin límite
+        if not self._heap and self._total_running == 0:
+            self._vclock = 0.0
+            self._last_finish.clear()
+
+    def _notify_positions(self):
+        for pos, j in enumerate(sorted(self._heap), start=1):
+            if j.on_position and j.last_pos != pos:
+                j.last_pos = pos
+                asyncio.create_task(self._safe_notify(j.on_position, pos))
+
+    @staticmethod
+    async def _safe_notify(cb, pos):
+        try: await cb(pos)
+        except Exception as e: print(f"⚠️ Scheduler notify error: {e}")
+
+
+# Instancia única del proceso
+scheduler = DownloadScheduler()
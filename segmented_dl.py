@@ -0,0 +1,317 @@
+import os
+import re
+import json
+import time
+import random
+import asyncio
+import aiohttp
+import threading
+from http_client import cookie_session
+from executors import run_in
+
+# --- MOTOR NATIVO SEGMENTADO (Python puro) ---
+# Descarga multi-conexión estilo aria2 para hosts sin aria2:
+# 1. Sondeo con Range (bytes=0-0) para saber tamaño y si el servidor acepta rangos.
+# 2. Archivo preasignado y N segmentos en paralelo escritos con os.pwrite en su offset
+#    (en el pool 'io' de executors: el disco no bloquea el loop del bot).
+# 3. Reintento por segmento con backoff; el resto de segmentos sigue corriendo.
+# 4. Sidecar JSON (<archivo>.segs.json) con el avance de cada segmento para reanudar.
+# 5. División adaptativa: el worker que termina le roba la mitad al segmento más lento.
+
+SEG_CONNECTIONS = int(os.environ.get("SEG_CONNECTIONS", 8))
+SEG_MIN_SPLIT = int(os.environ.get("SEG_MIN_SPLIT_MB", 4)) * 1024 * 1024
+SEG_RETRIES = int(os.environ.get("SEG_RETRIES", 5))
+CHUNK = 1024 * 1024
+SIDECAR_EVERY = 2.0  # segundos entre guardados del sidecar
+
+
+class SegmentedError(Exception):
+    pass
+
+
+class _Segment:
+    __slots__ = ('start', 'end', 'pos', 'active', 'speed')
+
+    def __init__(self, start, end, pos=None):
+        self.start = start
+        self.end = end          # inclusivo
+        self.pos = start if pos is None else pos
+        self.active = False
+        self.speed = 0.0        # EMA bytes/s
+
+    @property
+    def remaining(self):
+        return max(0, self.end - self.pos + 1)
+
+    def to_dict(self):
+        return {'start': self.start, 'end': self.end, 'pos': self.pos}
+
+
+class _FileWriter:
+    """
+    Escritura posicional. os.pwrite en POSIX; en Windows seek+write bajo lock.
+    write_at corre en hilos del pool 'io': close() espera las escrituras en curso (una
+    tarea cancelada no espera a su hilo) para no escribir en un fd ya cerrado o reutilizado.
+    """
+
+    def __init__(self, path, size):
+        flags = os.O_RDWR | os.O_CREAT | getattr(os, 'O_BINARY', 0)
+        self.fd = os.open(path, flags, 0o644)
+        self._lock = None if hasattr(os, 'pwrite') else threading.Lock()
+        self._cond = threading.Condition()
+        self._inflight = 0
+        if size and os.fstat(self.fd).st_size != size:
+            if hasattr(os, 'posix_fallocate'):
+                try: os.posix_fallocate(self.fd, 0, size)
+                except OSError: os.ftruncate(self.fd, size)
+            else:
+                os.ftruncate(self.fd, size)
+
+    def write_at(self, data, offset):
+        with self._cond:
+            if self.fd is None: return  # Cerrado (cancelación): descartar
+            self._inflight += 1
+        try:
+            if self._lock is None:
+                os.pwrite(self.fd, data, offset)
+            else:
+                with self._lock:
+                    os.lseek(self.fd, offset, os.SEEK_SET)
+                    os.write(self.fd, data)
+        finally:
+            with self._cond:
+                self._inflight -= 1
+                self._cond.notify_all()
+
+    def close(self):
+        with self._cond:
+            while self._inflight: self._cond.wait()
+            fd, self.fd = self.fd, None
+        if fd is None: return
+        try: os.close(fd)
+        except OSError: pass
+
+
+async def probe(url, headers=None, cookies=None, session=None):
+    """
+    Retorna (tamaño_total, acepta_rangos). tamaño 0 si el servidor no lo informa.
+    session: sesión con cookies de la descarga (si no, se usa una propia con `cookies`).
+    """
+    if session is None:
+        async with cookie_session(cookies) as session:
+            return await probe(url, headers, session=session)
+    h = dict(headers or {})
+    h['Range'] = 'bytes=0-0'
+    async with session.get(url, headers=h, allow_redirects=True) as resp:
+        if resp.status == 206:
+            m = re.search(r'/(\d+)$', resp.headers.get('Content-Range', ''))
+            if m: return int(m.group(1)), True
+        if resp.status in (200, 206):
+            return int(resp.headers.get('Content-Length', 0) or 0), False
+        raise SegmentedError(f"HTTP {resp.status}")
+
+
+class SegmentedDownloader:
+    def __init__(self, url, path, headers=None, cookies=None, connections=SEG_CONNECTIONS, on_progress=None, probed=None):
+        self.url = url
+        self.path = path
+        self.headers = headers or {}
+        self.cookies = cookies
+        self.connections = max(1, connections)
+        self.on_progress = on_progress
+        self.sidecar = path + ".segs.json"
+        self.size = 0
+        self.segments = []
+        self._writer = None
+        self._last_save = 0
+        self._t0 = 0
+        self._base = 0  # bytes ya presentes al empezar (reanudación), no cuentan para la velocidad
+        self._http = None  # cookie_session de esta descarga (un jar para todas sus conexiones)
+        self.probed = probed  # (tamaño, acepta_rangos) de un sondeo previo: no repetirlo
+
+    # --- ESTADO / REANUDACIÓN ---
+
+    def _load_sidecar(self):
+        try:
+            with open(self.sidecar, 'r') as f:
+                st = json.load(f)
+            if st.get('url') == self.url and st.get('size') == self.size and os.path.exists(self.path):
+                return [_Segment(s['start'], s['end'], s['pos']) for s in st['segments']]
+        except Exception:
+            pass
+        return None
+
+    def _save_sidecar(self, force=False):
+        now = time.time()
+        if not force and now - self._last_save < SIDECAR_EVERY: return
+        self._last_save = now
+        tmp = self.sidecar + ".tmp"
+        try:
+            with open(tmp, 'w') as f:
+                json.dump({'url': self.url, 'size': self.size, 'segments': [s.to_dict() for s in self.segments]}, f)
+            os.replace(tmp, self.sidecar)
+        except Exception as e:
+            print(f"⚠️ [SegDL] Sidecar error: {e}")
+
+    def _plan(self):
+        resumed = self._load_sidecar()
+        if resumed:
+            done = sum(s.pos - s.start for s in resumed)
+            print(f"♻️ [SegDL] Reanudando {os.path.basename(self.path)} ({done}/{self.size} bytes)")
+            return resumed
+        n = self.connections
+        # No abrir más conexiones que trozos mínimos razonables
+        n = max(1, min(n, self.size // SEG_MIN_SPLIT or 1))
+        step = self.size // n
+        segs = []
+        for i in range(n):
+            start = i * step
+            end = self.size - 1 if i == n - 1 else (i + 1) * step - 1
+            segs.append(_Segment(start, end))
+        return segs
+
+    @property
+    def downloaded(self):
+        return sum(s.pos - s.start for s in self.segments)
+
+    # --- DESCARGA ---
+
+    async def run(self):
+        async with cookie_session(self.cookies) as self._http:
+            return await self._run()
+
+    async def _run(self):
+        self.size, ranges = self.probed or await probe(self.url, self.headers, session=self._http)
+        self._t0 = time.time()
+
+        if not ranges or not self.size:
+            await self._single_stream()
+            return self.path
+
+        self.segments = self._plan()
+        self._base = self.downloaded
+        self._writer = await run_in('io', _FileWriter, self.path, self.size)
+        progress_task = asyncio.create_task(self._progress_loop())
+        try:
+            # No más workers que segmentos pendientes: los sobrantes solo partirían archivos pequeños
+            pending = sum(1 for s in self.segments if s.remaining)
+            workers = [asyncio.create_task(self._worker()) for _ in range(max(1, min(self.connections, pending)))]
+            try:
+                await asyncio.gather(*workers)
+            except BaseException:
+                for w in workers: w.cancel()
+                await asyncio.gather(*workers, return_exceptions=True)
+                raise
+            if any(s.remaining for s in self.segments):
+                raise SegmentedError("Descarga incompleta")
+        finally:
+            progress_task.cancel()
+            self._writer.close()
+            self._save_sidecar(force=True)
+
+        try: os.remove(self.sidecar)
+        except OSError: pass
+        await self._report()
+        return self.path
+
+    def _next_segment(self):
+        # 1. Segmentos pendientes sin worker (inicio o reanudación)
+        for s in self.segments:
+            if not s.active and s.remaining:
+                return s
+        # 2. Robo adaptativo: dividir el segmento activo con mayor tiempo restante estimado
+        victim, worst_eta = None, 0
+        for s in self.segments:
+            if s.active and s.remaining >= 2 * SEG_MIN_SPLIT:
+                eta = s.remaining / (s.speed or 1)
+                if eta > worst_eta:
+                    victim, worst_eta = s, eta
+        if victim is None: return None
+        mid = victim.pos + victim.remaining // 2
+        new = _Segment(mid, victim.end)
+        victim.end = mid - 1
+        self.segments.append(new)
+        return new
+
+    async def _worker(self):
+        while True:
+            seg = self._next_segment()
+            if seg is None: return
+            seg.active = True
+            try:
+                await self._fetch_segment(seg)
+            finally:
+                seg.active = False
+
+    async def _fetch_segment(self, seg):
+        for attempt in range(SEG_RETRIES + 1):
+            if not seg.remaining: return
+            h = dict(self.headers)
+            h['Range'] = f'bytes={seg.pos}-{seg.end}'
+            try:
+                timeout = aiohttp.ClientTimeout(total=None, sock_connect=20, sock_read=30)
+                async with self._http.get(self.url, headers=h, timeout=timeout) as resp:
+                    if resp.status != 206:
+                        raise SegmentedError(f"HTTP {resp.status} en rango {seg.pos}-{seg.end}")
+                    t_last = time.time()
+                    async for chunk in resp.content.iter_chunked(CHUNK):
+                        # El segmento pudo encogerse por un robo: no escribir más allá de end
+                        room = seg.end - seg.pos + 1
+                        if room <= 0: return
+                        if len(chunk) > room: chunk = chunk[:room]
+                        await run_in('io', self._writer.write_at, chunk, seg.pos)
+                        seg.pos += len(chunk)
+
+                        now = time.time()
+                        dt = now - t_last
+                        if dt > 0:
+                            inst = len(chunk) / dt
+                            seg.speed = inst if not seg.speed else 0.7 * seg.speed + 0.3 * inst
+                        t_last = now
+                        self._save_sidecar()
+                        if not seg.remaining: return
+                if not seg.remaining: return
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if attempt >= SEG_RETRIES:
+                    raise SegmentedError(f"Segmento {seg.start}-{seg.end} falló: {e}")
+                wait = min(30, 2 ** attempt) + random.random()
+                print(f"⚠️ [SegDL] Reintento {attempt + 1}/{SEG_RETRIES} ({seg.pos}-{seg.end}) en {wait:.1f}s: {e}")
+                await asyncio.sleep(wait)
+
+    async def _single_stream(self):
+        """Servidor sin rangos: una sola conexión (sin reanudación posible)."""
+        self.segments = [_Segment(0, max(0, self.size - 1))]
+        seg = self.segments[0]
+        timeout = aiohttp.ClientTimeout(total=None, sock_read=60)
+        last = 0
+        async with self._http.get(self.url, headers=self.headers, timeout=timeout) as resp:
+            if resp.status != 200:
+                raise SegmentedError(f"HTTP {resp.status}")
+            with open(self.path, 'wb') as f:
+                async for chunk in resp.content.iter_chunked(CHUNK):
+                    await run_in('io', f.write, chunk)
+                    seg.pos += len(chunk)
+                    if time.time() - last > 2:
+                        last = time.time()
+                        await self._report()
+        await self._report()
+
+    async def _progress_loop(self):
+        while True:
+            await asyncio.sleep(2)
+            await self._report()
+
+    async def _report(self):
+        if not self.on_progress: return
+        done = self.downloaded
+        elapsed = time.time() - self._t0
+        speed = (done - self._base) / elapsed if elapsed > 0 else 0
+        try: await self.on_progress(done, self.size, speed)
+        except Exception: pass
+
+
+async def download(url, path, headers=None, cookies=None, connections=SEG_CONNECTIONS, on_progress=None, probed=None):
+    """Atajo: descarga url en path con el motor segmentado. Retorna path o lanza SegmentedError."""
+    return await SegmentedDownloader(url, path, headers, cookies, connections, on_progress, probed).run()
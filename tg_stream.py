@@ -0,0 +1,245 @@
+import os
+import math
+import time
+import asyncio
+import inspect
+import aiohttp
+from pyrogram import raw, types, utils
+from pyrogram.session import Session
+from pyrogram.errors import FloodWait
+from http_client import cookie_session
+
+# --- STREAMING DIRECTO: HTTP -> TELEGRAM ---
+# Para enlaces directos con tamaño conocido, los bytes pasan por un buffer acotado
+# (cola de partes de 512 KB) directo a upload.SaveBigFilePart, sin tocar el disco.
+# La subida empieza con las primeras partes: tiempo total ~ max(bajada, subida)
+# en vez de bajada + subida, y el disco no se llena con el archivo completo.
+
+PART_SIZE = 512 * 1024
+BIG_FILE_MIN = 10 * 1024 * 1024     # Telegram exige SaveBigFilePart por encima de 10 MB
+STREAM_UPLOAD = os.environ.get("STREAM_UPLOAD", "1") == "1"
+STREAM_BUFFER_PARTS = int(os.environ.get("STREAM_BUFFER_PARTS", 32))   # 32 x 512 KB = 16 MB en RAM
+STREAM_WORKERS = int(os.environ.get("STREAM_WORKERS", 4))
+PART_RETRIES = 3
+UPLOAD_PARALLEL = int(os.environ.get("UPLOAD_PARALLEL", 3))  # partes subiendo a la vez (ParallelUploader)
+FLOOD_RETRIES = 5
+
+
+class StreamError(Exception):
+    pass
+
+
+def can_stream(size, limit):
+    """True si un archivo de `size` bytes puede ir por streaming (big file y sin necesidad de cortar)."""
+    return STREAM_UPLOAD and size and BIG_FILE_MIN < size <= limit
+
+
+async def _iter_parts(resp):
+    """Re-trocea el stream HTTP en partes exactas de PART_SIZE (la última puede ser menor)."""
+    buf = bytearray()
+    async for chunk in resp.content.iter_chunked(PART_SIZE):
+        buf.extend(chunk)
+        while len(buf) >= PART_SIZE:
+            yield bytes(buf[:PART_SIZE])
+            del buf[:PART_SIZE]
+    if buf:
+        yield bytes(buf)
+
+
+async def upload_from_url(client, url, size, file_name, headers=None, cookies=None, progress=None, progress_args=()):
+    """
+    Descarga `url` y la sube a Telegram al vuelo. Retorna raw.types.InputFileBig.
+    `size` debe ser el Content-Length real (Telegram necesita el total de partes por adelantado).
+    """
+    total_parts = int(math.ceil(size / PART_SIZE))
+    file_id = client.rnd_id()
+    queue = asyncio.Queue(STREAM_BUFFER_PARTS)
+    errors = []
+
+    session = Session(
+        client, await client.storage.dc_id(), await client.storage.auth_key(),
+        await client.storage.test_mode(), is_media=True
+    )
+
+    async def worker():
+        while True:
+            item = await queue.get()
+            if item is None: return
+            part, data = item
+            for attempt in range(PART_RETRIES):
+                try:
+                    await session.invoke(raw.functions.upload.SaveBigFilePart(
+                        file_id=file_id, file_part=part, file_total_parts=total_parts, bytes=data
+                    ))
+                    break
+                except Exception as e:
+                    if attempt == PART_RETRIES - 1:
+                        errors.append(e)
+                    else:
+                        await asyncio.sleep(1 + attempt)
+
+    workers = []
+    try:
+        await session.start()
+        workers = [asyncio.create_task(worker()) for _ in range(STREAM_WORKERS)]
+
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=20, sock_read=60)
+        sent = 0
+        part = 0
+        async with cookie_session(cookies) as http, http.get(url, headers=headers, timeout=timeout) as resp:
+            if resp.status != 200:
+                raise StreamError(f"HTTP {resp.status}")
+            async for data in _iter_parts(resp):
+                if errors: raise StreamError(f"Fallo subiendo parte: {errors[0]}")
+                await queue.put((part, data))  # Bloquea si el buffer está lleno (backpressure)
+                part += 1
+                sent += len(data)
+
+                if progress:
+                    r = progress(min(sent, size), size, *progress_args)
+                    if inspect.isawaitable(r): await r
+
+        if sent != size:
+            raise StreamError(f"Tamaño inesperado: {sent} de {size} bytes")
+        # Éxito: los workers suben lo que queda en la cola y terminan con el centinela
+        for _ in workers:
+            await queue.put(None)
+        await asyncio.gather(*workers)
+    finally:
+        # Cancelación o error: cortar los workers en vez de subir partes de un archivo descartado
+        for w in workers:
+            if not w.done(): w.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        await session.stop()
+
+    if errors:
+        raise StreamError(f"Fallo subiendo parte: {errors[0]}")
+    return raw.types.InputFileBig(id=file_id, parts=total_parts, name=file_name)
+
+
+async def send_uploaded(client, chat_id, input_file, file_name, caption="", as_video=False,
+                        width=0, height=0, duration=0, thumb=None, reply_to_message_id=None):
+    """Envía un archivo ya subido (InputFile/InputFileBig) como video o documento. Retorna Message."""
+    attributes = [raw.types.DocumentAttributeFilename(file_name=file_name)]
+    if as_video:
+        attributes.append(raw.types.DocumentAttributeVideo(
+            duration=int(duration or 0), w=int(width or 0), h=int(height or 0), supports_streaming=True
+        ))
+
+    media = raw.types.InputMediaUploadedDocument(
+        mime_type=client.guess_mime_type(file_name) or ("video/mp4" if as_video else "application/octet-stream"),
+        file=input_file,
+        force_file=None if as_video else True,
+        thumb=await client.save_file(thumb) if thumb else None,
+        attributes=attributes
+    )
+
+    r = await client.invoke(raw.functions.messages.SendMedia(
+        peer=await client.resolve_peer(chat_id),
+        media=media,
+        reply_to_msg_id=reply_to_message_id,
+        random_id=client.rnd_id(),
+        **await utils.parse_text_entities(client, caption, None, None)
+    ))
+    for i in r.updates:
+        if isinstance(i, (raw.types.UpdateNewMessage, raw.types.UpdateNewChannelMessage)):
+            return await types.Message._parse(client, i.message, {u.id: u for u in r.users}, {c.id: c for c in r.chats})
+    return None
+
+
+# --- SUBIDA PARALELA DE VARIAS PARTES ---
+# Un solo stream MTProto no llena el enlace de subida. Cada save_file abre su propia sesión
+# de media, así que con UPLOAD_PARALLEL partes a la vez el tiempo total baja casi en proporción.
+# Los mensajes se publican en orden: la parte i sale cuando su subida terminó y la i-1 ya salió.
+
+class FloodGate:
+    """Pausa compartida: si una subida recibe FloodWait, todas las del grupo esperan ese tiempo."""
+
+    def __init__(self):
+        self._until = 0.0
+
+    def hit(self, seconds):
+        self._until = max(self._until, time.time() + seconds + 1)
+
+    async def wait(self):
+        while True:
+            delay = self._until - time.time()
+            if delay <= 0: return
+            await asyncio.sleep(delay)
+
+    async def run(self, factory):
+        """Ejecuta factory() (corrutina nueva en cada intento), reintentando tras cada FloodWait."""
+        for attempt in range(FLOOD_RETRIES):
+            await self.wait()
+            try:
+                return await factory()
+            except FloodWait as e:
+                if attempt == FLOOD_RETRIES - 1: raise
+                print(f"⏳ [Upload] FloodWait {e.value}s (pausa compartida)")
+                self.hit(e.value)
+
+
+class ParallelUploader:
+    """
+    Sube varias partes con client.save_file en paralelo y las envía en orden.
+
+        up = ParallelUploader(client, total=size, progress=progreso, progress_args=(...))
+        up.submit(path, send, on_done=borrar)   # send(input_file) -> Message
+        results = await up.wait()               # resultado de send o excepción, por parte
+    """
+
+    def __init__(self, client, parallel=UPLOAD_PARALLEL, total=0, progress=None, progress_args=()):
+        self.client = client
+        self.gate = FloodGate()
+        self.total = total
+        self.progress = progress
+        self.progress_args = progress_args
+        self._sem = asyncio.Semaphore(max(1, parallel))
+        self._tasks = []
+        self._sizes = {}
+        self._done = {}
+
+    def submit(self, path, send, on_done=None):
+        """Encola `path`. on_done(path) se llama al final (bien o mal), p.ej. para borrar la parte."""
+        idx = len(self._tasks)
+        prev = self._tasks[-1] if self._tasks else None
+        try: self._sizes[idx] = os.path.getsize(path)
+        except OSError: self._sizes[idx] = 0
+        task = asyncio.create_task(self._run(idx, path, send, on_done, prev))
+        self._tasks.append(task)
+        return task
+
+    async def wait(self):
+        return await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def close(self):
+        """Cancela las partes pendientes (cancelación del usuario o error del productor)."""
+        for t in self._tasks:
+            if not t.done(): t.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def _run(self, idx, path, send, on_done, prev):
+        try:
+            async with self._sem:
+                input_file = await self.gate.run(
+                    lambda: self.client.save_file(path, progress=self._on_progress, progress_args=(idx,))
+                )
+            # Entrega ordenada: esperar a que la parte anterior se haya publicado (o fallado)
+            if prev: await asyncio.wait([prev])
+            return await self.gate.run(lambda: send(input_file))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"❌ [Upload] Parte {idx + 1} falló: {e}")
+            raise
+        finally:
+            if on_done:
+                try: on_done(path)
+                except Exception: pass
+
+    async def _on_progress(self, cur, tot, idx):
+        self._done[idx] = cur
+        if not self.progress: return
+        total = self.total or sum(self._sizes.values())
+        r = self.progress(min(sum(self._done.values()), total), total, *self.progress_args)
+        if inspect.isawaitable(r): await r
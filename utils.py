@@ -1,9 +1,9 @@
 import re
 import os
 import asyncio
-import requests
 from deep_translator import GoogleTranslator
 from config import COOKIE_MAP, TOOLS_DIR
+from executors import run_in
 
 def format_bytes(size):
     if not size or size <= 0: return "N/A"
@@ -41,9 +41,10 @@ async def resolver_url_facebook(url):
     # 1. Expandir redirecciones (fb.watch, etc)
     if "fb.watch" in url or "goo.gl" in url or "bit.ly" in url:
         try:
+            from http_client import get_session
             headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64)'}
-            loop = asyncio.get_running_loop()
-            url = await loop.run_in_executor(None, lambda: requests.head(url, allow_redirects=True, headers=headers).url)
+            async with get_session().head(url, allow_redirects=True, headers=headers) as resp:
+                url = str(resp.url)
         except: pass
 
     # 2. Extraer ID y formatear según tipo
@@ -83,8 +84,7 @@ def load_cookies_dict(filename):
 async def traducir_texto(texto):
     if not texto: return ""
     try:
-        loop = asyncio.get_running_loop()
-        return await loop.run_in_executor(None, lambda: GoogleTranslator(source='auto', target='es').translate(texto))
+        return await run_in('io', lambda: GoogleTranslator(source='auto', target='es').translate(texto))
     except Exception as e:
         print(f"Translation error: {e}")
         return texto
@@ -199,6 +199,7 @@ async def scan_channel_history(client, chat_id, limit=None):
                             'id': msg.id,
                             'chat': msg.chat.id
                         })
+                        hashtag_db.mark_dirty(tag_clean)
                 msgs_indexed += 1
                 
         save_tags()
@@ -211,19 +212,15 @@ async def scan_channel_history(client, chat_id, limit=None):
         traceback.print_exc()
         return 0
 
-def split_video_generic(input_path, mode, value):
+def calc_segment_time(input_path, mode, value):
     """
-    Divide video por: 'parts', 'min', 'sec'.
-    mode: 'parts' (value=num), 'min' (value=minutos), 'sec' (value=segundos)
+    Duración de cada parte (segundos) para split: 'parts' (value=num), 'min' o 'sec'.
+    Retorna 0 si no se puede calcular.
     """
     import subprocess
-    import glob
-    import os
-    
-    if not os.path.exists(input_path): return []
-    
+
     try:
-        # 1. Obtener duración
+        # Obtener duración
         cmd_dur = [
             "ffprobe", "-v", "error", "-show_entries", "format=duration",
             "-of", "default=noprint_wrappers=1:nokey=1", input_path
@@ -231,11 +228,10 @@ def split_video_generic(input_path, mode, value):
         duration = float(subprocess.check_output(cmd_dur).decode().strip())
     except Exception as e:
         print(f"Error duration: {e}")
-        return []
+        return 0
 
-    if duration < 1: return []
+    if duration < 1: return 0
 
-    # 2. Calcular segment_time
     segment_time = 0
     if mode == 'parts':
         segment_time = duration / int(value)
@@ -243,7 +239,21 @@ def split_video_generic(input_path, mode, value):
         segment_time = float(value) * 60
     elif mode == 'sec':
         segment_time = float(value)
-        
+    return max(0, segment_time)
+
+def split_video_generic(input_path, mode, value):
+    """
+    Divide video por: 'parts', 'min', 'sec'.
+    mode: 'parts' (value=num), 'min' (value=minutos), 'sec' (value=segundos)
+    """
+    import subprocess
+    import glob
+    import os
+    
+    if not os.path.exists(input_path): return []
+    
+    # 1-2. Calcular segment_time
+    segment_time = calc_segment_time(input_path, mode, value)
     if segment_time <= 0: return []
     
     # 3. Directorio salida
@@ -274,6 +284,121 @@ def split_video_generic(input_path, mode, value):
     print(f"📦 [DEBUG] Created {len(parts)} parts.")
     return parts
 
+class SplitPipeline:
+    """
+    Split en tubería: ffmpeg (muxer segment) corta en segundo plano y cada parte se entrega
+    en cuanto ffmpeg la cierra (se vigila el -segment_list), mientras la siguiente se escribe.
+
+        pipe = SplitPipeline(path, 'parts', 3)
+        async for part in pipe:
+            await subir(part)
+            pipe.release(part)   # borra la parte y libera hueco
+
+    Con max_in_flight partes entregadas sin liberar, ffmpeg se pausa (SIGSTOP/SIGCONT en
+    POSIX) para acotar el disco usado. En Windows no se puede pausar: solo se limita la entrega.
+    """
+
+    def __init__(self, input_path, mode, value, max_in_flight=2, poll=0.5):
+        base_dir = os.path.dirname(input_path)
+        self.base_name = os.path.splitext(os.path.basename(input_path))[0]
+        self.input_path = input_path
+        self.mode = mode
+        self.value = value
+        self.max_in_flight = max(1, max_in_flight)
+        self.poll = poll
+        self.base_dir = base_dir
+        self.list_path = os.path.join(base_dir, f"{self.base_name}_parts.csv")
+        self.output_pattern = os.path.join(base_dir, f"{self.base_name}_part%03d.mp4")
+        self.process = None
+        self.in_flight = set()
+        self.delivered = 0
+        self._paused = False
+
+    @property
+    def pid(self):
+        return self.process.pid if self.process else None
+
+    def release(self, path):
+        """El consumidor terminó con la parte: borrarla y reanudar ffmpeg si estaba pausado."""
+        self.in_flight.discard(path)
+        try: os.remove(path)
+        except OSError: pass
+        if self._paused and len(self.in_flight) < self.max_in_flight:
+            self._signal('SIGCONT')
+            self._paused = False
+
+    async def close(self):
+        """Detiene ffmpeg si sigue vivo (cancelación o error del consumidor) y borra partes pendientes."""
+        if self.process and self.process.returncode is None:
+            self._signal('SIGCONT')
+            try: self.process.kill()
+            except ProcessLookupError: pass
+            await self.process.wait()
+        for part in list(self.in_flight):
+            self.release(part)
+
+    def _signal(self, name):
+        import signal
+        sig = getattr(signal, name, None)
+        if sig is None or not self.process or self.process.returncode is not None: return False
+        try:
+            os.kill(self.process.pid, sig)
+            return True
+        except OSError:
+            return False
+
+    def _read_list(self):
+        try:
+            with open(self.list_path, 'r', encoding='utf-8') as f:
+                rows = [l.strip() for l in f if l.strip()]
+        except OSError:
+            return []
+        return [os.path.join(self.base_dir, r.split(',')[0]) for r in rows]
+
+    async def __aiter__(self):
+        segment_time = await run_in('cpu', lambda: calc_segment_time(self.input_path, self.mode, self.value))
+        if segment_time <= 0: return
+
+        try: os.remove(self.list_path)
+        except OSError: pass
+
+        cmd = [
+            "ffmpeg", "-y", "-v", "error", "-i", self.input_path, "-c", "copy",
+            "-f", "segment", "-segment_time", str(segment_time),
+            "-segment_list", self.list_path, "-segment_list_type", "csv",
+            "-reset_timestamps", "1", self.output_pattern
+        ]
+        print(f"✂️ [Pipeline] Split: {self.mode}={self.value} (seg_time={segment_time:.2f})")
+        self.process = await asyncio.create_subprocess_exec(*cmd)
+
+        try:
+            while True:
+                finished = self.process.returncode is not None
+                done = self._read_list()
+                for part in done[self.delivered:]:
+                    self.delivered += 1
+                    if not os.path.exists(part) or os.path.getsize(part) == 0: continue
+                    self.in_flight.add(part)
+                    if len(self.in_flight) >= self.max_in_flight and not finished and not self._paused:
+                        self._paused = self._signal('SIGSTOP')
+                    yield part
+                if finished: break
+                try: await asyncio.wait_for(self.process.wait(), timeout=self.poll)
+                except asyncio.TimeoutError: pass
+
+            if self.process.returncode != 0:
+                print(f"❌ [Pipeline] ffmpeg terminó con código {self.process.returncode}")
+        finally:
+            if self.process.returncode is None:
+                self._signal('SIGCONT')
+                try: self.process.kill()
+                except ProcessLookupError: pass
+                await self.process.wait()
+            try: os.remove(self.list_path)
+            except OSError: pass
+            print(f"📦 [Pipeline] Entregadas {self.delivered} partes.")
+
+
 def get_video_metadata(path):
     """Retorna (width, height) del video."""
     import subprocess
@@ -0,0 +1,92 @@
+import os
+import time
+import copy
+import asyncio
+import yt_dlp
+from utils import limpiar_url
+from executors import run_in
+
+# --- CACHE DE ANÁLISIS YT-DLP ---
+# `analyze` extrae la info del enlace y `procesar_descarga` volvía a extraerla al descargar.
+# Guardamos el info-dict (por URL normalizada con limpiar_url) durante YTDLP_INFO_TTL segundos
+# y la descarga lo reutiliza con process_ie_result (como --load-info-json), sin un segundo
+# viaje al extractor. Las extracciones corren en el pool 'extract' (executors.py), así una
+# ráfaga de enlaces no compite con descargas ni con Firestore.
+
+YTDLP_INFO_TTL = int(os.environ.get("YTDLP_INFO_TTL", 600))   # Las URLs firmadas de formatos caducan
+YTDLP_INFO_MAX = int(os.environ.get("YTDLP_INFO_MAX", 500))
+
+
+def _extract(url, opts):
+    with yt_dlp.YoutubeDL(opts) as ydl:
+        return ydl.sanitize_info(ydl.extract_info(url, download=False))
+
+
+class InfoCache:
+    def __init__(self, ttl=YTDLP_INFO_TTL, max_entries=YTDLP_INFO_MAX):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._data = {}       # {url_normalizada: (timestamp, info)}
+        self._inflight = {}   # {url_normalizada: Future} -> extracciones compartidas
+
+    def get(self, url):
+        """Info-dict vigente para url (copia, se puede modificar) o None."""
+        key = limpiar_url(url)
+        item = self._data.get(key)
+        if not item: return None
+        ts, info = item
+        if time.time() - ts > self.ttl:
+            self._data.pop(key, None)
+            return None
+        return copy.deepcopy(info)
+
+    def put(self, url, info):
+        if not info: return
+        if len(self._data) >= self.max_entries:
+            # Descartar el más antiguo (dict mantiene orden de inserción)
+            self._data.pop(next(iter(self._data)), None)
+        key = limpiar_url(url)
+        self._data.pop(key, None)
+        self._data[key] = (time.time(), info)
+
+    def invalidate(self, url):
+        self._data.pop(limpiar_url(url), None)
+
+    async def extract(self, url, opts):
+        """extract_info(download=False) con cache y en el pool de extracción. Peticiones simultáneas comparten resultado."""
+        cached = self.get(url)
+        if cached: return cached
+
+        key = limpiar_url(url)
+        fut = self._inflight.get(key)
+        if fut: return copy.deepcopy(await asyncio.shield(fut))
+
+        fut = asyncio.ensure_future(run_in('extract', _extract, url, dict(opts)))
+        self._inflight[key] = fut
+        try:
+            # shield: si el primer solicitante se cancela, los demás siguen esperando el resultado
+            info = await asyncio.shield(fut)
+        finally:
+            self._inflight.pop(key, None)
+        self.put(url, info)
+        return copy.deepcopy(info)
+
+
+def download_with_info(opts, url, info=None):
+    """
+    Descarga bloqueante (llamar en executor). Con info-dict cacheado usa process_ie_result;
+    si falla (URLs caducadas, etc.) vuelve a la extracción normal.
+    """
+    with yt_dlp.YoutubeDL(opts) as ydl:
+        if info and 'entries' not in info:
+            try:
+                ydl.process_ie_result(info, download=True)
+                return
+            except Exception as e:
+                print(f"⚠️ [yt-dlp] Info cacheada falló ({e}), re-extrayendo...")
+                info_cache.invalidate(url)
+        ydl.download([url])
+
+
+# Instancia única del proceso
+info_cache = InfoCache()
@@ -0,0 +1,158 @@
+import os
+import zlib
+import struct
+import asyncio
+import zipfile
+
+# --- ZIP INCREMENTAL (entradas a medida que llegan) ---
+# Antes el ZIP se armaba al final (cola serial tras la descarga), en el loop y con
+# ZIP_DEFLATED sobre JPG/WebP que ya vienen comprimidos (CPU tirada, ~0% de ahorro).
+# Ahora cada página se añade en cuanto se descarga, en el pool 'cpu', y las imágenes
+# van STORED (sin compresión); el resto de archivos sigue con DEFLATED.
+
+# Índice del ZIP Maestro: una línea "ruta\toffset\ttamaño\tmétodo" por entrada (ruta = capítulo/página.ext,
+# offset = inicio de la cabecera local). Se guarda junto al file_id para leer las páginas
+# directamente del stream de Telegram, sin bajar el ZIP entero ni extraerlo (ver iter_zip_pages).
+LOCAL_HEADER = struct.Struct('<4s2B4HL2L2H')  # 30 bytes, igual que zipfile.structFileHeader
+
+STORED_EXTS = {'.jpg', '.jpeg', '.png', '.webp', '.gif', '.avif', '.heic', '.zip', '.rar', '.7z', '.mp4', '.pdf'}
+
+
+def compress_type_for(path):
+    ext = os.path.splitext(path)[1].lower()
+    return zipfile.ZIP_STORED if ext in STORED_EXTS else zipfile.ZIP_DEFLATED
+
+
+class ZipBuilder:
+    """
+    Las entradas se encolan con feed(ruta) y un consumidor las escribe fuera del loop.
+    El nombre dentro del ZIP es la ruta relativa a base_dir.
+
+        z = ZipBuilder(zip_path, base_tmp).start()
+        await z.feed(page) ...
+        await z.finish()   # -> ruta, o None si no hubo entradas
+    """
+
+    def __init__(self, path, base_dir, max_pending=50):
+        self.path = path
+        self.base_dir = base_dir
+        self._queue = asyncio.Queue(max_pending)
+        self._zip = None
+        self._task = None
+        self.count = 0
+        self.index = []   # [(ruta, offset, tamaño comprimido, método)] en orden de escritura
+
+    def start(self):
+        self._zip = zipfile.ZipFile(self.path, 'w', zipfile.ZIP_DEFLATED)
+        self._task = asyncio.create_task(self._consume())
+        return self
+
+    async def feed(self, file_path):
+        if self._task.done():
+            await self._task  # Propaga el error del consumidor
+        await self._queue.put(file_path)
+
+    async def feed_folder(self):
+        """Encola todo lo que haya en base_dir (orden estable por carpeta y nombre)."""
+        for root, dirs, files in os.walk(self.base_dir):
+            dirs.sort()
+            for file in sorted(files):
+                await self.feed(os.path.join(root, file))
+
+    def _write(self, file_path):
+        arc_name = os.path.relpath(file_path, self.base_dir)
+        self._zip.write(file_path, arc_name, compress_type=compress_type_for(file_path))
+        info = self._zip.infolist()[-1]
+        self.index.append((info.filename, info.header_offset, info.compress_size, info.compress_type))
+        self.count += 1
+
+    async def _consume(self):
+        from executors import run_in
+        while True:
+            file_path = await self._queue.get()
+            if file_path is None: return
+            try:
+                await run_in('cpu', self._write, file_path)
+            except Exception as e:
+                print(f"⚠️ [ZIP] Entrada omitida ({os.path.basename(file_path)}): {e}")
+
+    async def finish(self):
+        from executors import run_in
+        await self._queue.put(None)
+        await self._task
+        await run_in('cpu', self._zip.close)
+        if not self.count:
+            try: os.remove(self.path)
+            except OSError: pass
+            return None
+        return self.path
+
+    async def abort(self):
+        if self._task and not self._task.done():
+            self._task.cancel()
+            try: await self._task
+            except BaseException: pass
+        if self._zip:
+            try: self._zip.close()
+            except Exception: pass
+        try: os.remove(self.path)
+        except OSError: pass
+
+
+def encode_index(entries):
+    return "\n".join(f"{name}\t{off}\t{size}\t{method}" for name, off, size, method in entries)
+
+
+def decode_index(text):
+    """Índice guardado -> lista de (ruta, offset, tamaño, método), o None si falta o está corrupto."""
+    if not text or not isinstance(text, str): return None
+    entries = []
+    try:
+        for line in text.split("\n"):
+            name, off, size, method = line.rsplit("\t", 3)
+            entries.append((name, int(off), int(size), int(method)))
+    except ValueError:
+        return None
+    return entries
+
+
+async def iter_zip_pages(chunks, index, dest_dir, base_offset=0):
+    """
+    Lee las entradas de `index` de un ZIP que llega como stream de bytes (`chunks`, empezando en
+    `base_offset` del archivo) y escribe cada una en dest_dir/ruta. Genera las rutas EN ORDEN de
+    offset a medida que se completan; en memoria solo queda la parte aún no consumida.
+    """
+    from executors import run_in
+
+    def write_entry(path, data, method):
+        if method == zipfile.ZIP_DEFLATED: data = zlib.decompress(data, -15)
+        elif method != zipfile.ZIP_STORED: raise zipfile.BadZipFile(f"Método {method} no soportado")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f: f.write(data)
+
+    entries = sorted(index, key=lambda e: e[1])
+    buf = bytearray()
+    pos = base_offset            # offset del archivo que corresponde a buf[0]
+    it = chunks.__aiter__()
+
+    async def fill(end):
+        # Lee del stream hasta que buf cubra [pos, end)
+        while pos + len(buf) < end:
+            try: chunk = await it.__anext__()
+            except StopAsyncIteration: raise zipfile.BadZipFile("ZIP truncado")
+            buf.extend(chunk)
+
+    for name, off, size, method in entries:
+        safe = os.path.normpath(name)
+        if safe.startswith('..') or os.path.isabs(safe): continue
+        await fill(off + LOCAL_HEADER.size)
+        head = LOCAL_HEADER.unpack_from(buf, off - pos)
+        if head[0] != zipfile.stringFileHeader: raise zipfile.BadZipFile(f"Cabecera inválida en {off}")
+        start = off + LOCAL_HEADER.size + head[10] + head[11]
+        await fill(start + size)
+        data = bytes(buf[start - pos:start - pos + size])
+        del buf[:start + size - pos]
+        pos = start + size
+        path = os.path.join(dest_dir, safe)
+        await run_in('io', write_entry, path, data, method)
+        yield path